@@ -11,6 +11,8 @@ from .util import db_find_ne
 from .util import db_find
 from .util import db_find_it_ne
 from .util import db_find_it
+from .util import db_find_batches
+from .util import db_find_raw_batches
 from .util import db_insert_ne
 from .util import db_insert
 from .util import db_bulk_update
@@ -21,12 +23,17 @@ from .util import db_insert_one
 from .util import db_remove
 from .util import db_force_remove
 from .util import db_distinct
+from .util import db_distinct_iter
 from .util import db_set_if_not_exists
 from .util import db_find_and_modify
 from .util import db_aggregate_iter
 from .util import db_aggregate
 from .util import db_aggregate_parse_results
+from .util import db_aggregate_parse_iter
 from .util import db_aggregate_parse_result
 from .util import db_max
+from .util import db_min
+from .util import db_max_many
+from .util import db_min_many
 
 name = "pyutil_mongo"
@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+"""Index advisor from the recorded query-shapes (as a hook of :py:mod:`pyutil_mongo.metrics`)
+
+The filters / sorts of the db-ops are recorded as shapes (equality-fields, sort-fields, range-fields).
+:py:meth:`analyze` explains the representative query of each shape,
+and compares the shapes with the indexes declared in MongoMap.ensure_index / ensure_unique_index:
+
+* missing: the shapes not served by the declared indexes (or explained as COLLSCAN),
+  with the suggested index in the equality-sort-range order.
+* unused: the declared indexes not serving any recorded shape.
+* redundant: the declared (non-unique) indexes which are the prefixes of the other declared indexes.
+"""
+import json
+import pprint
+import threading
+
+from . import cfg
+from . import metrics
+from . import util
+
+
+_lock = threading.Lock()
+_shapes = {}
+
+_RANGE_OPS = ('$gt', '$gte', '$lt', '$lte', '$ne', '$nin', '$exists', '$regex', '$not')
+
+_QUERY_PARAMS = ('key', 'query', 'query_key')
+
+# the key of db_max / db_min / db_max_many / db_min_many is the field, not the selection criteria.
+_QUERY_PARAMS_BY_OP = {
+    'db_max': ('query',),
+    'db_min': ('query',),
+    'db_max_many': ('query',),
+    'db_min_many': ('query',),
+}
+
+
+def enable():
+    """Enable recording the query-shapes
+    """
+    metrics.add_hook(_record)
+
+
+def disable():
+    """Disable recording the query-shapes
+    """
+    metrics.remove_hook(_record)
+
+
+def reset():
+    """Reset the recorded query-shapes
+    """
+    with _lock:
+        _shapes.clear()
+
+
+def get_query_shape(query, sort=None):
+    """Get the index-related shape of the query
+
+    Args:
+        query (dict): the selection criteria
+        sort (list, optional): [(key, direction)]
+
+    Returns:
+        (tuple, tuple, tuple): equality-fields, sort-fields, range-fields
+    """
+    eq_fields = set()
+    range_fields = set()
+    _parse_query(query or {}, eq_fields, range_fields)
+
+    sort_fields = tuple([key for key, _ in (sort or [])])
+    range_fields = range_fields - eq_fields - set(sort_fields)
+
+    return tuple(sorted(eq_fields)), sort_fields, tuple(sorted(range_fields))
+
+
+def analyze(is_explain=True):
+    """Analyze the recorded query-shapes with the declared indexes
+
+    Args:
+        is_explain (bool, optional): whether to explain the representative queries.
+
+    Returns:
+        dict: {missing, unused, redundant, suggested_ensure_index}
+    """
+    with _lock:
+        shapes = [dict(each) for each in _shapes.values()]
+
+    declared_indexes = _get_declared_indexes()
+
+    missing = []
+    used_index_keys = set()
+    for shape in shapes:
+        db_name, collection_name = shape['db_name'], shape['collection_name']
+        if is_explain:
+            shape['is_collscan'] = _is_collscan(db_name, collection_name, shape['query'], shape['sort'])
+
+        ns = _get_ns(db_name, collection_name)
+        serving_indexes = [each for each in declared_indexes.get(ns, []) if _is_serving(each['fields'], shape)]
+        for each in serving_indexes:
+            used_index_keys.add((ns, each['collection_name'], each['fields']))
+
+        if shape.get('is_collscan', None) is False:
+            continue
+        if serving_indexes and not shape.get('is_collscan', None):
+            continue
+
+        missing.append({
+            'db_name': db_name,
+            'collection_name': collection_name,
+            'count': shape['count'],
+            'eq_fields': list(shape['eq_fields']),
+            'sort_fields': list(shape['sort_fields']),
+            'range_fields': list(shape['range_fields']),
+            'is_collscan': shape.get('is_collscan', None),
+            'suggested_index': _get_suggested_index(shape),
+        })
+    missing.sort(key=lambda x: x['count'], reverse=True)
+
+    unused = []
+    redundant = []
+    for ns, indexes in declared_indexes.items():
+        for each in indexes:
+            if (ns, each['collection_name'], each['fields']) not in used_index_keys:
+                unused.append({'db_name': each['db_name'], 'collection_name': each['collection_name'], 'index': list(each['fields']), 'unique': each['unique']})
+
+            if each['unique']:
+                continue
+            for other in indexes:
+                if other is each or len(other['fields']) <= len(each['fields']):
+                    continue
+                if other['fields'][:len(each['fields'])] == each['fields']:
+                    redundant.append({'db_name': each['db_name'], 'collection_name': each['collection_name'], 'index': list(each['fields']), 'prefix_of': {'collection_name': other['collection_name'], 'index': list(other['fields'])}})
+                    break
+
+    suggested_ensure_index = {}
+    for each in missing:
+        if each['collection_name'] in suggested_ensure_index:
+            continue
+        suggested_ensure_index[each['collection_name']] = each['suggested_index']
+
+    return {
+        'missing': missing,
+        'unused': unused,
+        'redundant': redundant,
+        'suggested_ensure_index': suggested_ensure_index,
+    }
+
+
+def format_report(is_explain=True):
+    """Report of :py:meth:`analyze` as text
+
+    Args:
+        is_explain (bool, optional): whether to explain the representative queries.
+
+    Returns:
+        str: report
+    """
+    result = analyze(is_explain=is_explain)
+
+    lines = ['missing indexes:']
+    for each in result['missing']:
+        lines.append('  %s.%s: count: %s eq: %s sort: %s range: %s collscan: %s => %s' % (each['db_name'], each['collection_name'], each['count'], each['eq_fields'], each['sort_fields'], each['range_fields'], each['is_collscan'], each['suggested_index']))
+
+    lines.append('unused indexes:')
+    for each in result['unused']:
+        lines.append('  %s.%s: %s%s' % (each['db_name'], each['collection_name'], each['index'], ' (unique)' if each['unique'] else ''))
+
+    lines.append('redundant indexes:')
+    for each in result['redundant']:
+        lines.append('  %s.%s: %s is prefix of %s: %s' % (each['db_name'], each['collection_name'], each['index'], each['prefix_of']['collection_name'], each['prefix_of']['index']))
+
+    lines.append('suggested ensure_index:')
+    lines.append(pprint.pformat(result['suggested_ensure_index']))
+
+    return '\n'.join(lines)
+
+
+def _parse_query(query, eq_fields, range_fields):
+    """Parse the fields in the query into eq_fields / range_fields
+
+    Args:
+        query (dict): the selection criteria
+        eq_fields (set): equality-fields
+        range_fields (set): range-fields
+    """
+    for key, val in query.items():
+        if key in ('$and', '$or', '$nor'):
+            for each in val:
+                _parse_query(each, eq_fields, range_fields)
+            continue
+
+        if key.startswith('$'):
+            continue
+
+        if isinstance(val, dict) and val and all([each.startswith('$') for each in val.keys()]):
+            if any([each in _RANGE_OPS for each in val.keys()]):
+                range_fields.add(key)
+            else:
+                eq_fields.add(key)
+            continue
+
+        eq_fields.add(key)
+
+
+def _get_query_sort(op, params):
+    """Get the query / sort of the db-op
+
+    Args:
+        op (str): db-op
+        params (dict): params of the db-op
+
+    Returns:
+        (dict, list): query, sort. query is None if not a query.
+    """
+    if op in ('db_max', 'db_min') and not params.get('group_columns', None):
+        return params.get('query', None) or {}, [(params['key'], -1 if op == 'db_max' else 1)]
+
+    for param in _QUERY_PARAMS_BY_OP.get(op, _QUERY_PARAMS):
+        if param in params:
+            return params[param] or {}, []
+
+    pipe = params.get('pipe', None)
+    if not pipe:
+        return None, []
+
+    query = {}
+    sort = []
+    for stage in pipe:
+        if '$match' in stage and not query and not sort:
+            query = stage['$match']
+            continue
+        if '$sort' in stage and not sort:
+            sort = list(stage['$sort'].items())
+            continue
+        break
+
+    return query, sort
+
+
+def _record(event):
+    """Record the event from metrics
+
+    Args:
+        event (dict): event
+    """
+    # only the db-ops called directly (db_find => db_find_it is recorded once).
+    if event['type'] != 'op' or event['parent_op'] is not None:
+        return
+
+    params = event['params']
+    query, sort = _get_query_sort(event['op'], params)
+    if query is None or not isinstance(query, dict):
+        return
+
+    collection_name = event['collection_name']
+    db_name = params.get('db_name', None)
+    if db_name is None:
+        db_name = util._get_default_db(collection_name)
+    if db_name is None:
+        return
+
+    eq_fields, sort_fields, range_fields = get_query_shape(query, sort)
+    if not eq_fields and not sort_fields and not range_fields:
+        return
+
+    # the sorts in the different directions are in the different shapes (served by the different indexes).
+    sort_directions = tuple([direction for _, direction in sort])
+    key = (db_name, collection_name, eq_fields, sort_fields, range_fields, sort_directions)
+    with _lock:
+        shape = _shapes.get(key, None)
+        if shape is None:
+            shape = {'db_name': db_name, 'collection_name': collection_name, 'eq_fields': eq_fields, 'sort_fields': sort_fields, 'range_fields': range_fields, 'query': query, 'sort': sort, 'count': 0}
+            _shapes[key] = shape
+        shape['count'] += 1
+
+
+def _get_declared_indexes():
+    """Get the indexes declared in the mongo-maps, by the real collection.
+
+    Returns:
+        dict: {ns: [{db_name, collection_name, fields, unique}]}
+    """
+    result = {}
+    for db_name, val in cfg.config.items():
+        mongo_map = val['mongo_map']
+        for is_unique, ensure_index in [(False, mongo_map.ensure_index), (True, mongo_map.ensure_unique_index)]:
+            for collection_name, index in (ensure_index or {}).items():
+                fields = _get_index_fields(index)
+                ns = _get_ns(db_name, collection_name)
+                result.setdefault(ns, []).append({'db_name': db_name, 'collection_name': collection_name, 'fields': fields, 'unique': is_unique})
+
+    return result
+
+
+def _get_index_fields(index):
+    """Get the fields of the index in ensure_index
+
+    Args:
+        index (str / list): key or [(key, direction)]
+
+    Returns:
+        tuple: fields
+    """
+    if isinstance(index, str):
+        return (index,)
+
+    return tuple([each[0] if isinstance(each, (list, tuple)) else each for each in index])
+
+
+def _get_ns(db_name, collection_name):
+    """Get the real (mongo-db-name, collection-name) of the collection-name
+
+    Args:
+        db_name (str): db-name in config
+        collection_name (str): collection-name
+
+    Returns:
+        tuple: (hostname, mongo-db-name, real collection-name)
+    """
+    mongo_map = cfg.config[db_name]['mongo_map']
+
+    return (mongo_map.hostname, mongo_map.mongo_db_name, mongo_map.collection_map.get(collection_name, collection_name))
+
+
+def _is_serving(index_fields, shape):
+    """Whether the index serves the shape
+
+    The 1st field of the index is one of the equality-fields,
+    or the 1st sort-field / range-field if no equality-fields.
+
+    Args:
+        index_fields (tuple): fields of the index
+        shape (dict): shape
+
+    Returns:
+        bool: Description
+    """
+    eq_fields = shape['eq_fields']
+    if eq_fields:
+        return index_fields[0] in eq_fields
+
+    other_fields = shape['sort_fields'] + shape['range_fields']
+    if not other_fields:
+        return False
+
+    return index_fields[0] == other_fields[0]
+
+
+def _get_suggested_index(shape):
+    """Suggested index of the shape in the equality-sort-range order (with the directions of the sort).
+
+    Args:
+        shape (dict): shape
+
+    Returns:
+        list: [(key, direction)]
+    """
+    directions = dict(shape['sort'])
+
+    fields = []
+    for each in shape['eq_fields'] + shape['sort_fields'] + shape['range_fields']:
+        if each not in fields:
+            fields.append(each)
+
+    return [(each, directions.get(each, 1)) for each in fields]
+
+
+def _is_collscan(db_name, collection_name, query, sort):
+    """Whether the query is explained as COLLSCAN
+
+    Args:
+        db_name (str): db-name in config
+        collection_name (str): collection-name
+        query (dict): the selection criteria
+        sort (list): [(key, direction)]
+
+    Returns:
+        bool: None if not able to explain.
+    """
+    try:
+        cursor = cfg.config[db_name]['db'][collection_name].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explain_result = cursor.explain()
+        winning_plan = explain_result.get('queryPlanner', {}).get('winningPlan', None)
+        if winning_plan is None:
+            return None
+    except Exception as e:
+        cfg.logger.debug('advisor: unable to explain: collection: %s e: %s', collection_name, e)
+        return None
+
+    return 'COLLSCAN' in json.dumps(winning_plan, default=str)
@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+"""asyncio counterpart of :py:mod:`pyutil_mongo.util`
+
+The db-ops are the same as util (same (err, result), same cfg.config resolution and same restart semantics),
+run in a bounded thread-pool executor.
+
+Attributes:
+    max_workers (int): max workers of the default executor.
+    iter_batch_size (int): number of docs fetched from the iterator in each executor-call.
+"""
+import asyncio
+import concurrent.futures
+import functools
+import threading
+
+from . import util
+
+max_workers = 16
+iter_batch_size = 100
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def set_executor(executor=None, the_max_workers=None):
+    """Set the executor for the db-ops.
+
+    Args:
+        executor (concurrent.futures.Executor, optional): the executor, create a ThreadPoolExecutor if None.
+        the_max_workers (int, optional): max workers of the created ThreadPoolExecutor.
+    """
+    global _executor
+    global max_workers
+
+    if the_max_workers is not None:
+        max_workers = the_max_workers
+
+    with _executor_lock:
+        old_executor = _executor
+        _executor = executor
+
+    if old_executor is not None:
+        old_executor.shutdown(wait=False)
+
+
+def shutdown(wait=True):
+    """Shutdown the executor.
+
+    Args:
+        wait (bool, optional): wait for the pending db-ops.
+    """
+    global _executor
+
+    with _executor_lock:
+        old_executor = _executor
+        _executor = None
+
+    if old_executor is not None:
+        old_executor.shutdown(wait=wait)
+
+
+def _get_executor():
+    """Get the executor, create the default ThreadPoolExecutor if not set.
+
+    Returns:
+        concurrent.futures.Executor: executor
+    """
+    global _executor
+
+    if _executor is not None:
+        return _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='pyutil_mongo_aio')
+
+    return _executor
+
+
+async def _run(func, *args, **kwargs):
+    """Run func in the executor
+
+    Args:
+        func (function): Description
+        *args: Description
+        **kwargs: Description
+
+    Returns:
+        TYPE: result of func
+    """
+    loop = asyncio.get_running_loop()
+
+    return await loop.run_in_executor(_get_executor(), functools.partial(func, *args, **kwargs))
+
+
+class AsyncIterator(object):
+    """Async iterator over the (blocking) iterator from util.
+
+    The docs are fetched in batches of batch_size in the executor.
+
+    Attributes:
+        batch_size (int): number of docs in each fetch.
+    """
+
+    def __init__(self, it, batch_size=None):
+        self._it = iter(it)
+        self._buffer = []
+        self._idx = 0
+        self._is_end = False
+        self.batch_size = batch_size if batch_size else iter_batch_size
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._idx >= len(self._buffer):
+            if self._is_end:
+                raise StopAsyncIteration
+
+            self._buffer = await _run(self._fetch)
+            self._idx = 0
+            if not self._buffer:
+                raise StopAsyncIteration
+
+        result = self._buffer[self._idx]
+        self._idx += 1
+
+        return result
+
+    def _fetch(self):
+        results = []
+        for each in self._it:
+            results.append(each)
+            if len(results) >= self.batch_size:
+                return results
+
+        self._is_end = True
+
+        return results
+
+    async def to_list(self):
+        """Get all the remaining docs as list
+
+        Returns:
+            list: docs
+        """
+        return [each async for each in self]
+
+
+async def db_find_one_ne(collection_name, key, fields=None, db_name=None):
+    """See :py:meth:`pyutil_mongo.util.db_find_one_ne`
+    """
+    return await _run(util.db_find_one_ne, collection_name, key, fields=fields, db_name=db_name)
+
+
+async def db_find_one(collection_name, key, fields=None, db_name=None, retry_policy=None, is_raw=False):
+    """See :py:meth:`pyutil_mongo.util.db_find_one`
+    """
+    return await _run(util.db_find_one, collection_name, key, fields=fields, db_name=db_name, retry_policy=retry_policy, is_raw=is_raw)
+
+
+async def db_find_ne(collection_name, key=None, fields=None, db_name=None):
+    """See :py:meth:`pyutil_mongo.util.db_find_ne`
+    """
+    return await _run(util.db_find_ne, collection_name, key=key, fields=fields, db_name=db_name)
+
+
+async def db_find(collection_name, key=None, fields=None, db_name=None, retry_policy=None, is_raw=False):
+    """See :py:meth:`pyutil_mongo.util.db_find`
+    """
+    return await _run(util.db_find, collection_name, key=key, fields=fields, db_name=db_name, retry_policy=retry_policy, is_raw=is_raw)
+
+
+async def db_find_it_ne(collection_name, key=None, fields=None, with_id=False, db_name=None, batch_size=None):
+    """See :py:meth:`pyutil_mongo.util.db_find_it_ne`
+
+    Returns:
+        AsyncIterator: db-results
+    """
+    err, result = await db_find_it(collection_name, key=key, fields=fields, with_id=with_id, db_name=db_name, batch_size=batch_size)
+
+    return result
+
+
+async def db_find_it(collection_name, key=None, fields=None, with_id=False, db_name=None, is_raw=False, batch_size=None):
+    """See :py:meth:`pyutil_mongo.util.db_find_it`
+
+    Args:
+        batch_size (int, optional): number of docs fetched in each executor-call.
+
+    Returns:
+        (Error, AsyncIterator): db-results
+    """
+    err, result = await _run(util.db_find_it, collection_name, key=key, fields=fields, with_id=with_id, db_name=db_name, is_raw=is_raw)
+
+    return err, AsyncIterator(result, batch_size=batch_size)
+
+
+async def db_insert_ne(collection_name, val, db_name=None):
+    """See :py:meth:`pyutil_mongo.util.db_insert_ne`
+    """
+    return await _run(util.db_insert_ne, collection_name, val, db_name=db_name)
+
+
+async def db_insert(collection_name, val, db_name=None):
+    """See :py:meth:`pyutil_mongo.util.db_insert`
+    """
+    return await _run(util.db_insert, collection_name, val, db_name=db_name)
+
+
+async def db_bulk_update(collection_name, update_data, is_set=True, upsert=True, multi=True, db_name=None, chunk_size=None, max_workers=1):
+    """See :py:meth:`pyutil_mongo.util.db_bulk_update`
+    """
+    return await _run(util.db_bulk_update, collection_name, update_data, is_set=is_set, upsert=upsert, multi=multi, db_name=db_name, chunk_size=chunk_size, max_workers=max_workers)
+
+
+async def db_force_bulk_update(collection_name, update_data, is_set, upsert, multi, db_name=None, chunk_size=None, max_workers=1):
+    """See :py:meth:`pyutil_mongo.util.db_force_bulk_update`
+    """
+    return await _run(util.db_force_bulk_update, collection_name, update_data, is_set, upsert, multi, db_name=db_name, chunk_size=chunk_size, max_workers=max_workers)
+
+
+async def db_update(collection_name, key, val, is_set=True, upsert=True, multi=True, db_name=None, retry_policy=None):
+    """See :py:meth:`pyutil_mongo.util.db_update`
+    """
+    return await _run(util.db_update, collection_name, key, val, is_set=is_set, upsert=upsert, multi=multi, db_name=db_name, retry_policy=retry_policy)
+
+
+async def db_force_update(collection_name, key, val, is_set=True, upsert=True, multi=True, db_name=None, retry_policy=None):
+    """See :py:meth:`pyutil_mongo.util.db_force_update`
+    """
+    return await _run(util.db_force_update, collection_name, key, val, is_set=is_set, upsert=upsert, multi=multi, db_name=db_name, retry_policy=retry_policy)
+
+
+async def db_insert_one(collection_name, doc, db_name=None):
+    """See :py:meth:`pyutil_mongo.util.db_insert_one`
+    """
+    return await _run(util.db_insert_one, collection_name, doc, db_name=db_name)
+
+
+async def db_remove(collection_name, key, db_name=None):
+    """See :py:meth:`pyutil_mongo.util.db_remove`
+    """
+    return await _run(util.db_remove, collection_name, key, db_name=db_name)
+
+
+async def db_force_remove(collection_name, key=None, db_name=None):
+    """See :py:meth:`pyutil_mongo.util.db_force_remove`
+    """
+    return await _run(util.db_force_remove, collection_name, key=key, db_name=db_name)
+
+
+async def db_distinct(collection_name, distinct_key, query_key, fields=None, with_id=False, db_name=None, retry_policy=None):
+    """See :py:meth:`pyutil_mongo.util.db_distinct`
+    """
+    return await _run(util.db_distinct, collection_name, distinct_key, query_key, fields=fields, with_id=with_id, db_name=db_name, retry_policy=retry_policy)
+
+
+async def db_distinct_iter(collection_name, distinct_key, query_key, db_name=None, batch_size=None):
+    """See :py:meth:`pyutil_mongo.util.db_distinct_iter`
+
+    Returns:
+        (Error, AsyncIterator): db-distinct-results
+    """
+    err, result = await _run(util.db_distinct_iter, collection_name, distinct_key, query_key, db_name=db_name)
+
+    return err, AsyncIterator(result, batch_size=batch_size)
+
+
+async def db_set_if_not_exists(collection_name, key, val, fields=None, with_id=False, db_name=None, retry_policy=None):
+    """See :py:meth:`pyutil_mongo.util.db_set_if_not_exists`
+    """
+    return await _run(util.db_set_if_not_exists, collection_name, key, val, fields=fields, with_id=with_id, db_name=db_name, retry_policy=retry_policy)
+
+
+async def db_find_and_modify(collection_name, key, val, fields=None, with_id=False, is_set=True, upsert=True, multi=True, db_name=None):
+    """See :py:meth:`pyutil_mongo.util.db_find_and_modify`
+    """
+    return await _run(util.db_find_and_modify, collection_name, key, val, fields=fields, with_id=with_id, is_set=is_set, upsert=upsert, multi=multi, db_name=db_name)
+
+
+async def db_aggregate_iter(collection_name, pipe, db_name=None, retry_policy=None, batch_size=None):
+    """See :py:meth:`pyutil_mongo.util.db_aggregate_iter`
+
+    Args:
+        batch_size (int, optional): number of docs fetched in each executor-call.
+
+    Returns:
+        (Error, AsyncIterator): db-aggregate-results
+    """
+    err, result = await _run(util.db_aggregate_iter, collection_name, pipe, db_name=db_name, retry_policy=retry_policy)
+
+    return err, AsyncIterator(result, batch_size=batch_size)
+
+
+async def db_aggregate(collection_name, pipe, db_name=None, retry_policy=None):
+    """See :py:meth:`pyutil_mongo.util.db_aggregate`
+    """
+    return await _run(util.db_aggregate, collection_name, pipe, db_name=db_name, retry_policy=retry_policy)
+
+
+async def db_max(collection_name, key, query, group_columns=None, db_name=None):
+    """See :py:meth:`pyutil_mongo.util.db_max`
+    """
+    return await _run(util.db_max, collection_name, key, query, group_columns=group_columns, db_name=db_name)
+
+
+async def db_min(collection_name, key, query, group_columns=None, db_name=None):
+    """See :py:meth:`pyutil_mongo.util.db_min`
+    """
+    return await _run(util.db_min, collection_name, key, query, group_columns=group_columns, db_name=db_name)
+
+
+async def db_max_many(collection_name, key, query, group_columns=None, db_name=None):
+    """See :py:meth:`pyutil_mongo.util.db_max_many`
+    """
+    return await _run(util.db_max_many, collection_name, key, query, group_columns=group_columns, db_name=db_name)
+
+
+async def db_min_many(collection_name, key, query, group_columns=None, db_name=None):
+    """See :py:meth:`pyutil_mongo.util.db_min_many`
+    """
+    return await _run(util.db_min_many, collection_name, key, query, group_columns=group_columns, db_name=db_name)
+
+
+async def drop(collection_name, db_name=None):
+    """See :py:meth:`pyutil_mongo.util.drop`
+    """
+    return await _run(util.drop, collection_name, db_name=db_name)
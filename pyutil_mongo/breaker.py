@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""Restart-storm protection of the mongo-restarts from the db-ops in util.
+
+* Only the connection-level errors (ConnectionFailure / not-primary / shutdown) trigger the restarts,
+  the other errors (ex: validation errors) are returned without restarting.
+* The restarts are single-flight per db-name: the other threads failing at the same time do not restart again.
+  The restart is verified with ping (within ping_timeout_ms), and the failed restarts are backed-off exponentially.
+  After a successful restart, the db-name is not restarted again within min_interval
+  (the errors of the in-flight ops on the old client, or the not-primary errors in the election, do not restart again).
+* The circuit of the db-name is open after failure_threshold consecutive failed restarts:
+  the db-ops fail fast with CircuitOpenError until the backoff passes,
+  then the db-ops go through and the next connection-error probes the restart again.
+
+Attributes:
+    base_backoff (float): backoff (sec) after the 1st failed restart, doubled in each consecutive failure.
+    failure_threshold (int): number of the consecutive failed restarts to open the circuit.
+    max_backoff (float): max backoff (sec)
+    min_interval (float): min interval (sec) after a successful restart before the next restart of the db-name.
+    ping_timeout_ms (int): timeout (ms) of the ping verifying the restart.
+"""
+import threading
+import time
+
+import pymongo.errors
+
+from . import cfg
+
+
+base_backoff = 0.5
+failure_threshold = 5
+max_backoff = 30.0
+min_interval = 5.0
+ping_timeout_ms = 2000
+
+_lock = threading.Lock()
+_states = {}
+
+# OperationFailure codes of not-primary / shutdown / network.
+_CONNECTION_ERROR_CODES = set([
+    6,  # HostUnreachable
+    7,  # HostNotFound
+    89,  # NetworkTimeout
+    91,  # ShutdownInProgress
+    189,  # PrimarySteppedDown
+    10107,  # NotWritablePrimary
+    11600,  # InterruptedAtShutdown
+    11602,  # InterruptedDueToReplStateChange
+    13435,  # NotPrimaryNoSecondaryOk
+    13436,  # NotPrimaryOrSecondary
+])
+
+
+class CircuitOpenError(Exception):
+    """The circuit of the db-name is open (the db is down), the db-op is not sent.
+    """
+    pass
+
+
+def set_policy(the_failure_threshold=5, the_base_backoff=0.5, the_max_backoff=30.0, the_ping_timeout_ms=2000, the_min_interval=5.0):
+    """Set the policy of the backoff / circuit
+
+    Args:
+        the_failure_threshold (int, optional): number of the consecutive failed restarts to open the circuit.
+        the_base_backoff (float, optional): backoff (sec) after the 1st failed restart.
+        the_max_backoff (float, optional): max backoff (sec)
+        the_ping_timeout_ms (int, optional): timeout (ms) of the ping verifying the restart.
+        the_min_interval (float, optional): min interval (sec) after a successful restart before the next restart of the db-name.
+    """
+    global failure_threshold
+    global base_backoff
+    global max_backoff
+    global ping_timeout_ms
+    global min_interval
+
+    failure_threshold = the_failure_threshold
+    base_backoff = the_base_backoff
+    max_backoff = the_max_backoff
+    ping_timeout_ms = the_ping_timeout_ms
+    min_interval = the_min_interval
+
+
+def reset(db_name=None):
+    """Reset (close) the circuits
+
+    Args:
+        db_name (str, optional): db-name in config, None for all the db-names.
+    """
+    with _lock:
+        if db_name is None:
+            _states.clear()
+            return
+
+        _states.pop(db_name, None)
+
+
+def status():
+    """Status of the circuits
+
+    Returns:
+        dict: {db-name: {n_failures, is_open, is_restarting, retry_after}}
+    """
+    now = time.monotonic()
+    with _lock:
+        return {
+            db_name: {
+                'n_failures': state['n_failures'],
+                'is_open': _is_open(state, now),
+                'is_restarting': state['is_restarting'],
+                'retry_after': max(0.0, state['next_timestamp'] - now),
+            } for db_name, state in _states.items()
+        }
+
+
+def is_connection_error(e):
+    """Whether the error is connection-level (to restart mongo)
+
+    Args:
+        e (Exception): exception
+
+    Returns:
+        bool: Description
+    """
+    if isinstance(e, pymongo.errors.ConnectionFailure):
+        return True
+
+    if isinstance(e, pymongo.errors.OperationFailure) and e.code in _CONNECTION_ERROR_CODES:
+        return True
+
+    return False
+
+
+def check(db_name):
+    """Check the circuit of the db-name before the db-op
+
+    Args:
+        db_name (str): db-name in config
+
+    Returns:
+        Error: CircuitOpenError if the circuit is open.
+    """
+    if not _states:
+        return None
+
+    now = time.monotonic()
+    with _lock:
+        state = _states.get(db_name, None)
+        if state is None or not _is_open(state, now):
+            return None
+        n_failures = state['n_failures']
+        retry_after = state['next_timestamp'] - now
+
+    return CircuitOpenError('circuit open: db: %s n_failures: %s retry after: %.1f sec' % (db_name, n_failures, retry_after))
+
+
+def restart(db_name, collection_name):
+    """Restart mongo of the db-name (single-flight with backoff), verified with ping.
+
+    Args:
+        db_name (str): db-name in config
+        collection_name (str): collection-name
+
+    Returns:
+        bool: whether restarted in this call (False if restarting in the other threads, in the backoff or within min_interval).
+    """
+    now = time.monotonic()
+    with _lock:
+        state = _states.get(db_name, None)
+        if state is None:
+            state = {'n_failures': 0, 'next_timestamp': 0.0, 'is_restarting': False}
+            _states[db_name] = state
+
+        if state['is_restarting'] or now < state['next_timestamp']:
+            return False
+        state['is_restarting'] = True
+
+    err = None
+    try:
+        err = cfg.restart_mongo(collection_name=collection_name, db_name=db_name, is_ensure_index=False)
+        if not err:
+            err = cfg.ping(db_name, ping_timeout_ms)
+    except Exception as e:
+        err = e
+    finally:
+        with _lock:
+            state['is_restarting'] = False
+            if err:
+                state['n_failures'] += 1
+                state['next_timestamp'] = time.monotonic() + min(max_backoff, base_backoff * (2 ** (state['n_failures'] - 1)))
+            else:
+                state['n_failures'] = 0
+                state['next_timestamp'] = time.monotonic() + min_interval
+
+    if err:
+        cfg.logger.warning('mongo: restart failed: db: %s n_failures: %s e: %s', db_name, state['n_failures'], err)
+
+    return True
+
+
+def _is_open(state, now):
+    """Whether the circuit is open (with the lock acquired)
+
+    Args:
+        state (dict): state of the db-name
+        now (float): monotonic timestamp
+
+    Returns:
+        bool: Description
+    """
+    return state['n_failures'] >= failure_threshold and now < state['next_timestamp']
@@ -0,0 +1,729 @@
+# -*- coding: utf-8 -*-
+"""Read-through query result cache for db_find_one / db_find, and pipeline result cache for db_aggregate.
+
+The results are stored as BSON (isolated from the callers, and the bytes are the size-bound),
+keyed by the namespace (hostname, mongo-db-name, real collection-name), the op,
+and the canonicalized (BSON-encoded, with the sorted keys) selection criteria and resulting fields.
+
+The writes through util invalidate the entries of the namespace,
+and bump the version of the namespace so that the results of the queries started before the writes are not cached.
+
+The pipeline results are keyed by the sha256 of the BSON-encoded (namespace, pipeline).
+The identical pipelines running concurrently are run once (single-flight).
+With pipeline_dir, the results are also kept on disk (until the ttl, across the process restarts),
+the on-disk results are invalidated only by the writes in the same process.
+The pipelines with side-effects or random results ($out / $merge / $sample ...) are not cached,
+and the collections in $lookup / $unionWith do not invalidate the pipeline results (only the ttl).
+
+Attributes:
+    is_pipeline_invalidate (bool): whether the writes invalidate the pipeline results (or only the ttl).
+    pipeline_cache (QueryCache): the pipeline result cache, None if disabled.
+    pipeline_dir (str): directory of the on-disk pipeline results, None if not on disk.
+    query_cache (QueryCache): the query cache, None if disabled.
+"""
+import collections
+import copy
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+import bson
+
+
+query_cache = None
+
+pipeline_cache = None
+pipeline_dir = None
+is_pipeline_invalidate = True
+
+_inflight_lock = threading.Lock()
+_inflight = {}
+
+# stages with side-effects or random / server-state results.
+_UNCACHED_STAGES = ('$out', '$merge', '$sample', '$currentOp', '$collStats', '$indexStats', '$listSessions', '$planCacheStats')
+
+
+class QueryCache(object):
+    """LRU + TTL cache of the query results.
+
+    Attributes:
+        collection_ttl (dict): ttl (sec) by collection-name, override ttl. (None: not cached)
+        max_bytes (int): max total bytes of the cached results. (None: unbounded)
+        max_size (int): max number of entries.
+        ttl (float): default ttl (sec). (None: only the collections in collection_ttl are cached)
+    """
+
+    def __init__(self, max_size=1024, max_bytes=None, ttl=60.0, collection_ttl=None):
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.collection_ttl = collection_ttl if collection_ttl is not None else {}
+
+        self._lock = threading.Lock()
+        self._data = collections.OrderedDict()
+        self._keys_by_ns = {}
+        self._versions = {}
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get_ttl(self, collection_name):
+        """Get ttl of the collection-name
+
+        Args:
+            collection_name (str): collection-name
+
+        Returns:
+            float: ttl (sec), None if not cached.
+        """
+        return self.collection_ttl.get(collection_name, self.ttl)
+
+    def get_version(self, ns):
+        """Get the version of the namespace (bumped in each invalidation)
+
+        Args:
+            ns (tuple): namespace
+
+        Returns:
+            int: version
+        """
+        return self._versions.get(ns, 0)
+
+    def get(self, ns, key):
+        """Get the value
+
+        Args:
+            ns (tuple): namespace
+            key (tuple): cache-key
+
+        Returns:
+            (bool, object): is-hit, value
+        """
+        with self._lock:
+            entry = self._data.get(key, None)
+            if entry is None:
+                self.misses += 1
+                return False, None
+
+            expire_timestamp, val, n_bytes = entry
+            if expire_timestamp < time.monotonic():
+                self._remove(ns, key)
+                self.misses += 1
+                return False, None
+
+            self._data.move_to_end(key)
+            self.hits += 1
+
+        return True, val
+
+    def set(self, ns, key, val, n_bytes, ttl, version):
+        """Set the value
+
+        Args:
+            ns (tuple): namespace
+            key (tuple): cache-key
+            val (object): value
+            n_bytes (int): size of the value
+            ttl (float): ttl (sec)
+            version (int): version of the namespace when the value is queried.
+        """
+        if self.max_bytes is not None and n_bytes > self.max_bytes:
+            return
+
+        with self._lock:
+            if version != self._versions.get(ns, 0):
+                return
+
+            if key in self._data:
+                self._remove(ns, key)
+
+            self._data[key] = (time.monotonic() + ttl, val, n_bytes)
+            self._keys_by_ns.setdefault(ns, set()).add(key)
+            self._bytes += n_bytes
+
+            while len(self._data) > self.max_size or (self.max_bytes is not None and self._bytes > self.max_bytes):
+                each_key = next(iter(self._data))
+                self._remove(each_key[0], each_key)
+                self.evictions += 1
+
+    def invalidate(self, ns):
+        """Remove all the entries of the namespace
+
+        Args:
+            ns (tuple): namespace
+        """
+        with self._lock:
+            self._versions[ns] = self._versions.get(ns, 0) + 1
+
+            keys = self._keys_by_ns.get(ns, None)
+            if not keys:
+                return
+
+            for key in list(keys):
+                self._remove(ns, key)
+            self.invalidations += 1
+
+    def clear(self):
+        """Remove all the entries
+        """
+        with self._lock:
+            self._data.clear()
+            self._keys_by_ns.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Stats of the cache
+
+        Returns:
+            dict: hits, misses, evictions, invalidations, size, bytes
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'size': len(self._data),
+                'bytes': self._bytes,
+            }
+
+    def _remove(self, ns, key):
+        """Remove the entry (with the lock acquired)
+
+        Args:
+            ns (tuple): namespace
+            key (tuple): cache-key
+        """
+        entry = self._data.pop(key, None)
+        if entry is None:
+            return
+
+        self._bytes -= entry[2]
+
+        keys = self._keys_by_ns.get(ns, None)
+        if keys is None:
+            return
+        keys.discard(key)
+        if not keys:
+            del self._keys_by_ns[ns]
+
+
+def enable(max_size=1024, max_bytes=None, ttl=60.0, collection_ttl=None):
+    """Enable the query cache
+
+    Args:
+        max_size (int, optional): max number of entries.
+        max_bytes (int, optional): max total bytes of the cached results.
+        ttl (float, optional): default ttl (sec), None to cache only the collections in collection_ttl.
+        collection_ttl (dict, optional): ttl (sec) by collection-name.
+    """
+    global query_cache
+
+    query_cache = QueryCache(max_size=max_size, max_bytes=max_bytes, ttl=ttl, collection_ttl=collection_ttl)
+
+
+def disable():
+    """Disable the query cache
+    """
+    global query_cache
+
+    query_cache = None
+
+
+def stats():
+    """Stats of the query cache
+
+    Returns:
+        dict: stats, {} if disabled.
+    """
+    the_query_cache = query_cache
+    if the_query_cache is None:
+        return {}
+
+    return the_query_cache.stats()
+
+
+def get_version(ns):
+    """Get the version of the namespace, taken before the query and passed to set_result.
+
+    Args:
+        ns (tuple): namespace
+
+    Returns:
+        int: version
+    """
+    the_query_cache = query_cache
+    if the_query_cache is None:
+        return 0
+
+    return the_query_cache.get_version(ns)
+
+
+def get_result(ns, collection_name, op, key, fields):
+    """Get the cached result of the query
+
+    Args:
+        ns (tuple): namespace
+        collection_name (str): collection-name
+        op (str): db-op
+        key (dict): the selection criteria
+        fields (dict): resulting fields
+
+    Returns:
+        (bool, dict/list): is-hit, result
+    """
+    the_query_cache = query_cache
+    if the_query_cache is None or the_query_cache.get_ttl(collection_name) is None:
+        return False, None
+
+    cache_key = _get_cache_key(ns, op, key, fields)
+    if cache_key is None:
+        return False, None
+
+    is_hit, val = the_query_cache.get(ns, cache_key)
+    if not is_hit:
+        return False, None
+
+    if isinstance(val, list):
+        return True, [bson.decode(each) for each in val]
+
+    return True, bson.decode(val)
+
+
+def set_result(ns, collection_name, op, key, fields, result, version):
+    """Cache the result of the query
+
+    Args:
+        ns (tuple): namespace
+        collection_name (str): collection-name
+        op (str): db-op
+        key (dict): the selection criteria
+        fields (dict): resulting fields
+        result (dict/list): result
+        version (int): version of the namespace before the query.
+    """
+    the_query_cache = query_cache
+    if the_query_cache is None:
+        return
+
+    ttl = the_query_cache.get_ttl(collection_name)
+    if ttl is None:
+        return
+
+    cache_key = _get_cache_key(ns, op, key, fields)
+    if cache_key is None:
+        return
+
+    try:
+        if isinstance(result, list):
+            val = [bson.encode(each) for each in result]
+            n_bytes = sum([len(each) for each in val])
+        else:
+            val = bson.encode(result)
+            n_bytes = len(val)
+    except Exception:
+        return
+
+    the_query_cache.set(ns, cache_key, val, n_bytes, ttl, version)
+
+
+def invalidate(ns):
+    """Invalidate the cached results of the namespace
+
+    Args:
+        ns (tuple): namespace
+    """
+    the_query_cache = query_cache
+    if the_query_cache is not None:
+        the_query_cache.invalidate(ns)
+
+    the_pipeline_cache = pipeline_cache
+    if the_pipeline_cache is not None and is_pipeline_invalidate:
+        the_pipeline_cache.invalidate(ns)
+        _remove_pipeline_files(ns)
+
+
+def enable_pipeline(max_size=256, max_bytes=None, ttl=10.0, collection_ttl=None, is_invalidate=True, the_pipeline_dir=None):
+    """Enable the pipeline result cache
+
+    Args:
+        max_size (int, optional): max number of entries.
+        max_bytes (int, optional): max total bytes of the cached results.
+        ttl (float, optional): default ttl (sec), None to cache only the collections in collection_ttl.
+        collection_ttl (dict, optional): ttl (sec) by collection-name.
+        is_invalidate (bool, optional): whether the writes invalidate the pipeline results (or only the ttl).
+        the_pipeline_dir (str, optional): directory of the on-disk pipeline results.
+    """
+    global pipeline_cache
+    global pipeline_dir
+    global is_pipeline_invalidate
+
+    if the_pipeline_dir is not None:
+        os.makedirs(the_pipeline_dir, exist_ok=True)
+
+    pipeline_dir = the_pipeline_dir
+    is_pipeline_invalidate = is_invalidate
+    pipeline_cache = QueryCache(max_size=max_size, max_bytes=max_bytes, ttl=ttl, collection_ttl=collection_ttl)
+
+
+def disable_pipeline():
+    """Disable the pipeline result cache (the on-disk results are kept)
+    """
+    global pipeline_cache
+    global pipeline_dir
+
+    pipeline_cache = None
+    pipeline_dir = None
+
+
+def pipeline_stats():
+    """Stats of the pipeline result cache
+
+    Returns:
+        dict: stats, {} if disabled.
+    """
+    the_pipeline_cache = pipeline_cache
+    if the_pipeline_cache is None:
+        return {}
+
+    return the_pipeline_cache.stats()
+
+
+def run_pipeline(ns, collection_name, pipe, func):
+    """Get the cached result of the pipeline, or run func (once for the concurrent identical pipelines) and cache the result.
+
+    Args:
+        ns (tuple): namespace
+        collection_name (str): collection-name
+        pipe ([{}]): pipe in db-aggregate
+        func (function): func() => (Error, list), running the pipeline.
+
+    Returns:
+        (Error, list): db-aggregate-results
+    """
+    the_pipeline_cache = pipeline_cache
+    if the_pipeline_cache is None:
+        return func()
+
+    ttl = the_pipeline_cache.get_ttl(collection_name)
+    if ttl is None or not _is_cacheable_pipeline(pipe):
+        return func()
+
+    cache_key = _get_pipeline_key(ns, pipe)
+    if cache_key is None:
+        return func()
+
+    is_hit, val = the_pipeline_cache.get(ns, cache_key)
+    if is_hit:
+        return None, [bson.decode(each) for each in val]
+
+    with _inflight_lock:
+        flight = _inflight.get(cache_key, None)
+        is_leader = flight is None
+        if is_leader:
+            flight = {'is_done': threading.Event(), 'err': None, 'val': None, 'results': []}
+            _inflight[cache_key] = flight
+
+    if not is_leader:
+        flight['is_done'].wait()
+        if flight['err']:
+            return flight['err'], []
+        if flight['val'] is None:
+            return None, copy.deepcopy(flight['results'])
+        return None, [bson.decode(each) for each in flight['val']]
+
+    err = None
+    results = []
+    try:
+        version = the_pipeline_cache.get_version(ns)
+
+        # on-disk hit: the file is kept as is, cached in memory until the expiry of the file.
+        val, file_ttl = _get_pipeline_file(ns, cache_key)
+        if val is None:
+            err, results = func()
+        else:
+            results = [bson.decode(each) for each in val]
+            the_pipeline_cache.set(ns, cache_key, val, sum([len(each) for each in val]), min(ttl, file_ttl), version)
+
+        if not err and val is None:
+            val = _encode_results(results)
+            if val is not None:
+                the_pipeline_cache.set(ns, cache_key, val, sum([len(each) for each in val]), ttl, version)
+                _set_pipeline_file(ns, cache_key, val, ttl, version)
+
+        flight['err'], flight['val'], flight['results'] = err, val, results
+    except Exception as e:
+        flight['err'] = e
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(cache_key, None)
+        flight['is_done'].set()
+
+    return err, results
+
+
+def _is_cacheable_pipeline(pipe):
+    """Whether the pipeline is cacheable (without side-effects or random results)
+
+    Args:
+        pipe ([{}]): pipe in db-aggregate
+
+    Returns:
+        bool: Description
+    """
+    for stage in pipe:
+        if any([each in _UNCACHED_STAGES for each in stage.keys()]):
+            return False
+
+    return True
+
+
+def _get_pipeline_key(ns, pipe):
+    """Cache-key of the pipeline: sha256 of the BSON-encoded (namespace, pipeline)
+
+    Args:
+        ns (tuple): namespace
+        pipe ([{}]): pipe in db-aggregate
+
+    Returns:
+        tuple: cache-key, None if not able to be encoded.
+    """
+    try:
+        pipe_bytes = bson.encode({'ns': list(ns), 'pipe': pipe})
+    except Exception:
+        return None
+
+    return (ns, 'db_aggregate', hashlib.sha256(pipe_bytes).hexdigest())
+
+
+def _encode_results(results):
+    """Encode the results as BSON
+
+    Args:
+        results (list): results
+
+    Returns:
+        list: BSON of each result, None if not able to be encoded.
+    """
+    try:
+        return [bson.encode(each) for each in results]
+    except Exception:
+        return None
+
+
+def _get_pipeline_path(ns, cache_key):
+    """Path of the on-disk pipeline result: {pipeline_dir}/{ns-hash}-{pipeline-hash}.bson
+
+    Args:
+        ns (tuple): namespace
+        cache_key (tuple): cache-key
+
+    Returns:
+        str: path, None if not on disk.
+    """
+    the_pipeline_dir = pipeline_dir
+    if the_pipeline_dir is None:
+        return None
+
+    filename = '%s-%s.bson' % (_get_ns_hash(ns), cache_key[2]) if cache_key is not None else ''
+
+    return os.path.join(the_pipeline_dir, filename)
+
+
+def _get_ns_hash(ns):
+    return hashlib.sha256(repr(ns).encode('utf-8')).hexdigest()[:16]
+
+
+def _get_pipeline_file(ns, cache_key):
+    """Get the on-disk pipeline result (1st doc as the header {expire_timestamp}, followed by the results)
+
+    Args:
+        ns (tuple): namespace
+        cache_key (tuple): cache-key
+
+    Returns:
+        (list, float): BSON of each result and the remaining ttl (sec), None if not on disk or expired.
+    """
+    path = _get_pipeline_path(ns, cache_key)
+    if path is None:
+        return None, 0.0
+
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None, 0.0
+
+    try:
+        docs = bson.decode_all(data)
+    except Exception:
+        return None, 0.0
+
+    file_ttl = docs[0].get('expire_timestamp', 0) - time.time() if docs else 0.0
+    if file_ttl <= 0:
+        return None, 0.0
+
+    return [bson.encode(each) for each in docs[1:]], file_ttl
+
+
+def _set_pipeline_file(ns, cache_key, val, ttl, version):
+    """Set the on-disk pipeline result (written to a temp-file and renamed)
+
+    The version is checked and the temp-file is renamed with the lock of the pipeline cache,
+    so that the concurrent invalidation (bumping the version, then removing the files) is not undone.
+
+    Args:
+        ns (tuple): namespace
+        cache_key (tuple): cache-key
+        val (list): BSON of each result
+        ttl (float): ttl (sec)
+        version (int): version of the namespace before the pipeline.
+    """
+    path = _get_pipeline_path(ns, cache_key)
+    if path is None:
+        return
+
+    the_pipeline_cache = pipeline_cache
+    if the_pipeline_cache is None or the_pipeline_cache.get_version(ns) != version:
+        return
+
+    tmp_path = None
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(bson.encode({'expire_timestamp': time.time() + ttl}))
+            for each in val:
+                f.write(each)
+
+        with the_pipeline_cache._lock:
+            if the_pipeline_cache.get_version(ns) != version:
+                return
+            os.replace(tmp_path, path)
+            tmp_path = None
+    except OSError:
+        return
+    finally:
+        if tmp_path is not None:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+
+def _remove_pipeline_files(ns):
+    """Remove the on-disk pipeline results of the namespace
+
+    Args:
+        ns (tuple): namespace
+    """
+    the_pipeline_dir = pipeline_dir
+    if the_pipeline_dir is None:
+        return
+
+    prefix = _get_ns_hash(ns) + '-'
+    try:
+        filenames = os.listdir(the_pipeline_dir)
+    except OSError:
+        return
+
+    for filename in filenames:
+        if not filename.startswith(prefix):
+            continue
+        try:
+            os.remove(os.path.join(the_pipeline_dir, filename))
+        except OSError:
+            continue
+
+
+def _get_cache_key(ns, op, key, fields):
+    """Canonicalized cache-key: the BSON of the selection criteria and the resulting fields with the sorted keys
+    (BSON keeps the types of the query).
+
+    Args:
+        ns (tuple): namespace
+        op (str): db-op
+        key (dict): the selection criteria
+        fields (dict): resulting fields
+
+    Returns:
+        tuple: cache-key, None if not able to be encoded.
+    """
+    try:
+        query_bytes = bson.encode({'key': _canonicalize_query(key), 'fields': _canonicalize_fields(fields)})
+    except Exception:
+        return None
+
+    return (ns, op, query_bytes)
+
+
+def _canonicalize_query(query):
+    """Sort the keys of the selection criteria (and of the operators / the sub-queries),
+    the embedded documents to match exactly are kept in the order (the order matters in mongo).
+
+    Args:
+        query (dict): the selection criteria
+
+    Returns:
+        dict: canonicalized selection criteria
+    """
+    if not isinstance(query, dict):
+        return query
+
+    result = {}
+    for each_key in sorted(query.keys()):
+        val = query[each_key]
+        if each_key in ('$and', '$or', '$nor') and isinstance(val, list):
+            val = [_canonicalize_query(each) for each in val]
+        elif not each_key.startswith('$'):
+            val = _canonicalize_operators(val)
+        result[each_key] = val
+
+    return result
+
+
+def _canonicalize_operators(val):
+    """Sort the keys of the operators of the field ({'$gte': ..., '$lt': ...}), other values are kept.
+
+    Args:
+        val (object): value of the field in the selection criteria
+
+    Returns:
+        object: canonicalized value
+    """
+    if not isinstance(val, dict) or not val or not all([isinstance(each, str) and each.startswith('$') for each in val.keys()]):
+        return val
+
+    result = {}
+    for each_key in sorted(val.keys()):
+        each_val = val[each_key]
+        if each_key == '$elemMatch':
+            each_val = _canonicalize_query(each_val)
+        elif each_key == '$not':
+            each_val = _canonicalize_operators(each_val)
+        result[each_key] = each_val
+
+    return result
+
+
+def _canonicalize_fields(fields):
+    """Sort the keys of the resulting fields
+
+    Args:
+        fields (dict / list): resulting fields
+
+    Returns:
+        dict / list: canonicalized resulting fields
+    """
+    if isinstance(fields, dict):
+        return {each_key: fields[each_key] for each_key in sorted(fields.keys())}
+
+    if isinstance(fields, (list, tuple)):
+        return sorted(fields)
+
+    return fields
@@ -1,15 +1,30 @@
 # -*- coding: utf-8 -*-
 """
 Attributes:
+    clients (dict): shared MongoClient by client-key (url + ssl/cert + pool settings).
+    collection_db_map (dict): collection-name => db-name in config (None if the collection-name is ambiguous).
     config (dict): Description
+    index_max_workers (int): number of the collections creating indexes concurrently.
+    is_lazy (bool): whether the clients / collections are created lazily in the first use (in each process).
     logger (logging.Logger): Description
 """
 import logging
+import os
+import threading
+import concurrent.futures
 import pymongo
 
 
 logger = None
 config = {}
+clients = {}
+collection_db_map = {}
+index_max_workers = 8
+is_lazy = False
+
+_clients_lock = threading.Lock()
+_client_pids = {}
+_lazy_ensured_indexes = set()
 
 
 class MongoMap(object):
@@ -23,11 +38,16 @@ class MongoMap(object):
         ensure_index (None, optional): ensure-index
         ensure_unique_index (None, optional): ensure-unique-index
         hostname (str): hostname of the real mongo.
+        max_idle_time_ms (int, optional): max idle time (ms) of a connection in the pool.
+        max_pool_size (int, optional): max number of connections in the pool.
+        min_pool_size (int, optional): min number of connections in the pool.
         mongo_db_name (str, optional): real db-name in mongodb.
+        retry_policy (RetryPolicy, optional): retry policy of the reads / idempotent writes (see :py:mod:`pyutil_mongo.retry`).
         ssl (bool, optional): whether to use ssl
+        wait_queue_timeout_ms (int, optional): max time (ms) to wait for a connection from the pool.
     """
 
-    def __init__(self, collection_map: dict, ensure_index=None, ensure_unique_index=None, db_name="mongo", hostname="localhost:27017", mongo_db_name="test", ssl=False, cert=None, ca=None):
+    def __init__(self, collection_map: dict, ensure_index=None, ensure_unique_index=None, db_name="mongo", hostname="localhost:27017", mongo_db_name="test", ssl=False, cert=None, ca=None, max_pool_size=None, min_pool_size=None, max_idle_time_ms=None, wait_queue_timeout_ms=None, retry_policy=None):
         self.db_name = db_name
         self.hostname = hostname
         self.mongo_db_name = mongo_db_name
@@ -37,32 +57,96 @@ class MongoMap(object):
         self.ssl = ssl
         self.cert = cert
         self.ca = ca
+        self.max_pool_size = max_pool_size
+        self.min_pool_size = min_pool_size
+        self.max_idle_time_ms = max_idle_time_ms
+        self.wait_queue_timeout_ms = wait_queue_timeout_ms
+        self.retry_policy = retry_policy
+
+
+class LazyCollections(dict):
+    """Collections of the mongo-map (collection-name in the code: collection), created in the first use.
+
+    The client and the collections are re-created in the forked process (fork-safe),
+    and the indexes of the collection are ensured in the first use (once across the processes forked after that).
+    """
+
+    def __init__(self, mongo_map: MongoMap):
+        super().__init__({key: None for key in mongo_map.collection_map.keys()})
+        self._mongo_map = mongo_map
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def __getitem__(self, key):
+        if self._pid != os.getpid():
+            self._reset()
+
+        collection = dict.__getitem__(self, key)
+        if collection is not None:
+            return collection
+
+        with self._lock:
+            collection = dict.__getitem__(self, key)
+            if collection is not None:
+                return collection
+
+            mongo_map = self._mongo_map
+            logger.info('mongo (lazy): %s => %s', key, mongo_map.collection_map[key])
+            collection = _get_client(mongo_map)[mongo_map.mongo_db_name][mongo_map.collection_map[key]]
+            _ensure_lazy_collection_indexes(mongo_map, key, collection)
+            dict.__setitem__(self, key, collection)
 
+        return collection
 
-def init(the_logger: logging.Logger, mongo_maps: list):
+    def get(self, key, default=None):
+        if key not in self:
+            return default
+
+        return self[key]
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def _reset(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            for key in self.keys():
+                dict.__setitem__(self, key, None)
+            self._pid = os.getpid()
+
+
+def init(the_logger: logging.Logger, mongo_maps: list, the_is_lazy=False):
     """init
 
     Args:
         the_logger (logging.Logger): Description
         mongo_maps (list): list of MongoDB info
+        the_is_lazy (bool, optional): whether to create the clients / collections lazily in the first use (in each process).
 
     Returns:
         TYPE: Description
     """
     global logger
+    global is_lazy
 
     logger = the_logger
+    is_lazy = the_is_lazy
 
     return restart_mongo(mongo_maps=mongo_maps)
 
 
-def restart_mongo(collection_name="", db_name="", mongo_maps=None):
+def restart_mongo(collection_name="", db_name="", mongo_maps=None, is_ensure_index=True):
     """restarting mongo
 
     Args:
         collection_name (str, optional): collection-name
         db_name (str, optional): db-name
         mongo_maps (None, optional): mongo-maps
+        is_ensure_index (bool, optional): whether to ensure the indexes (False for reconnecting only).
 
     Returns:
         TYPE: Description
@@ -78,12 +162,38 @@ def restart_mongo(collection_name="", db_name="", mongo_maps=None):
     if len(mongo_maps) == 0:
         return
 
+    # rebuild the shared clients of the restarting mongo-maps only once.
+    # (the old clients are dropped without closing: they may still be in use by the in-flight ops
+    #  of the mongo-maps / threads sharing them, and are reclaimed by the garbage-collection.)
+    restarting_maps = [mongo_map for mongo_map in mongo_maps if collection_name != '' and mongo_map.db_name in config and _is_match_mongo_map(mongo_map, collection_name=collection_name, db_name=db_name)]
+    reset_client_keys = set([_get_client_key(mongo_map) for mongo_map in restarting_maps])
+    for client_key in reset_client_keys:
+        with _clients_lock:
+            clients.pop(client_key, None)
+            _client_pids.pop(client_key, None)
+
     errs = []
+    inited_maps = []
     for idx, mongo_map in enumerate(mongo_maps):
+        if not _is_match_mongo_map(mongo_map, collection_name=collection_name, db_name=db_name):
+            continue
         each_err = _init_mongo_map_core(mongo_map, collection_name=collection_name, db_name=db_name)
         if each_err:
             errs.append(each_err)
             logger.error('(%s/%s): e: %s', idx, len(mongo_maps), each_err)
+            continue
+        inited_maps.append(mongo_map)
+
+    # the other mongo-maps sharing the rebuilt clients.
+    restarting_db_names = set([mongo_map.db_name for mongo_map in restarting_maps])
+    for each_db_name, val in config.items():
+        if each_db_name in restarting_db_names or val['client_key'] not in reset_client_keys:
+            continue
+        mongo_map = val['mongo_map']
+        val['db'] = _new_collections(mongo_map)
+
+    if is_ensure_index and not is_lazy:
+        errs += _ensure_indexes(inited_maps)
 
     if not errs:
         return None
@@ -107,30 +217,169 @@ def _init_mongo_map_core(mongo_map: MongoMap, collection_name="", db_name=""):
     global config
     global logger
 
-    mongo_map_db_name, hostname, mongo_db_name, collection_map, ensure_index, ensure_unique_index = mongo_map.db_name, mongo_map.hostname, mongo_map.mongo_db_name, mongo_map.collection_map, mongo_map.ensure_index, mongo_map.ensure_unique_index
+    mongo_map_db_name, hostname, mongo_db_name = mongo_map.db_name, mongo_map.hostname, mongo_map.mongo_db_name
 
-    if db_name != '' and mongo_map_db_name != db_name:
-        return
-
-    if collection_name != '' and collection_name not in collection_map:
+    if not _is_match_mongo_map(mongo_map, collection_name=collection_name, db_name=db_name):
         return
 
     if collection_name == '' and mongo_map_db_name in config:
         return Exception('db already in config: db_name: %s config: %s', mongo_map_db_name, config[mongo_map_db_name])
 
-    if ensure_index is None:
-        ensure_index = {}
-
-    if ensure_unique_index is None:
-        ensure_unique_index = {}
+    _register_collection_db_map(mongo_map)
 
     # mongo_server_url
     mongo_server_url = 'mongodb://%s/%s' % (hostname, mongo_db_name)
 
-    # mongo-server-client
-    mongo_kwargs = {}
+    # config-by-db-name
+    config_by_db_name = {'mongo_map': mongo_map, 'db': {}, 'url': mongo_server_url, 'client_key': _get_client_key(mongo_map)}
+
+    # collection
+    config_by_db_name['db'] = _new_collections(mongo_map)
+
+    config[mongo_map_db_name] = config_by_db_name
+
+
+def _ensure_indexes(mongo_maps: list):
+    """Ensure the indexes of the mongo-maps, concurrently by the collections.
+
+    Args:
+        mongo_maps (list): mongo-maps
+
+    Returns:
+        list: errors
+    """
+    # index-specs by the real collection.
+    specs_by_collection = {}
+    for mongo_map in mongo_maps:
+        for is_unique, ensure_index in [(False, mongo_map.ensure_index), (True, mongo_map.ensure_unique_index)]:
+            if ensure_index is None:
+                continue
+            for key, val in ensure_index.items():
+                collection = config[mongo_map.db_name]['db'][key]
+                ns = (mongo_map.hostname, collection.full_name)
+                if ns not in specs_by_collection:
+                    specs_by_collection[ns] = (collection, [])
+                specs_by_collection[ns][1].append((key, val, is_unique))
+
+    if not specs_by_collection:
+        return []
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=index_max_workers) as executor:
+        results = list(executor.map(lambda each: _ensure_collection_indexes(*each), specs_by_collection.values()))
+
+    return [each for each in results if each]
+
+
+def _ensure_collection_indexes(collection, specs: list):
+    """Ensure the indexes of the collection, skipping the existing indexes (checked once with list_indexes).
+
+    Args:
+        collection (pymongo.collection.Collection): collection
+        specs (list): [(collection-name, index, is-unique)]
+
+    Returns:
+        Exception: error
+    """
+    try:
+        existing_indexes = set([(_normalize_index(list(each['key'].items())), bool(each.get('unique', False))) for each in collection.list_indexes()])
+
+        for key, val, is_unique in specs:
+            if (_normalize_index(val), is_unique) in existing_indexes:
+                logger.debug('ensure_index: exists: key: %s index: %s unique: %s', key, val, is_unique)
+                continue
+
+            logger.info('to ensure_index: key: %s unique: %s', key, is_unique)
+            if is_unique:
+                collection.create_index(val, background=True, unique=True)
+            else:
+                collection.create_index(val, background=True)
+            existing_indexes.add((_normalize_index(val), is_unique))
+    except Exception as e:
+        logger.error('unable to ensure_index: collection: %s e: %s', collection.full_name, e)
+        return e
+
+    return None
+
+
+def _ensure_lazy_collection_indexes(mongo_map: MongoMap, key: str, collection):
+    """Ensure the indexes of the collection in the first use (lazy mode).
+
+    Args:
+        mongo_map (MongoMap): Description
+        key (str): collection-name in the code
+        collection (pymongo.collection.Collection): collection
+    """
+    if (mongo_map.db_name, key) in _lazy_ensured_indexes:
+        return
+
+    specs = []
+    for is_unique, ensure_index in [(False, mongo_map.ensure_index), (True, mongo_map.ensure_unique_index)]:
+        if ensure_index is not None and key in ensure_index:
+            specs.append((key, ensure_index[key], is_unique))
+
+    if specs:
+        err = _ensure_collection_indexes(collection, specs)
+        if err:
+            return
+
+    _lazy_ensured_indexes.add((mongo_map.db_name, key))
+
+
+def _normalize_index(index):
+    """Normalize the index-spec as tuple of (key, direction)
+
+    Args:
+        index (str / list): key or [(key, direction)]
+
+    Returns:
+        tuple: ((key, direction))
+    """
+    if isinstance(index, str):
+        return ((index, 1),)
+
+    return tuple([(key, int(direction) if isinstance(direction, float) else direction) for key, direction in index])
+
+
+def _is_match_mongo_map(mongo_map: MongoMap, collection_name="", db_name=""):
+    """Whether the mongo-map is the target of the collection-name / db-name
+
+    Args:
+        mongo_map (MongoMap): Description
+        collection_name (str, optional): Description
+        db_name (str, optional): Description
+
+    Returns:
+        bool: Description
+    """
+    if db_name != '' and mongo_map.db_name != db_name:
+        return False
+
+    if collection_name != '' and collection_name not in mongo_map.collection_map:
+        return False
+
+    return True
+
+
+def _get_client_url_kwargs(mongo_map: MongoMap):
+    """Get the url and the kwargs of the MongoClient for the mongo-map
+
+    The db is not part of the url (so that mongo-maps with different mongo-db-names share the client),
+    except that the hostname includes the credentials without ssl, which authenticate against the db in the url.
+
+    Args:
+        mongo_map (MongoMap): Description
+
+    Returns:
+        (str, dict): url, kwargs
+    """
+    if '@' in mongo_map.hostname and not mongo_map.ssl:
+        url = 'mongodb://%s/%s' % (mongo_map.hostname, mongo_map.mongo_db_name)
+    else:
+        url = 'mongodb://%s/' % (mongo_map.hostname)
+
+    kwargs = {}
     if mongo_map.ssl:
-        mongo_kwargs.update({
+        kwargs.update({
             'ssl': True,
             'authSource': '$external',
             'authMechanism': 'MONGODB-X509',
@@ -138,35 +387,173 @@ def _init_mongo_map_core(mongo_map: MongoMap, collection_name="", db_name=""):
             'ssl_ca_certs': mongo_map.ca,
         })
 
-    mongo_server_client = pymongo.MongoClient(
-        mongo_server_url,
-        **mongo_kwargs,
-    )[mongo_db_name]
+    pool_kwargs = {
+        'maxPoolSize': mongo_map.max_pool_size,
+        'minPoolSize': mongo_map.min_pool_size,
+        'maxIdleTimeMS': mongo_map.max_idle_time_ms,
+        'waitQueueTimeoutMS': mongo_map.wait_queue_timeout_ms,
+    }
+    kwargs.update({key: val for key, val in pool_kwargs.items() if val is not None})
 
-    # config-by-db-name
-    config_by_db_name = {'mongo_map': mongo_map, 'db': {}, 'url': mongo_server_url}
+    return url, kwargs
 
-    # collection
-    for (key, val) in collection_map.items():
+
+def _get_client_key(mongo_map: MongoMap):
+    """Get the key of the shared client in clients
+
+    Args:
+        mongo_map (MongoMap): Description
+
+    Returns:
+        tuple: client-key
+    """
+    url, kwargs = _get_client_url_kwargs(mongo_map)
+
+    return (url, tuple(sorted(kwargs.items())))
+
+
+def _get_client(mongo_map: MongoMap):
+    """Get the shared MongoClient of the mongo-map, create one if not exists.
+
+    Args:
+        mongo_map (MongoMap): Description
+
+    Returns:
+        pymongo.MongoClient: client
+    """
+    client_key = _get_client_key(mongo_map)
+    pid = os.getpid()
+
+    client = clients.get(client_key, None)
+    if client is not None and _client_pids.get(client_key, None) == pid:
+        return client
+
+    with _clients_lock:
+        client = clients.get(client_key, None)
+        if client is not None and _client_pids.get(client_key, None) == pid:
+            return client
+
+        # the client from the parent process is not used (nor closed) in the forked process.
+        url, kwargs = _get_client_url_kwargs(mongo_map)
+        logger.info('mongo: new client: url: %s', url)
+        client = pymongo.MongoClient(
+            url,
+            **kwargs,
+        )
+        clients[client_key] = client
+        _client_pids[client_key] = pid
+
+    return client
+
+
+def ping(db_name, timeout_ms):
+    """Ping the mongo of the db-name with a short-lived client
+
+    The shared client is not used, so that the ping fails within timeout_ms
+    instead of the server-selection-timeout of the shared client.
+
+    Args:
+        db_name (str): db-name in config
+        timeout_ms (int): server-selection / connect / socket timeout (ms)
+
+    Returns:
+        Error: Description
+    """
+    val = config.get(db_name, None)
+    if val is None:
+        return Exception('no db: %s' % (db_name))
+
+    url, kwargs = _get_client_url_kwargs(val['mongo_map'])
+    kwargs.update({
+        'serverSelectionTimeoutMS': timeout_ms,
+        'connectTimeoutMS': timeout_ms,
+        'socketTimeoutMS': timeout_ms,
+    })
+
+    client = None
+    try:
+        client = pymongo.MongoClient(url, **kwargs)
+        client.admin.command('ping')
+    except Exception as e:
+        return e
+    finally:
+        if client is not None:
+            client.close()
+
+    return None
+
+
+def _new_collections(mongo_map: MongoMap):
+    """New collections of the mongo-map, LazyCollections if is_lazy.
+
+    Args:
+        mongo_map (MongoMap): Description
+
+    Returns:
+        dict: collection-name in the code: collection
+    """
+    if is_lazy:
+        return LazyCollections(mongo_map)
+
+    return _get_collections(mongo_map, _get_client(mongo_map)[mongo_map.mongo_db_name])
+
+
+def _get_collections(mongo_map: MongoMap, mongo_server_client):
+    """Get the collections in the collection-map
+
+    Args:
+        mongo_map (MongoMap): Description
+        mongo_server_client (pymongo.database.Database): Description
+
+    Returns:
+        dict: collection-name in the code: collection
+    """
+    collections = {}
+    for (key, val) in mongo_map.collection_map.items():
         logger.info('mongo: %s => %s', key, val)
-        config_by_db_name['db'][key] = mongo_server_client[val]
+        collections[key] = mongo_server_client[val]
 
-    # enure index
-    for key, val in ensure_index.items():
-        logger.info('to ensure_index: key: %s', key)
-        config_by_db_name['db'][key].create_index(val, background=True)
+    return collections
 
-    # enure unique index
-    for key, val in ensure_unique_index.items():
-        logger.info('to ensure_unique_index: key: %s', key)
-        config_by_db_name['db'][key].create_index(val, background=True, unique=True)
 
-    config[mongo_map_db_name] = config_by_db_name
+def _register_collection_db_map(mongo_map: MongoMap):
+    """Register the collection-names of the mongo-map in collection_db_map.
+
+    The collection-name existing in more than 1 db is ambiguous (None),
+    and requires the db-name explicitly.
+
+    Args:
+        mongo_map (MongoMap): Description
+    """
+    for key in mongo_map.collection_map.keys():
+        if key not in collection_db_map:
+            collection_db_map[key] = mongo_map.db_name
+            continue
+
+        each_db_name = collection_db_map[key]
+        if each_db_name is None or each_db_name == mongo_map.db_name:
+            continue
+
+        logger.warning('mongo: ambiguous collection: %s in db: (%s, %s), requires db_name', key, each_db_name, mongo_map.db_name)
+        collection_db_map[key] = None
 
 
 def clean():
-    """Reset config
+    """Reset config and close the clients
     """
     global config
+    global clients
+    global collection_db_map
+    global is_lazy
+
+    for client_key, client in clients.items():
+        if _client_pids.get(client_key, None) != os.getpid():
+            continue
+        client.close()
 
     config = {}
+    clients = {}
+    collection_db_map = {}
+    is_lazy = False
+    _client_pids.clear()
+    _lazy_ensured_indexes.clear()
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""Columnar results of db_find / db_aggregate, without the intermediate list of dicts.
+
+Given the schema [(field, dtype)], the docs are streamed from the cursor (in batches of batch_size)
+and the (dotted) fields are written directly into the columns:
+
+* :py:meth:`db_find_columns` / :py:meth:`db_aggregate_columns`: NumPy masked-arrays,
+  preallocated (n_docs or batch_size) and grown by doubling, masked where the field is missing or None.
+* :py:meth:`db_find_record_batches` / :py:meth:`db_aggregate_record_batches`: Arrow record-batches
+  of batch_size rows, null where the field is missing or None.
+
+numpy / pyarrow are optional (pip install pyutil_mongo[columnar] / pyutil_mongo[arrow]).
+"""
+from . import util
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+_MISSING = object()
+
+
+def db_find_columns(collection_name, schema, key=None, n_docs=None, batch_size=10000, db_name=None):
+    """Find data into NumPy (masked) arrays
+
+    Args:
+        collection_name (str): collection-name
+        schema ([(field, dtype)]): (dotted) fields and the NumPy dtypes.
+        key (dict, optional): the selection criteria
+        n_docs (int, optional): expected number of docs to preallocate.
+        batch_size (int, optional): batch-size of the cursor.
+        db_name (str, optional): db-name in config
+
+    Returns:
+        (Error, dict): {field: numpy.ma.MaskedArray}
+    """
+    if numpy is None:
+        return Exception('numpy is not installed'), {}
+
+    err, db_result_it = util.db_find_it(collection_name, key, _get_fields(schema), db_name=db_name)
+    if err:
+        return err, {}
+
+    return _to_columns(db_result_it, schema, n_docs, batch_size)
+
+
+def db_aggregate_columns(collection_name, pipe, schema, n_docs=None, batch_size=10000, db_name=None):
+    """db-aggregate into NumPy (masked) arrays
+
+    Args:
+        collection_name (str): collection-name
+        pipe ([{}]): pipe in db-aggregate
+        schema ([(field, dtype)]): (dotted) fields and the NumPy dtypes.
+        n_docs (int, optional): expected number of docs to preallocate.
+        batch_size (int, optional): batch-size of the cursor.
+        db_name (str, optional): db-name in config
+
+    Returns:
+        (Error, dict): {field: numpy.ma.MaskedArray}
+    """
+    if numpy is None:
+        return Exception('numpy is not installed'), {}
+
+    err, db_result_it = util.db_aggregate_iter(collection_name, pipe, db_name=db_name)
+    if err:
+        return err, {}
+
+    return _to_columns(db_result_it, schema, n_docs, batch_size)
+
+
+def db_find_record_batches(collection_name, schema, key=None, batch_size=10000, db_name=None):
+    """Find data as Arrow record-batches
+
+    Args:
+        collection_name (str): collection-name
+        schema ([(field, type)]): (dotted) fields and the Arrow types (pyarrow.DataType or alias as 'int64' / 'string').
+        key (dict, optional): the selection criteria
+        batch_size (int, optional): number of rows in each record-batch.
+        db_name (str, optional): db-name in config
+
+    Yields:
+        (Error, pyarrow.RecordBatch): record-batch, the iteration stops after the error.
+    """
+    if pyarrow is None:
+        yield Exception('pyarrow is not installed'), None
+        return
+
+    err, db_result_it = util.db_find_it(collection_name, key, _get_fields(schema), db_name=db_name)
+    if err:
+        yield err, None
+        return
+
+    yield from _to_record_batches(db_result_it, schema, batch_size)
+
+
+def db_aggregate_record_batches(collection_name, pipe, schema, batch_size=10000, db_name=None):
+    """db-aggregate as Arrow record-batches
+
+    Args:
+        collection_name (str): collection-name
+        pipe ([{}]): pipe in db-aggregate
+        schema ([(field, type)]): (dotted) fields and the Arrow types (pyarrow.DataType or alias as 'int64' / 'string').
+        batch_size (int, optional): number of rows in each record-batch.
+        db_name (str, optional): db-name in config
+
+    Yields:
+        (Error, pyarrow.RecordBatch): record-batch, the iteration stops after the error.
+    """
+    if pyarrow is None:
+        yield Exception('pyarrow is not installed'), None
+        return
+
+    err, db_result_it = util.db_aggregate_iter(collection_name, pipe, db_name=db_name)
+    if err:
+        yield err, None
+        return
+
+    yield from _to_record_batches(db_result_it, schema, batch_size)
+
+
+def _get_fields(schema):
+    """Get the projection of the schema
+
+    Args:
+        schema ([(field, dtype)]): schema
+
+    Returns:
+        dict: resulting fields
+    """
+    fields = {field: True for field, _ in schema}
+    if '_id' not in fields:
+        fields['_id'] = False
+
+    return fields
+
+
+def _to_columns(db_result_it, schema, n_docs, batch_size):
+    """Write the docs into the preallocated columns
+
+    Args:
+        db_result_it (iterator): docs
+        schema ([(field, dtype)]): schema
+        n_docs (int): expected number of docs to preallocate.
+        batch_size (int): batch-size of the cursor.
+
+    Returns:
+        (Error, dict): {field: numpy.ma.MaskedArray}
+    """
+    if not schema:
+        return Exception('no schema'), {}
+
+    if hasattr(db_result_it, 'batch_size'):
+        db_result_it.batch_size(batch_size)
+
+    capacity = max(n_docs or batch_size, 1)
+    datas = [numpy.zeros(capacity, dtype=dtype) for _, dtype in schema]
+    masks = [numpy.zeros(capacity, dtype=bool) for _ in schema]
+
+    idx = 0
+    try:
+        for each in db_result_it:
+            if idx >= capacity:
+                capacity *= 2
+                datas = [_grow(data, capacity) for data in datas]
+                masks = [_grow(mask, capacity) for mask in masks]
+
+            for (field, _), data, mask in zip(schema, datas, masks):
+                val = util._get_value(each, field, _MISSING)
+                if val is _MISSING or val is None:
+                    mask[idx] = True
+                    continue
+                data[idx] = val
+            idx += 1
+    except Exception as e:
+        return e, {}
+    finally:
+        if hasattr(db_result_it, 'close'):
+            db_result_it.close()
+
+    return None, {field: numpy.ma.MaskedArray(data[:idx], mask=mask[:idx]) for (field, _), data, mask in zip(schema, datas, masks)}
+
+
+def _grow(data, capacity):
+    """Grow the array to the capacity
+
+    Args:
+        data (numpy.ndarray): array
+        capacity (int): new capacity
+
+    Returns:
+        numpy.ndarray: array
+    """
+    result = numpy.zeros(capacity, dtype=data.dtype)
+    result[:len(data)] = data
+
+    return result
+
+
+def _to_record_batches(db_result_it, schema, batch_size):
+    """Write the docs into the record-batches
+
+    Args:
+        db_result_it (iterator): docs
+        schema ([(field, type)]): schema
+        batch_size (int): number of rows in each record-batch.
+
+    Yields:
+        (Error, pyarrow.RecordBatch): record-batch
+    """
+    if not schema:
+        yield Exception('no schema'), None
+        return
+
+    if hasattr(db_result_it, 'batch_size'):
+        db_result_it.batch_size(batch_size)
+
+    arrow_schema = pyarrow.schema([(field, pyarrow.type_for_alias(the_type) if isinstance(the_type, str) else the_type) for field, the_type in schema])
+
+    columns = [[] for _ in schema]
+    try:
+        for each in db_result_it:
+            for (field, _), column in zip(schema, columns):
+                val = util._get_value(each, field, None)
+                column.append(val)
+
+            if len(columns[0]) >= batch_size:
+                yield None, _to_record_batch(columns, arrow_schema)
+                columns = [[] for _ in schema]
+
+        if columns[0]:
+            yield None, _to_record_batch(columns, arrow_schema)
+    except Exception as e:
+        yield e, None
+    finally:
+        if hasattr(db_result_it, 'close'):
+            db_result_it.close()
+
+
+def _to_record_batch(columns, arrow_schema):
+    """Convert the columns into the record-batch
+
+    Args:
+        columns ([list]): values of each column
+        arrow_schema (pyarrow.Schema): schema
+
+    Returns:
+        pyarrow.RecordBatch: record-batch
+    """
+    arrays = [pyarrow.array(column, type=arrow_field.type) for column, arrow_field in zip(columns, arrow_schema)]
+
+    return pyarrow.RecordBatch.from_arrays(arrays, schema=arrow_schema)
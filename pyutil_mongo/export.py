@@ -0,0 +1,481 @@
+# -*- coding: utf-8 -*-
+"""Streaming exporter of db_find_it / db_aggregate_iter to JSONL (gzip / zstd), BSON or Parquet.
+
+The docs are streamed from the cursor into the file (constant memory):
+
+* jsonl: extended JSON, one doc per line (see :py:meth:`pyutil_mongo.raw.write_jsonl`), optionally gzip / zstd compressed.
+* bson: concatenated BSON (as mongodump), optionally gzip / zstd compressed.
+* parquet: a row-group of batch_size rows for each record-batch (see :py:mod:`pyutil_mongo.columnar`), schema required,
+  compressed by parquet (snappy / gzip / zstd ...).
+
+With n_shards, the collection is split into the ranges of _id (see :py:meth:`pyutil_mongo.scan.db_scan_ranges`),
+and the ranges are exported concurrently into the sharded files ({root}-{idx:05d}{ext}).
+
+A manifest ({path}.manifest.json) is written after the export, with the count, size and sha256 of each file.
+
+    err, manifest = export.export_find('a', 'a.jsonl.gz', {'key1': 'a'}, n_shards=4)
+
+    python -m pyutil_mongo.export --collection a --query '{"key1": "a"}' --shards 4 a.jsonl.gz
+"""
+import argparse
+import concurrent.futures
+import gzip
+import hashlib
+import io
+import logging
+import os
+import sys
+import time
+
+import bson
+import bson.json_util
+
+from . import cfg
+from . import util
+from . import raw
+from . import scan
+from . import columnar
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+FORMATS = ('jsonl', 'bson', 'parquet')
+
+COMPRESSIONS = ('gzip', 'zstd')
+
+
+def get_format(path):
+    """Get the format and the compression of the file by the extension
+
+    Args:
+        path (str): path
+
+    Returns:
+        (str, str): format (None if unknown), compression (None if not compressed)
+    """
+    root, ext = os.path.splitext(path)
+
+    compression = None
+    if ext in ('.gz', '.zst'):
+        compression = 'gzip' if ext == '.gz' else 'zstd'
+        _, ext = os.path.splitext(root)
+
+    file_format = {'.jsonl': 'jsonl', '.ndjson': 'jsonl', '.json': 'jsonl', '.bson': 'bson', '.parquet': 'parquet'}.get(ext, None)
+
+    return file_format, compression
+
+
+def export_find(collection_name, path, key=None, fields=None, file_format=None, compression=None, schema=None, n_shards=1, batch_size=10000, is_raw=True, manifest_path=None, db_name=None):
+    """Export the found docs into the file (or the sharded files)
+
+    Args:
+        collection_name (str): collection-name
+        path (str): path of the file
+        key (dict, optional): the selection criteria
+        fields (dict, optional): resulting fields (with _id if not specified)
+        file_format (str, optional): jsonl / bson / parquet, None to get from the extension.
+        compression (str, optional): gzip / zstd for jsonl / bson, parquet compression for parquet, None to get from the extension.
+        schema ([(field, type)], optional): Arrow schema of the parquet (see :py:meth:`pyutil_mongo.columnar.db_find_record_batches`)
+        n_shards (int, optional): number of the sharded files by the ranges of _id.
+        batch_size (int, optional): batch-size of the cursor (and rows in each row-group of the parquet)
+        is_raw (bool, optional): find as RawBSONDocument for jsonl / bson (written without decoding).
+        manifest_path (str, optional): path of the manifest (default: {path}.manifest.json)
+        db_name (str, optional): db-name in config
+
+    Returns:
+        (Error, dict): manifest
+    """
+    file_format, compression, err = _get_format_compression(path, file_format, compression, schema)
+    if err:
+        return err, {}
+
+    ranges = [(None, None)]
+    if n_shards > 1:
+        err, ranges = scan.db_scan_ranges(collection_name, key='_id', query=key, n_ranges=n_shards, db_name=db_name)
+        if err:
+            return err, {}
+
+    paths = [path] if len(ranges) == 1 else [_get_shard_path(path, idx) for idx in range(len(ranges))]
+
+    def _export_range(each_path, the_range):
+        range_key = scan._get_range_query(key, '_id', the_range)
+        if file_format == 'parquet':
+            db_result_it = columnar.db_find_record_batches(collection_name, schema, range_key, batch_size=batch_size, db_name=db_name)
+            return _write_file(each_path, file_format, compression, db_result_it, schema)
+
+        err, db_result_it = util.db_find_it(collection_name, range_key, fields, with_id=fields is None, db_name=db_name, is_raw=is_raw and file_format in ('jsonl', 'bson'))
+        if err:
+            return err, {}
+        if hasattr(db_result_it, 'batch_size'):
+            db_result_it.batch_size(batch_size)
+
+        return _write_file(each_path, file_format, compression, db_result_it, schema)
+
+    files_with_err = []
+    if len(ranges) == 1:
+        files_with_err.append(_export_range(paths[0], ranges[0]))
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+            futures = [executor.submit(_export_range, each_path, the_range) for each_path, the_range in zip(paths, ranges)]
+            files_with_err = [each.result() for each in futures]
+
+    for (_, each_file), the_range in zip(files_with_err, ranges):
+        if each_file and len(ranges) > 1:
+            each_file['range'] = list(the_range)
+
+    return _write_manifest(path, manifest_path, collection_name, file_format, compression, files_with_err, {'query': key, 'fields': fields})
+
+
+def export_aggregate(collection_name, pipe, path, file_format=None, compression=None, schema=None, batch_size=10000, manifest_path=None, db_name=None):
+    """Export the db-aggregate-results into the file
+
+    Args:
+        collection_name (str): collection-name
+        pipe ([{}]): pipe in db-aggregate
+        path (str): path of the file
+        file_format (str, optional): see :py:meth:`export_find`
+        compression (str, optional): see :py:meth:`export_find`
+        schema ([(field, type)], optional): see :py:meth:`export_find`
+        batch_size (int, optional): see :py:meth:`export_find`
+        manifest_path (str, optional): see :py:meth:`export_find`
+        db_name (str, optional): db-name in config
+
+    Returns:
+        (Error, dict): manifest
+    """
+    file_format, compression, err = _get_format_compression(path, file_format, compression, schema)
+    if err:
+        return err, {}
+
+    if file_format == 'parquet':
+        db_result_it = columnar.db_aggregate_record_batches(collection_name, pipe, schema, batch_size=batch_size, db_name=db_name)
+        file_with_err = _write_file(path, file_format, compression, db_result_it, schema)
+    else:
+        err, db_result_it = util.db_aggregate_iter(collection_name, pipe, db_name=db_name)
+        if err:
+            file_with_err = (err, {})
+        else:
+            if hasattr(db_result_it, 'batch_size'):
+                db_result_it.batch_size(batch_size)
+            file_with_err = _write_file(path, file_format, compression, db_result_it, schema)
+
+    return _write_manifest(path, manifest_path, collection_name, file_format, compression, [file_with_err], {'pipe': pipe})
+
+
+def _get_format_compression(path, file_format, compression, schema):
+    """Get the format and the compression (from the extension if not specified)
+
+    Args:
+        path (str): path
+        file_format (str): format
+        compression (str): compression
+        schema ([(field, type)]): Arrow schema
+
+    Returns:
+        (str, str, Error): format, compression, error
+    """
+    path_format, path_compression = get_format(path)
+    if file_format is None:
+        file_format = path_format
+    if compression is None and file_format != 'parquet':
+        compression = path_compression
+
+    if file_format not in FORMATS:
+        return file_format, compression, Exception('export: unknown format: path: %s format: %s' % (path, file_format))
+
+    if file_format == 'parquet':
+        if pyarrow is None:
+            return file_format, compression, Exception('pyarrow is not installed')
+        if not schema:
+            return file_format, compression, Exception('export: no schema for parquet: path: %s' % (path))
+        return file_format, compression, None
+
+    if compression is not None and compression not in COMPRESSIONS:
+        return file_format, compression, Exception('export: unknown compression: path: %s compression: %s' % (path, compression))
+
+    if compression == 'zstd' and zstandard is None:
+        return file_format, compression, Exception('zstandard is not installed')
+
+    return file_format, compression, None
+
+
+def _get_shard_path(path, idx):
+    """Get the path of the sharded file: {root}-{idx:05d}{ext}, ext including .gz / .zst.
+
+    Args:
+        path (str): path
+        idx (int): index of the shard
+
+    Returns:
+        str: path
+    """
+    root, ext = os.path.splitext(path)
+    if ext in ('.gz', '.zst'):
+        root, ext2 = os.path.splitext(root)
+        ext = ext2 + ext
+
+    return '%s-%05d%s' % (root, idx, ext)
+
+
+def _write_file(path, file_format, compression, db_result_it, schema):
+    """Write the docs (or record-batches for parquet) into the file
+
+    Args:
+        path (str): path
+        file_format (str): format
+        compression (str): compression
+        db_result_it (iterator): docs, or (Error, RecordBatch) for parquet
+        schema ([(field, type)]): Arrow schema
+
+    Returns:
+        (Error, dict): info of the file: {path, n_docs, n_bytes, sha256}
+    """
+    start_timestamp = time.time()
+
+    try:
+        if file_format == 'parquet':
+            err, n_docs = _write_parquet(path, compression, db_result_it)
+        else:
+            with _open_compressed(path, compression) as f:
+                if file_format == 'jsonl':
+                    # detached after writing: f is closed by _open_compressed.
+                    text_f = io.TextIOWrapper(f, encoding='utf-8', newline='\n')
+                    err, n_docs = raw.write_jsonl(db_result_it, text_f)
+                    text_f.flush()
+                    text_f.detach()
+                else:
+                    err, n_docs = raw.write_bson(db_result_it, f)
+    except Exception as e:
+        return e, {'path': path}
+    finally:
+        if hasattr(db_result_it, 'close'):
+            db_result_it.close()
+
+    n_bytes, sha256 = _get_file_info(path)
+
+    return err, {'path': path, 'n_docs': n_docs, 'n_bytes': n_bytes, 'sha256': sha256, 'elapsed': time.time() - start_timestamp}
+
+
+def _write_parquet(path, compression, record_batches):
+    """Write the record-batches as the row-groups of the parquet
+
+    Args:
+        path (str): path
+        compression (str): parquet compression (None: pyarrow default)
+        record_batches (iterator): (Error, RecordBatch)
+
+    Returns:
+        (Error, int): number of the written rows
+    """
+    n_docs = 0
+    writer = None
+    try:
+        for err, record_batch in record_batches:
+            if err:
+                return err, n_docs
+            if writer is None:
+                writer = pyarrow.parquet.ParquetWriter(path, record_batch.schema, compression=compression or 'snappy')
+            writer.write_table(pyarrow.Table.from_batches([record_batch]))
+            n_docs += record_batch.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if writer is None:
+        # no rows: empty file, as the empty jsonl / bson.
+        open(path, 'wb').close()
+
+    return None, n_docs
+
+
+class _open_compressed(object):
+    """Open the binary file for writing, with gzip / zstd compression
+    """
+
+    def __init__(self, path, compression):
+        self.path = path
+        self.compression = compression
+        self._f = None
+        self._compressed_f = None
+
+    def __enter__(self):
+        self._f = open(self.path, 'wb')
+        if self.compression == 'gzip':
+            self._compressed_f = gzip.GzipFile(fileobj=self._f, mode='wb')
+            return self._compressed_f
+        if self.compression == 'zstd':
+            self._compressed_f = zstandard.ZstdCompressor().stream_writer(self._f, closefd=False)
+            return self._compressed_f
+
+        return self._f
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._compressed_f is not None:
+            self._compressed_f.close()
+        self._f.close()
+
+
+def _get_file_info(path):
+    """Get the size and the sha256 of the file (read in chunks)
+
+    Args:
+        path (str): path
+
+    Returns:
+        (int, str): size, sha256 in hex
+    """
+    n_bytes = 0
+    the_hash = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            n_bytes += len(chunk)
+            the_hash.update(chunk)
+
+    return n_bytes, the_hash.hexdigest()
+
+
+def _write_manifest(path, manifest_path, collection_name, file_format, compression, files_with_err, source):
+    """Write the manifest of the exported files
+
+    Args:
+        path (str): path of the export
+        manifest_path (str): path of the manifest (default: {path}.manifest.json)
+        collection_name (str): collection-name
+        file_format (str): format
+        compression (str): compression
+        files_with_err ([(Error, dict)]): info of each file
+        source (dict): query / fields / pipe
+
+    Returns:
+        (Error, dict): manifest
+    """
+    if manifest_path is None:
+        manifest_path = path + '.manifest.json'
+
+    err, _ = util._flatten_results_with_err([(each_err, []) for each_err, _ in files_with_err])
+
+    files = [dict(each_file, path=os.path.basename(each_file.get('path', ''))) for _, each_file in files_with_err]
+    manifest = {
+        'collection': collection_name,
+        'format': file_format,
+        'compression': compression,
+        'source': source,
+        'n_docs': sum([each.get('n_docs', 0) for each in files]),
+        'n_bytes': sum([each.get('n_bytes', 0) for each in files]),
+        'files': files,
+        'is_complete': err is None,
+        'created_timestamp': time.time(),
+    }
+    if err:
+        manifest['errors'] = [str(each_err) for each_err, _ in files_with_err if each_err]
+
+    try:
+        with open(manifest_path, 'w') as f:
+            f.write(bson.json_util.dumps(manifest, json_options=bson.json_util.RELAXED_JSON_OPTIONS, indent=2))
+            f.write('\n')
+    except Exception as e:
+        return e, manifest
+
+    return err, manifest
+
+
+def _parse_schema(schema):
+    """Parse the schema from the command-line (field=type, type as the Arrow alias: int64 / double / string ...)
+
+    Args:
+        schema ([str]): field=type
+
+    Returns:
+        [(str, str)]: schema
+    """
+    result = []
+    for each in schema or []:
+        field, _, the_type = each.partition('=')
+        if not field or not the_type:
+            raise ValueError('invalid schema: %s' % (each))
+        result.append((field, the_type))
+
+    return result
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(prog='python -m pyutil_mongo.export', description='Export a collection (or db-aggregate-results) to JSONL / BSON / Parquet.')
+    parser.add_argument('path', help='output file (.jsonl / .bson / .parquet, .gz / .zst for jsonl / bson)')
+    parser.add_argument('--hostname', default='localhost:27017', help='hostname of the mongo')
+    parser.add_argument('--mongo-db-name', default='test', help='real db-name in mongo')
+    parser.add_argument('--collection', required=True, help='collection-name')
+    parser.add_argument('--real-collection', default=None, help='real collection-name in mongo (default: collection)')
+    parser.add_argument('--ssl', action='store_true', help='use ssl')
+    parser.add_argument('--cert', default=None, help='ssl-cert')
+    parser.add_argument('--ca', default=None, help='ssl-ca')
+    parser.add_argument('--query', default=None, help='the selection criteria (extended JSON)')
+    parser.add_argument('--fields', default=None, help='resulting fields (extended JSON)')
+    parser.add_argument('--pipeline', default=None, help='pipe in db-aggregate (extended JSON), instead of query / fields')
+    parser.add_argument('--format', dest='file_format', choices=FORMATS, default=None, help='output format (default: from the extension)')
+    parser.add_argument('--compression', default=None, help='gzip / zstd for jsonl / bson, parquet compression for parquet (default: from the extension)')
+    parser.add_argument('--schema', action='append', default=[], help='parquet column: field=type (Arrow alias, repeatable)')
+    parser.add_argument('--shards', dest='n_shards', type=int, default=1, help='number of the sharded files by the ranges of _id')
+    parser.add_argument('--batch-size', type=int, default=10000, help='batch-size of the cursor / rows in each row-group')
+    parser.add_argument('--no-raw', dest='is_raw', action='store_false', help='decode the docs (default: written as raw BSON)')
+    parser.add_argument('--manifest', dest='manifest_path', default=None, help='path of the manifest (default: {path}.manifest.json)')
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Command-line entry: python -m pyutil_mongo.export
+
+    Args:
+        argv ([str], optional): arguments (default: sys.argv[1:])
+
+    Returns:
+        int: exit code
+    """
+    args = _parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    logger = logging.getLogger('pyutil_mongo.export')
+
+    try:
+        query = bson.json_util.loads(args.query) if args.query else None
+        fields = bson.json_util.loads(args.fields) if args.fields else None
+        pipe = bson.json_util.loads(args.pipeline) if args.pipeline else None
+        schema = _parse_schema(args.schema)
+    except ValueError as e:
+        logger.error('invalid argument: e: %s', e)
+        return 2
+
+    mongo_map = cfg.MongoMap({args.collection: args.real_collection or args.collection}, hostname=args.hostname, mongo_db_name=args.mongo_db_name, ssl=args.ssl, cert=args.cert, ca=args.ca)
+    err = cfg.init(logger, [mongo_map])
+    if err:
+        logger.error('unable to init mongo: e: %s', err)
+        return 1
+
+    try:
+        if pipe is not None:
+            err, manifest = export_aggregate(args.collection, pipe, args.path, file_format=args.file_format, compression=args.compression, schema=schema, batch_size=args.batch_size, manifest_path=args.manifest_path)
+        else:
+            err, manifest = export_find(args.collection, args.path, query, fields, file_format=args.file_format, compression=args.compression, schema=schema, n_shards=args.n_shards, batch_size=args.batch_size, is_raw=args.is_raw, manifest_path=args.manifest_path)
+    finally:
+        cfg.clean()
+
+    if err:
+        logger.error('export: path: %s e: %s', args.path, err)
+
+    sys.stdout.write(bson.json_util.dumps({k: v for k, v in manifest.items() if k != 'files'}))
+    sys.stdout.write('\n')
+    sys.stdout.flush()
+
+    return 1 if err else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,565 @@
+# -*- coding: utf-8 -*-
+"""Bulk loader of JSONL / CSV / BSON files into a collection.
+
+The files are stream-parsed (mmap for the uncompressed JSONL / BSON, .gz / .zst are decompressed as streams),
+the docs are batched by batch_size and batch_bytes, and the batches are written by n_writers threads:
+
+* insert (default): db_insert (insert_many(ordered=False)).
+* upsert (upsert_keys): db_force_bulk_update with upsert, $set by the upsert-keys ($setOnInsert for _id).
+
+The E11000 duplicates are collected separately (without restarting the connection), the other write errors are counted as errors.
+
+    err, stats = load.load_file('a', 'a.jsonl', upsert_keys=['key1'], n_writers=4)
+
+    python -m pyutil_mongo.load --hostname localhost:27017 --mongo-db-name test --collection a [--upsert-key key1] a.jsonl a.bson.gz
+
+Only the batches in progress are kept in memory (at most 2 * n_writers batches).
+"""
+import argparse
+import concurrent.futures
+import contextlib
+import csv
+import gzip
+import io
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+
+import bson
+import bson.json_util
+import bson.raw_bson
+
+from . import cfg
+from . import util
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+FORMATS = ('jsonl', 'csv', 'bson')
+
+_EXTENSION_FORMATS = {
+    '.jsonl': 'jsonl',
+    '.ndjson': 'jsonl',
+    '.json': 'jsonl',
+    '.csv': 'csv',
+    '.bson': 'bson',
+}
+
+_DUPLICATE_KEY_CODES = (11000, 11001)
+
+
+def get_format(path):
+    """Get the format of the file by the extension (.jsonl / .ndjson / .json / .csv / .bson, optionally with .gz / .zst)
+
+    Args:
+        path (str): path
+
+    Returns:
+        str: format, None if unknown.
+    """
+    root, ext = os.path.splitext(path)
+    if ext in ('.gz', '.zst'):
+        _, ext = os.path.splitext(root)
+
+    return _EXTENSION_FORMATS.get(ext, None)
+
+
+def iter_file(path, file_format=None, csv_types=None, is_raw=False):
+    """Stream-parse the file
+
+    Args:
+        path (str): path
+        file_format (str, optional): jsonl / csv / bson, None to get from the extension.
+        csv_types (dict, optional): {field: type-function} of the CSV columns (str if not specified).
+        is_raw (bool, optional): BSON docs as RawBSONDocument (inserted without decoding).
+
+    Yields:
+        (Error, dict, int): doc, and number of bytes in the file, doc is None with the parse-error.
+    """
+    if file_format is None:
+        file_format = get_format(path)
+
+    if file_format == 'jsonl':
+        yield from iter_jsonl(path)
+    elif file_format == 'csv':
+        yield from iter_csv(path, csv_types=csv_types)
+    elif file_format == 'bson':
+        yield from iter_bson(path, is_raw=is_raw)
+    else:
+        yield Exception('load: unknown format: path: %s format: %s' % (path, file_format)), None, 0
+
+
+def iter_jsonl(path):
+    """Stream-parse the extended JSON file, one doc per line.
+
+    Args:
+        path (str): path
+
+    Yields:
+        (Error, dict, int): doc, and number of bytes in the file.
+    """
+    with _open_binary(path) as f:
+        for idx, line in enumerate(iter(f.readline, b'')):
+            if not line.strip():
+                continue
+            try:
+                doc = bson.json_util.loads(line)
+            except Exception as e:
+                yield Exception('load: invalid json: path: %s line: %s e: %s' % (path, idx + 1, e)), None, len(line)
+                continue
+            yield None, doc, len(line)
+
+
+def iter_csv(path, csv_types=None):
+    """Stream-parse the CSV file with the header, the empty values are skipped and the dotted columns are nested.
+
+    Args:
+        path (str): path
+        csv_types (dict, optional): {field: type-function} of the columns (str if not specified).
+
+    Yields:
+        (Error, dict, int): doc, and (approximated) number of bytes in the file.
+    """
+    if csv_types is None:
+        csv_types = {}
+
+    with _open_binary(path) as f:
+        reader = csv.DictReader(line.decode('utf-8') for line in iter(f.readline, b''))
+        for idx, row in enumerate(reader):
+            n_bytes = sum([len(each) for each in row.values() if isinstance(each, str)]) + len(row)
+            doc = {}
+            try:
+                for field, val in row.items():
+                    if field is None or val is None or val == '':
+                        continue
+                    type_func = csv_types.get(field, None)
+                    _set_value(doc, field, type_func(val) if type_func is not None else val)
+            except Exception as e:
+                yield Exception('load: invalid csv: path: %s row: %s e: %s' % (path, idx + 1, e)), None, n_bytes
+                continue
+            yield None, doc, n_bytes
+
+
+def iter_bson(path, is_raw=False):
+    """Stream-parse the concatenated BSON file (as mongodump)
+
+    Args:
+        path (str): path
+        is_raw (bool, optional): docs as RawBSONDocument.
+
+    Yields:
+        (Error, dict, int): doc, and number of bytes in the file, stopped after the error.
+    """
+    with _open_binary(path) as f:
+        while True:
+            header = f.read(4)
+            if not header:
+                return
+            n_bytes = struct.unpack('<i', header)[0] if len(header) == 4 else 0
+            if n_bytes < 5:
+                yield Exception('load: invalid bson: path: %s' % (path)), None, len(header)
+                return
+
+            data = header + f.read(n_bytes - 4)
+            if len(data) != n_bytes:
+                yield Exception('load: truncated bson: path: %s' % (path)), None, len(data)
+                return
+
+            try:
+                doc = bson.raw_bson.RawBSONDocument(data) if is_raw else bson.decode(data)
+            except Exception as e:
+                yield Exception('load: invalid bson: path: %s e: %s' % (path, e)), None, n_bytes
+                return
+
+            yield None, doc, n_bytes
+
+
+def load_file(collection_name, path, file_format=None, csv_types=None, is_raw=False, **kwargs):
+    """Load the file into the collection
+
+    Args:
+        collection_name (str): collection-name
+        path (str): path
+        file_format (str, optional): see :py:meth:`iter_file`
+        csv_types (dict, optional): see :py:meth:`iter_file`
+        is_raw (bool, optional): see :py:meth:`iter_file`
+        **kwargs: see :py:meth:`load`
+
+    Returns:
+        (Error, dict): stats, see :py:meth:`load`
+    """
+    try:
+        with open(path, 'rb'):
+            pass
+    except OSError as e:
+        return Exception('load: unable to open: path: %s e: %s' % (path, e)), _get_stats()
+
+    return load(collection_name, iter_file(path, file_format=file_format, csv_types=csv_types, is_raw=is_raw), **kwargs)
+
+
+def load(collection_name, docs, upsert_keys=None, batch_size=1000, batch_bytes=16 * 1024 * 1024, n_writers=4, max_duplicates=1000, db_name=None, progress=None):
+    """Load the docs into the collection in batches by parallel writers
+
+    Args:
+        collection_name (str): collection-name
+        docs (iterator): (Error, doc, n_bytes), as from :py:meth:`iter_file`
+        upsert_keys ([str], optional): upsert by the keys (None: insert)
+        batch_size (int, optional): max number of docs in a batch.
+        batch_bytes (int, optional): max bytes of the docs (in the file) in a batch.
+        n_writers (int, optional): number of the concurrent writers.
+        max_duplicates (int, optional): max number of the kept duplicates (None: unbounded), the duplicates are all counted.
+        db_name (str, optional): db-name in config
+        progress (function, optional): progress(stats), called after each batch is written.
+
+    Returns:
+        (Error, dict): stats: {n_docs, n_bytes, n_inserted, n_upserted, n_modified, n_duplicates, n_errors, duplicates: [{index, _id / key}], errors: [{index, errmsg}], elapsed, docs_per_sec, bytes_per_sec}, error if any doc is not written (except the duplicates).
+    """
+    if db_name is None:
+        db_name = util._get_default_db(collection_name)
+
+    if db_name is None:
+        return Exception('unable to get db_name: collection: %s' % (collection_name)), {}
+
+    stats = _get_stats()
+    lock = threading.Lock()
+    start_timestamp = time.time()
+
+    def _update_stats(batch_stats):
+        with lock:
+            for key in ['n_inserted', 'n_upserted', 'n_modified', 'n_duplicates', 'n_errors']:
+                stats[key] += batch_stats[key]
+            n_kept = len(batch_stats['duplicates']) if max_duplicates is None else max(max_duplicates - len(stats['duplicates']), 0)
+            stats['duplicates'] += batch_stats['duplicates'][:n_kept]
+            stats['errors'] += batch_stats['errors']
+            _update_throughput(stats, start_timestamp)
+            if progress is not None:
+                progress(stats)
+
+    semaphore = threading.BoundedSemaphore(2 * max(n_writers, 1))
+
+    def _write(batch, offset):
+        try:
+            _update_stats(_write_batch(collection_name, batch, offset, upsert_keys, db_name))
+        except Exception as e:
+            _update_stats(_get_batch_stats(errors=[{'index': offset, 'n_docs': len(batch), 'errmsg': str(e)}], n_errors=len(batch)))
+        finally:
+            semaphore.release()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(n_writers, 1)) as executor:
+        batch = []
+        batch_n_bytes = 0
+        offset = 0
+        idx = 0
+        try:
+            for idx, (err, doc, n_bytes) in enumerate(docs):
+                with lock:
+                    stats['n_docs'] += 1
+                    stats['n_bytes'] += n_bytes
+                if err:
+                    _update_stats(_get_batch_stats(errors=[{'index': idx, 'errmsg': str(err)}], n_errors=1))
+                    continue
+
+                if not batch:
+                    offset = idx
+                batch.append(doc)
+                batch_n_bytes += n_bytes
+                if len(batch) < batch_size and batch_n_bytes < batch_bytes:
+                    continue
+
+                semaphore.acquire()
+                executor.submit(_write, batch, offset)
+                batch = []
+                batch_n_bytes = 0
+        except OSError as e:
+            # unable to read the rest of the file.
+            _update_stats(_get_batch_stats(errors=[{'index': idx, 'errmsg': 'unable to read: e: %s' % (e)}], n_errors=1))
+
+        if batch:
+            semaphore.acquire()
+            executor.submit(_write, batch, offset)
+
+    _update_throughput(stats, start_timestamp)
+
+    err = None
+    if stats['n_errors']:
+        err = Exception('load: unable to load: collection: %s n_errors: %s' % (collection_name, stats['n_errors']))
+
+    return err, stats
+
+
+def _write_batch(collection_name, batch, offset, upsert_keys, db_name):
+    """Write the batch (insert or upsert)
+
+    Args:
+        collection_name (str): collection-name
+        batch ([dict]): docs
+        offset (int): index of the 1st doc in the batch.
+        upsert_keys ([str]): upsert-keys (None: insert)
+        db_name (str): db-name in config
+
+    Returns:
+        dict: stats of the batch
+    """
+    if not upsert_keys:
+        err, _ = util.db_insert(collection_name, batch, db_name=db_name)
+        if not err:
+            return _get_batch_stats(n_inserted=len(batch))
+        return _get_write_error_stats(err, getattr(err, 'details', None), batch, offset, 'nInserted', lambda op: {'_id': op.get('_id', None)})
+
+    update_data = [_get_upsert_data(doc, upsert_keys) for doc in batch]
+    err, result = util.db_force_bulk_update(collection_name, update_data, is_set=False, upsert=True, multi=False, db_name=db_name)
+    if not err:
+        return _get_batch_stats(n_upserted=result.get('nUpserted', 0), n_modified=result.get('nModified', 0))
+
+    batch_stats = _get_write_error_stats(err, result, batch, offset, 'nUpserted', lambda op: {'key': op.get('q', None)})
+    batch_stats['n_modified'] = result.get('nModified', 0) if result else 0
+
+    return batch_stats
+
+
+def _get_upsert_data(doc, upsert_keys):
+    """Get the update-data of the doc, $set by the upsert-keys ($setOnInsert for _id)
+
+    Args:
+        doc (dict): doc
+        upsert_keys ([str]): upsert-keys
+
+    Returns:
+        dict: {key, val}
+    """
+    key = {each: util._get_value(doc, each) for each in upsert_keys}
+    val = {'$set': {k: v for k, v in doc.items() if k != '_id'}}
+    if '_id' in doc and '_id' not in upsert_keys:
+        val['$setOnInsert'] = {'_id': doc['_id']}
+
+    return {'key': key, 'val': val}
+
+
+def _get_write_error_stats(err, details, batch, offset, n_written_key, get_duplicate):
+    """Get the stats of the batch with the write-error, the E11000 duplicates are separated from the errors.
+
+    Args:
+        err (Error): error
+        details (dict): raw-result / BulkWriteError details, None if not a bulk-write-error.
+        batch ([dict]): docs
+        offset (int): index of the 1st doc in the batch.
+        n_written_key (str): nInserted / nUpserted
+        get_duplicate (function): get_duplicate(op) => dict, info of the duplicate in the write-error.
+
+    Returns:
+        dict: stats of the batch
+    """
+    if not details or (not details.get('writeErrors', None) and not details.get(n_written_key, 0)):
+        return _get_batch_stats(errors=[{'index': offset, 'n_docs': len(batch), 'errmsg': str(err)}], n_errors=len(batch))
+
+    duplicates = []
+    errors = []
+    for each in details.get('writeErrors', []):
+        index = offset + each.get('index', 0)
+        if each.get('code', None) in _DUPLICATE_KEY_CODES:
+            duplicates.append(dict({'index': index}, **get_duplicate(each.get('op', None) or {})))
+            continue
+        errors.append({'index': index, 'errmsg': each.get('errmsg', '')})
+
+    batch_stats = _get_batch_stats(duplicates=duplicates, errors=errors, n_duplicates=len(duplicates), n_errors=len(errors))
+    batch_stats['n_inserted' if n_written_key == 'nInserted' else 'n_upserted'] = details.get(n_written_key, 0)
+
+    return batch_stats
+
+
+def _get_stats():
+    return {
+        'n_docs': 0,
+        'n_bytes': 0,
+        'n_inserted': 0,
+        'n_upserted': 0,
+        'n_modified': 0,
+        'n_duplicates': 0,
+        'n_errors': 0,
+        'duplicates': [],
+        'errors': [],
+        'elapsed': 0.0,
+        'docs_per_sec': 0.0,
+        'bytes_per_sec': 0.0,
+    }
+
+
+def _get_batch_stats(n_inserted=0, n_upserted=0, n_modified=0, n_duplicates=0, n_errors=0, duplicates=None, errors=None):
+    return {
+        'n_inserted': n_inserted,
+        'n_upserted': n_upserted,
+        'n_modified': n_modified,
+        'n_duplicates': n_duplicates,
+        'n_errors': n_errors,
+        'duplicates': duplicates if duplicates is not None else [],
+        'errors': errors if errors is not None else [],
+    }
+
+
+def _update_throughput(stats, start_timestamp):
+    elapsed = max(time.time() - start_timestamp, 1e-6)
+    stats['elapsed'] = elapsed
+    stats['docs_per_sec'] = stats['n_docs'] / elapsed
+    stats['bytes_per_sec'] = stats['n_bytes'] / elapsed
+
+
+@contextlib.contextmanager
+def _open_binary(path):
+    """Open the file as a binary stream: mmap for the uncompressed file, decompressed stream for .gz / .zst.
+
+    Args:
+        path (str): path
+
+    Yields:
+        file: file-object with read / readline.
+    """
+    if path.endswith('.gz'):
+        with gzip.open(path, 'rb') as f:
+            yield f
+        return
+
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raise Exception('zstandard is not installed')
+        with open(path, 'rb') as raw_f:
+            with zstandard.ZstdDecompressor().stream_reader(raw_f) as f:
+                yield io.BufferedReader(f)
+        return
+
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield f
+            return
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield mm
+
+
+def _set_value(doc, key, val):
+    each_keys = key.split('.')
+    for each_key in each_keys[:-1]:
+        doc = doc.setdefault(each_key, {})
+    doc[each_keys[-1]] = val
+
+
+def _parse_csv_types(csv_types):
+    """Parse the CSV types from the command-line (field=int / float / bool / str / json)
+
+    Args:
+        csv_types ([str]): field=type
+
+    Returns:
+        dict: {field: type-function}
+    """
+    type_funcs = {
+        'int': int,
+        'float': float,
+        'bool': lambda val: val.lower() in ('1', 'true', 'yes', 'y'),
+        'str': str,
+        'json': bson.json_util.loads,
+    }
+
+    result = {}
+    for each in csv_types or []:
+        field, _, the_type = each.partition('=')
+        if the_type not in type_funcs:
+            raise ValueError('invalid csv type: %s' % (each))
+        result[field] = type_funcs[the_type]
+
+    return result
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(prog='python -m pyutil_mongo.load', description='Bulk-load JSONL / CSV / BSON files into a collection.')
+    parser.add_argument('paths', nargs='+', help='input files (.jsonl / .ndjson / .json / .csv / .bson, optionally .gz / .zst)')
+    parser.add_argument('--hostname', default='localhost:27017', help='hostname of the mongo')
+    parser.add_argument('--mongo-db-name', default='test', help='real db-name in mongo')
+    parser.add_argument('--collection', required=True, help='collection-name')
+    parser.add_argument('--real-collection', default=None, help='real collection-name in mongo (default: collection)')
+    parser.add_argument('--ssl', action='store_true', help='use ssl')
+    parser.add_argument('--cert', default=None, help='ssl-cert')
+    parser.add_argument('--ca', default=None, help='ssl-ca')
+    parser.add_argument('--format', dest='file_format', choices=FORMATS, default=None, help='input format (default: from the extension)')
+    parser.add_argument('--csv-type', dest='csv_types', action='append', default=[], help='type of the csv column: field=int / float / bool / str / json')
+    parser.add_argument('--raw', dest='is_raw', action='store_true', help='insert the BSON docs without decoding')
+    parser.add_argument('--upsert-key', dest='upsert_keys', action='append', default=None, help='upsert by the key (repeatable), default: insert')
+    parser.add_argument('--batch-size', type=int, default=1000, help='max number of docs in a batch')
+    parser.add_argument('--batch-bytes', type=int, default=16 * 1024 * 1024, help='max bytes of the docs in a batch')
+    parser.add_argument('--writers', dest='n_writers', type=int, default=4, help='number of the concurrent writers')
+    parser.add_argument('--duplicates', dest='duplicates_path', default=None, help='write the duplicates to the file (JSONL)')
+    parser.add_argument('--report-interval', type=float, default=5.0, help='interval (sec) of the throughput report')
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Command-line entry: python -m pyutil_mongo.load
+
+    Args:
+        argv ([str], optional): arguments (default: sys.argv[1:])
+
+    Returns:
+        int: exit code, 1 if any doc is not loaded (except the duplicates).
+    """
+    args = _parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    logger = logging.getLogger('pyutil_mongo.load')
+
+    try:
+        csv_types = _parse_csv_types(args.csv_types)
+    except ValueError as e:
+        logger.error('%s', e)
+        return 2
+
+    mongo_map = cfg.MongoMap({args.collection: args.real_collection or args.collection}, hostname=args.hostname, mongo_db_name=args.mongo_db_name, ssl=args.ssl, cert=args.cert, ca=args.ca)
+    err = cfg.init(logger, [mongo_map])
+    if err:
+        logger.error('unable to init mongo: e: %s', err)
+        return 1
+
+    last_report = [time.time()]
+
+    def _progress(stats):
+        if time.time() - last_report[0] < args.report_interval:
+            return
+        last_report[0] = time.time()
+        logger.info('load: n_docs: %s docs/s: %.1f MB/s: %.2f n_duplicates: %s n_errors: %s', stats['n_docs'], stats['docs_per_sec'], stats['bytes_per_sec'] / 1024 / 1024, stats['n_duplicates'], stats['n_errors'])
+
+    exit_code = 0
+    duplicates_f = open(args.duplicates_path, 'w') if args.duplicates_path else None
+    try:
+        for path in args.paths:
+            err, stats = load_file(args.collection, path, file_format=args.file_format, csv_types=csv_types, is_raw=args.is_raw, upsert_keys=args.upsert_keys, batch_size=args.batch_size, batch_bytes=args.batch_bytes, n_writers=args.n_writers, max_duplicates=None if duplicates_f else 1000, progress=_progress)
+            if err:
+                exit_code = 1
+                logger.error('load: path: %s e: %s', path, err)
+                for each in stats.get('errors', [])[:10]:
+                    logger.error('load: path: %s index: %s errmsg: %s', path, each['index'], each['errmsg'])
+
+            if duplicates_f is not None:
+                for each in stats.get('duplicates', []):
+                    duplicates_f.write(bson.json_util.dumps(dict(each, path=path)))
+                    duplicates_f.write('\n')
+
+            summary = {k: v for k, v in stats.items() if k not in ('duplicates', 'errors')}
+            sys.stdout.write(bson.json_util.dumps(dict(summary, path=path)))
+            sys.stdout.write('\n')
+            sys.stdout.flush()
+    finally:
+        if duplicates_f is not None:
+            duplicates_f.close()
+        cfg.clean()
+
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""Batched db_find_one by a key-field (DataLoader-style).
+
+The lookups of (collection-name, key-field) issued within a short window (wait_ms)
+are coalesced and resolved with one {key_field: {'$in': values}} query through db_find_it.
+The identical values are queried once, and each caller gets its own (copied) doc.
+
+* :py:class:`Loader`: for the threads, load() blocks until the batch is resolved.
+* :py:class:`AsyncLoader`: for asyncio, the batch is resolved in the executor of :py:mod:`pyutil_mongo.aio`.
+
+load_many() is the explicit batch (one query for all the values).
+
+The values are hashable (the same as the keys of dict), and the doc of the value is {} if not found (as db_find_one).
+"""
+import asyncio
+import copy
+import threading
+
+from . import util
+from . import aio
+
+
+class Loader(object):
+    """Batched db_find_one by key_field for the threads.
+
+    Attributes:
+        collection_name (str): collection-name
+        db_name (str): db-name in config
+        fields (dict): resulting fields
+        key_field (str): the key-field of the lookups
+        max_batch_size (int): max number of values in each query.
+        wait_ms (float): window (ms) to collect the lookups.
+    """
+
+    def __init__(self, collection_name, key_field='id', fields=None, db_name=None, max_batch_size=1000, wait_ms=2.0):
+        self.collection_name = collection_name
+        self.key_field = key_field
+        self.fields = fields
+        self.db_name = db_name
+        self.max_batch_size = max_batch_size
+        self.wait_ms = wait_ms
+
+        self._lock = threading.Lock()
+        self._batch = None
+
+    def load(self, value):
+        """Load the doc of the value (coalesced with the other lookups in the window)
+
+        Args:
+            value (object): value of key_field
+
+        Returns:
+            (Error, dict): db-result
+        """
+        err = _check_value(value)
+        if err:
+            return err, {}
+
+        with self._lock:
+            batch = self._batch
+            is_leader = batch is None
+            if is_leader:
+                batch = _Batch()
+                self._batch = batch
+
+            batch.values.setdefault(value, value)
+            if len(batch.values) >= self.max_batch_size:
+                self._batch = None
+                batch.is_full.set()
+
+        if not is_leader:
+            batch.is_done.wait()
+            return batch.get(value)
+
+        try:
+            batch.is_full.wait(self.wait_ms / 1000.0)
+            with self._lock:
+                if self._batch is batch:
+                    self._batch = None
+
+            batch.err, batch.docs = _find_docs(self.collection_name, self.key_field, self.fields, self.db_name, list(batch.values.keys()))
+        except Exception as e:
+            batch.err, batch.docs = e, {}
+        except BaseException as e:
+            # ex: KeyboardInterrupt, re-raised in the leader after the waiters are signaled.
+            batch.err, batch.docs = e, {}
+            raise
+        finally:
+            # the waiters get the error instead of blocking.
+            with self._lock:
+                if self._batch is batch:
+                    self._batch = None
+            batch.is_done.set()
+
+        return batch.get(value)
+
+    def load_many(self, values):
+        """Load the docs of the values in one batch
+
+        Args:
+            values (list): values of key_field
+
+        Returns:
+            (Error, list): db-results in the order of values
+        """
+        return _load_many(self.collection_name, self.key_field, self.fields, self.db_name, self.max_batch_size, values)
+
+
+class AsyncLoader(object):
+    """Batched db_find_one by key_field for asyncio.
+
+    Attributes:
+        collection_name (str): collection-name
+        db_name (str): db-name in config
+        fields (dict): resulting fields
+        key_field (str): the key-field of the lookups
+        max_batch_size (int): max number of values in each query.
+        wait_ms (float): window (ms) to collect the lookups.
+    """
+
+    def __init__(self, collection_name, key_field='id', fields=None, db_name=None, max_batch_size=1000, wait_ms=2.0):
+        self.collection_name = collection_name
+        self.key_field = key_field
+        self.fields = fields
+        self.db_name = db_name
+        self.max_batch_size = max_batch_size
+        self.wait_ms = wait_ms
+
+        self._batch = None
+
+    async def load(self, value):
+        """Load the doc of the value (coalesced with the other lookups in the window)
+
+        Args:
+            value (object): value of key_field
+
+        Returns:
+            (Error, dict): db-result
+        """
+        err = _check_value(value)
+        if err:
+            return err, {}
+
+        batch = self._batch
+        if batch is None:
+            loop = asyncio.get_running_loop()
+            batch = _Batch(future=loop.create_future())
+            self._batch = batch
+            batch.timer = loop.call_later(self.wait_ms / 1000.0, self._dispatch, batch)
+
+        batch.values.setdefault(value, value)
+        if len(batch.values) >= self.max_batch_size:
+            batch.timer.cancel()
+            self._dispatch(batch)
+
+        await asyncio.shield(batch.future)
+
+        return batch.get(value)
+
+    async def load_many(self, values):
+        """Load the docs of the values in one batch
+
+        Args:
+            values (list): values of key_field
+
+        Returns:
+            (Error, list): db-results in the order of values
+        """
+        return await aio._run(_load_many, self.collection_name, self.key_field, self.fields, self.db_name, self.max_batch_size, values)
+
+    def _dispatch(self, batch):
+        if self._batch is batch:
+            self._batch = None
+
+        task = asyncio.ensure_future(aio._run(_find_docs, self.collection_name, self.key_field, self.fields, self.db_name, list(batch.values.keys())))
+        task.add_done_callback(lambda the_task: batch.set_result(the_task))
+
+
+class _Batch(object):
+    """The lookups coalesced in one query
+    """
+
+    def __init__(self, future=None):
+        self.values = {}
+        self.err = None
+        self.docs = {}
+
+        self.is_full = threading.Event()
+        self.is_done = threading.Event()
+
+        self.future = future
+        self.timer = None
+
+    def set_result(self, task):
+        try:
+            self.err, self.docs = task.result()
+        except BaseException as e:
+            # including CancelledError: the waiters get the error instead of blocking.
+            self.err, self.docs = e, {}
+        finally:
+            if not self.future.done():
+                self.future.set_result(None)
+
+    def get(self, value):
+        if self.err:
+            return self.err, {}
+
+        return None, copy.deepcopy(self.docs.get(value, {}))
+
+
+def _check_value(value):
+    """Check that the value is hashable (as the key of dict)
+
+    Args:
+        value (object): value of key_field
+
+    Returns:
+        Error: error
+    """
+    try:
+        hash(value)
+    except TypeError as e:
+        return Exception('loader: unhashable value: value: %s e: %s' % (value, e))
+
+    return None
+
+
+def _load_many(collection_name, key_field, fields, db_name, max_batch_size, values):
+    """Load the docs of the values (in the chunks of max_batch_size)
+
+    Returns:
+        (Error, list): db-results in the order of values
+    """
+    unique_values = list(dict.fromkeys(values).keys())
+
+    docs = {}
+    for idx in range(0, len(unique_values), max_batch_size):
+        err, each_docs = _find_docs(collection_name, key_field, fields, db_name, unique_values[idx:(idx + max_batch_size)])
+        if err:
+            return err, []
+        docs.update(each_docs)
+
+    return None, [copy.deepcopy(docs.get(each, {})) for each in values]
+
+
+def _find_docs(collection_name, key_field, fields, db_name, values):
+    """Find the docs of the values with $in
+
+    Args:
+        collection_name (str): collection-name
+        key_field (str): the key-field
+        fields (dict): resulting fields
+        db_name (str): db-name in config
+        values (list): (unique) values of key_field
+
+    Returns:
+        (Error, dict): {value: doc}, the 1st doc of each value.
+    """
+    if fields is None:
+        fields = {'_id': False}
+
+    # the key-field is required to match the docs with the values.
+    is_strip_key = False
+    if any([val and each != '_id' for each, val in fields.items()]) and not fields.get(key_field, False):
+        fields = dict(fields)
+        fields[key_field] = True
+        is_strip_key = True
+
+    err, db_result_it = util.db_find_it(collection_name, {key_field: {'$in': values}}, fields, db_name=db_name)
+    if err:
+        return err, {}
+
+    docs = {}
+    try:
+        for each in db_result_it:
+            value = util._get_value(each, key_field)
+            if value in docs:
+                continue
+            if is_strip_key:
+                each.pop(key_field, None)
+            docs[value] = each
+    except Exception as e:
+        return e, {}
+
+    return None, docs
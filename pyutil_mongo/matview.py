@@ -0,0 +1,519 @@
+# -*- coding: utf-8 -*-
+"""Materialized views: $group rollups of the source collections, kept up to date from the writes through util.
+
+    matview.register('a_by_key1', 'a', 'a_by_key1', ['key1'], {'total': {'$sum': '$key2'}, 'n': {'$sum': 1}, 'lo': {'$min': '$key2'}, 'hi': {'$max': '$key2'}})
+    err = matview.build('a_by_key1')
+
+    err, db_result = util.db_find_one('a_by_key1', {'key1': 'a'})  # {'key1': 'a', 'total': ..., 'n': ..., 'lo': ..., 'hi': ...}
+
+The view is built once with db_aggregate (without the pipeline cache), each group is a doc of the group keys and the aggregated fields.
+After build, the writes to the source collection through util are applied to the view by recomputing the affected groups with db_aggregate:
+
+* db_insert / db_insert_one: the groups of the inserted docs.
+* db_update / db_force_update / db_bulk_update / db_force_bulk_update / db_find_and_modify / db_set_if_not_exists / db_remove / db_force_remove:
+  the group keys of the matched docs are read before the write, and the groups before / after the write are recomputed.
+
+(Recomputing instead of $inc: the concurrent writes to the same group do not double-count the docs.)
+
+Only $sum (of a field or a constant), $min and $max are supported.
+Dropping the source collection through util empties the view.
+The writes not through util (or from other processes) are not applied, call build again to rebuild the view.
+The errors in updating the views are returned by the writers (the write itself is done, the view needs to be rebuilt).
+
+Attributes:
+    views (dict): registered views by name.
+"""
+import collections.abc
+
+from . import util
+
+
+views = {}
+
+_OPS = ('$sum', '$min', '$max')
+
+_MAX_GROUPS_IN_MATCH = 1000
+
+_MAX_KEYS_IN_MATCH = 1000
+
+
+class MatView(object):
+    """Materialized view
+
+    Attributes:
+        aggregates ([(str, str, str, object)]): (field, op, source-field, constant), source-field is None for the constant $sum.
+        collection_name (str): source collection-name
+        db_name (str): db-name of the source collection in config (None: from collection_db_map)
+        group_keys ([str]): (dotted) group keys
+        is_built (bool): whether the view is built (and maintained from the writes).
+        name (str): name
+        view_collection_name (str): collection-name of the view
+        view_db_name (str): db-name of the view in config (None: from collection_db_map)
+    """
+
+    def __init__(self, name, collection_name, view_collection_name, group_keys, aggregates, db_name=None, view_db_name=None):
+        self.name = name
+        self.collection_name = collection_name
+        self.view_collection_name = view_collection_name
+        self.group_keys = group_keys
+        self.aggregates = aggregates
+        self.db_name = db_name
+        self.view_db_name = view_db_name
+        self.is_built = False
+
+    def get_group_spec(self):
+        """Get the $group stage
+
+        Returns:
+            dict: $group stage
+        """
+        spec = {'_id': {str(idx): '$' + key for idx, key in enumerate(self.group_keys)} if self.group_keys else None}
+        for field, op, source_field, constant in self.aggregates:
+            spec[field] = {op: '$' + source_field if source_field is not None else constant}
+
+        return {'$group': spec}
+
+    def get_group(self, doc):
+        """Get the group (values of the group keys) of the doc
+
+        Args:
+            doc (dict): doc in the source collection
+
+        Returns:
+            tuple: group
+        """
+        return tuple([_to_hashable(util._get_value(doc, key)) for key in self.group_keys])
+
+    def get_group_key(self, group):
+        """Get the selection criteria of the group
+
+        Args:
+            group (tuple): group
+
+        Returns:
+            dict: the selection criteria
+        """
+        return {key: _from_hashable(val) for key, val in zip(self.group_keys, group)}
+
+
+def register(name, collection_name, view_collection_name, group_keys, aggregates, db_name=None, view_db_name=None):
+    """Register the materialized view (built with :py:meth:`build`)
+
+    Args:
+        name (str): name
+        collection_name (str): source collection-name
+        view_collection_name (str): collection-name of the view
+        group_keys ([str]): (dotted) group keys
+        aggregates (dict): {field: {'$sum': '$source-field' / constant, '$min': '$source-field', '$max': '$source-field'}}
+        db_name (str, optional): db-name of the source collection in config
+        view_db_name (str, optional): db-name of the view in config
+
+    Returns:
+        Error: error
+    """
+    if not group_keys and not aggregates:
+        return Exception('matview: no group keys and aggregates: name: %s' % (name))
+
+    if collection_name == view_collection_name and db_name == view_db_name:
+        return Exception('matview: view is the source collection: name: %s collection: %s' % (name, collection_name))
+
+    parsed_aggregates = []
+    for field, spec in aggregates.items():
+        if field in group_keys:
+            return Exception('matview: aggregate field is a group key: name: %s field: %s' % (name, field))
+        if not isinstance(spec, dict) or len(spec) != 1:
+            return Exception('matview: invalid aggregate: name: %s field: %s spec: %s' % (name, field, spec))
+
+        op, operand = list(spec.items())[0]
+        if op not in _OPS:
+            return Exception('matview: not supported op: name: %s field: %s op: %s' % (name, field, op))
+
+        if isinstance(operand, str) and operand.startswith('$'):
+            parsed_aggregates.append((field, op, operand[1:], None))
+        elif op == '$sum' and isinstance(operand, (int, float)) and not isinstance(operand, bool):
+            parsed_aggregates.append((field, op, None, operand))
+        else:
+            return Exception('matview: invalid operand: name: %s field: %s operand: %s' % (name, field, operand))
+
+    views[name] = MatView(name, collection_name, view_collection_name, list(group_keys), parsed_aggregates, db_name=db_name, view_db_name=view_db_name)
+
+    return None
+
+
+def unregister(name):
+    """Unregister the materialized view (the view collection is kept)
+
+    Args:
+        name (str): name
+    """
+    views.pop(name, None)
+
+
+def clean():
+    """Unregister all the materialized views
+    """
+    views.clear()
+
+
+def build(name):
+    """Build (or rebuild) the materialized view from the source collection with db_aggregate
+
+    Args:
+        name (str): name
+
+    Returns:
+        Error: error
+    """
+    view = views.get(name, None)
+    if view is None:
+        return Exception('matview: not registered: name: %s' % (name))
+
+    view.is_built = False
+
+    err, db_results = util.db_aggregate(view.collection_name, [view.get_group_spec()], db_name=view.db_name, is_cache=False)
+    if err:
+        return err
+
+    err, _ = util.db_force_remove(view.view_collection_name, {}, db_name=view.view_db_name)
+    if err:
+        return err
+
+    if db_results:
+        err = _set_groups(view, db_results)
+        if err:
+            return err
+
+    view.is_built = True
+
+    return None
+
+
+def on_insert(db_name, collection_name, docs):
+    """Recompute the groups of the inserted docs in the views of the collection
+
+    Args:
+        db_name (str): db-name in config
+        collection_name (str): collection-name
+        docs ([dict]): inserted docs (including the failed ones, the groups are recomputed from the collection).
+
+    Returns:
+        Error: error in updating the views
+    """
+    the_views = _get_views(db_name, collection_name)
+    if not the_views:
+        return None
+
+    errs = []
+    for view in the_views:
+        try:
+            err = _recompute_groups(view, set([view.get_group(each) for each in docs]))
+        except Exception as e:
+            err = e
+
+        if err:
+            errs.append((view, err))
+
+    return _get_views_err('insert', errs)
+
+
+def pre_write(db_name, collection_name, keys, is_remove=False):
+    """Get the groups of the docs matched by the selection criteria before the write
+
+    The keys are queried in chunks (of the $or), and only the group keys (and _id for the updates) are projected.
+
+    Args:
+        db_name (str): db-name in config
+        collection_name (str): collection-name
+        keys ([dict]): the selection criteria of the write
+        is_remove (bool, optional): whether the write is remove (no docs after the write).
+
+    Returns:
+        dict: state passed to :py:meth:`post_write`, None if no views of the collection.
+    """
+    if not keys:
+        return None
+
+    the_views = _get_views(db_name, collection_name)
+    if not the_views:
+        return None
+
+    state = {'db_name': db_name, 'collection_name': collection_name, 'views': the_views, 'keys': keys, 'is_remove': is_remove, 'ids': [], 'groups': [set() for _ in the_views], 'err': None}
+    try:
+        for idx in range(0, len(keys), _MAX_KEYS_IN_MATCH):
+            for doc in _find_group_docs(db_name, collection_name, the_views, _get_or_key(keys[idx:(idx + _MAX_KEYS_IN_MATCH)]), not is_remove):
+                if not is_remove:
+                    state['ids'].append(doc['_id'])
+                _add_groups(the_views, state['groups'], doc)
+    except Exception as e:
+        state['err'] = e
+
+    return state
+
+
+def post_write(state):
+    """Recompute the groups of the matched docs before and after the write
+
+    Args:
+        state (dict): from :py:meth:`pre_write`
+
+    Returns:
+        Error: error in updating the views (the views are stale, call build to rebuild)
+    """
+    if state is None:
+        return None
+
+    the_views = state['views']
+    groups_by_view = state['groups']
+
+    err = state['err']
+    if not err and not state['is_remove']:
+        ids = state['ids']
+        post_keys = [{'_id': {'$in': ids[idx:(idx + _MAX_KEYS_IN_MATCH)]}} for idx in range(0, len(ids), _MAX_KEYS_IN_MATCH)] + state['keys']
+        try:
+            for idx in range(0, len(post_keys), _MAX_KEYS_IN_MATCH):
+                for doc in _find_group_docs(state['db_name'], state['collection_name'], the_views, _get_or_key(post_keys[idx:(idx + _MAX_KEYS_IN_MATCH)]), False):
+                    _add_groups(the_views, groups_by_view, doc)
+        except Exception as e:
+            err = e
+
+    if err:
+        return _get_views_err('get the affected groups', [(view, err) for view in the_views])
+
+    errs = []
+    for view, groups in zip(the_views, groups_by_view):
+        try:
+            each_err = _recompute_groups(view, groups)
+        except Exception as e:
+            each_err = e
+
+        if each_err:
+            errs.append((view, each_err))
+
+    return _get_views_err('write', errs)
+
+
+def on_drop(db_name, collection_name):
+    """The collection is dropped: the views of the collection are emptied,
+    and the views stored in the collection are marked as not built.
+
+    Args:
+        db_name (str): db-name in config
+        collection_name (str): collection-name
+
+    Returns:
+        Error: error in emptying the views
+    """
+    if not views:
+        return None
+
+    ns = util._get_ns(db_name, collection_name)
+    if ns is None:
+        return None
+
+    errs = []
+    for view in list(views.values()):
+        if util._get_ns(_get_db_name(view.view_db_name, view.view_collection_name), view.view_collection_name) == ns:
+            view.is_built = False
+            continue
+
+        if util._get_ns(_get_db_name(view.db_name, view.collection_name), view.collection_name) != ns:
+            continue
+
+        err, _ = util.db_force_remove(view.view_collection_name, {}, db_name=view.view_db_name)
+        if err:
+            view.is_built = False
+            errs.append((view, err))
+
+    return _get_views_err('drop', errs)
+
+
+def _add_groups(the_views, groups_by_view, doc):
+    for view, groups in zip(the_views, groups_by_view):
+        groups.add(view.get_group(doc))
+
+
+def _get_views_err(op, errs):
+    """Get the error of updating the views
+
+    Args:
+        op (str): op of the source collection
+        errs ([(MatView, Error)]): errors
+
+    Returns:
+        Error: error, None if no errors.
+    """
+    if not errs:
+        return None
+
+    return Exception('matview: unable to apply %s, need to rebuild: %s' % (op, ', '.join(['name: %s e: %s' % (view.name, err) for view, err in errs])))
+
+
+def _get_views(db_name, collection_name):
+    """Get the built views of the collection (by the real collection in mongo)
+
+    Args:
+        db_name (str): db-name in config
+        collection_name (str): collection-name
+
+    Returns:
+        [MatView]: views
+    """
+    if not views:
+        return []
+
+    ns = util._get_ns(db_name, collection_name)
+    if ns is None:
+        return []
+
+    return [view for view in list(views.values()) if view.is_built and util._get_ns(_get_db_name(view.db_name, view.collection_name), view.collection_name) == ns]
+
+
+def _get_db_name(db_name, collection_name):
+    if db_name is not None:
+        return db_name
+
+    return util._get_default_db(collection_name)
+
+
+def _get_or_key(keys):
+    """Get the selection criteria matching any of the keys
+
+    Args:
+        keys ([dict]): the selection criteria
+
+    Returns:
+        dict: the selection criteria
+    """
+    if len(keys) == 1:
+        return keys[0]
+
+    return {'$or': keys}
+
+
+def _find_group_docs(db_name, collection_name, the_views, key, with_id):
+    """Find the docs with the group keys of the views (streamed)
+
+    Args:
+        db_name (str): db-name in config
+        collection_name (str): collection-name
+        the_views ([MatView]): views
+        key (dict): the selection criteria
+        with_id (bool): whether to include _id
+
+    Returns:
+        iterator: docs
+    """
+    fields = {group_key: True for view in the_views for group_key in view.group_keys}
+    fields['_id'] = with_id
+
+    err, db_result_it = util.db_find_it(collection_name, key, fields, with_id=with_id, db_name=db_name)
+    if err:
+        raise err
+
+    return db_result_it
+
+
+def _recompute_groups(view, groups):
+    """Recompute the groups with db_aggregate, the groups without the docs are removed from the view.
+
+    Args:
+        view (MatView): view
+        groups (set): groups
+
+    Returns:
+        Error: error
+    """
+    groups = list(groups)
+    for idx in range(0, len(groups), _MAX_GROUPS_IN_MATCH):
+        each_groups = groups[idx:(idx + _MAX_GROUPS_IN_MATCH)]
+        group_keys = [view.get_group_key(group) for group in each_groups]
+
+        pipe = [{'$match': _get_or_key(group_keys)}, view.get_group_spec()] if view.group_keys else [view.get_group_spec()]
+        err, db_results = util.db_aggregate(view.collection_name, pipe, db_name=view.db_name, is_cache=False)
+        if err:
+            return err
+
+        existing_groups = set([view.get_group(_get_group_doc(view, each)) for each in db_results])
+        removed_keys = [group_key for group, group_key in zip(each_groups, group_keys) if group not in existing_groups]
+        if removed_keys:
+            err, _ = util.db_force_remove(view.view_collection_name, _get_or_key(removed_keys), db_name=view.view_db_name)
+            if err:
+                return err
+
+        if db_results:
+            err = _set_groups(view, db_results)
+            if err:
+                return err
+
+    return None
+
+
+def _set_groups(view, db_results):
+    """Set the aggregated groups to the view (the null aggregated fields are unset)
+
+    Args:
+        view (MatView): view
+        db_results ([dict]): results of the $group stage
+
+    Returns:
+        Error: error
+    """
+    update_data = []
+    for each in db_results:
+        key = view.get_group_key(view.get_group(_get_group_doc(view, each)))
+        val = {'$set': {}, '$unset': {}}
+        for field, _, _, _ in view.aggregates:
+            if each.get(field, None) is None:
+                val['$unset'][field] = True
+                continue
+            val['$set'][field] = each[field]
+        val = {op: each_val for op, each_val in val.items() if each_val} or {'$set': key}
+        update_data.append({'key': key, 'val': val})
+
+    err, _ = util.db_force_bulk_update(view.view_collection_name, update_data, is_set=False, upsert=True, multi=False, db_name=view.view_db_name)
+
+    return err
+
+
+def _get_group_doc(view, db_result):
+    """Get the doc with the group keys from the result of the $group stage
+
+    Args:
+        view (MatView): view
+        db_result (dict): result of the $group stage
+
+    Returns:
+        dict: doc with the (dotted) group keys
+    """
+    the_id = db_result.get('_id', None) or {}
+
+    doc = {}
+    for idx, key in enumerate(view.group_keys):
+        _set_value(doc, key, the_id.get(str(idx), None))
+
+    return doc
+
+
+def _set_value(doc, key, val):
+    each_keys = key.split('.')
+    for each_key in each_keys[:-1]:
+        doc = doc.setdefault(each_key, {})
+    doc[each_keys[-1]] = val
+
+
+def _to_hashable(val):
+    if isinstance(val, collections.abc.Mapping):
+        return ('__dict__', tuple([(k, _to_hashable(v)) for k, v in val.items()]))
+    if isinstance(val, list):
+        return ('__list__', tuple([_to_hashable(each) for each in val]))
+
+    return val
+
+
+def _from_hashable(val):
+    if isinstance(val, tuple) and len(val) == 2 and val[0] == '__dict__':
+        return {k: _from_hashable(v) for k, v in val[1]}
+    if isinstance(val, tuple) and len(val) == 2 and val[0] == '__list__':
+        return [_from_hashable(each) for each in val[1]]
+
+    return val
@@ -0,0 +1,417 @@
+# -*- coding: utf-8 -*-
+"""Instrumentation of the db-ops in util.
+
+The db-ops decorated with :py:meth:`instrument` emit an event to the hooks after each call:
+
+    {
+        'type': 'op',
+        'op': function-name,
+        'parent_op': function-name of the enclosing db-op (None if called directly),
+        'collection_name': collection-name,
+        'params': bound arguments of the call,
+        'duration': sec,
+        'err': Error,
+        'n_docs': number of the returned / written docs,
+    }
+
+and :py:meth:`record_restart` emits {'type': 'restart', 'op', 'collection_name', 'db_name', 'err'},
+:py:meth:`record_retry` emits {'type': 'retry', 'op', 'collection_name', 'db_name', 'err', 'n_retries'}.
+
+The decorated db-ops call the functions directly if there are no hooks.
+
+The built-in recorder (:py:meth:`enable`) keeps per (collection-name, op):
+calls, errors, restarts, retries, n_docs and latency (histogram + recent samples for p50 / p95 / p99),
+as :py:meth:`snapshot` or :py:meth:`to_prometheus`.
+
+Attributes:
+    latency_buckets (tuple): upper-bounds (sec) of the latency histogram.
+    n_latency_samples (int): number of the recent latency samples for the percentiles.
+"""
+import collections
+import functools
+import inspect
+import logging
+import threading
+import time
+
+
+latency_buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+n_latency_samples = 1024
+
+_hooks = []
+
+_lock = threading.Lock()
+_stats = {}
+
+_local = threading.local()
+
+_logger = logging.getLogger(__name__)
+
+
+class _OpStats(object):
+    """Stats of (collection-name, op)
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.restarts = 0
+        self.retries = 0
+        self.n_docs = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.latency_bucket_counts = [0] * (len(latency_buckets) + 1)
+        self.latency_samples = collections.deque(maxlen=n_latency_samples)
+
+    def add(self, duration, is_err, n_docs):
+        self.calls += 1
+        if is_err:
+            self.errors += 1
+        self.n_docs += n_docs
+        self.latency_sum += duration
+        self.latency_max = max(self.latency_max, duration)
+        self.latency_bucket_counts[_get_bucket_idx(duration)] += 1
+        self.latency_samples.append(duration)
+
+    def to_dict(self):
+        samples = sorted(self.latency_samples)
+
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'restarts': self.restarts,
+            'retries': self.retries,
+            'n_docs': self.n_docs,
+            'latency': {
+                'sum': self.latency_sum,
+                'max': self.latency_max,
+                'p50': _percentile(samples, 0.50),
+                'p95': _percentile(samples, 0.95),
+                'p99': _percentile(samples, 0.99),
+                'buckets': list(zip(latency_buckets + (float('inf'),), _accumulate(self.latency_bucket_counts))),
+            },
+        }
+
+
+def add_hook(hook):
+    """Add the hook, called with the event after each instrumented db-op.
+
+    Args:
+        hook (function): hook(event)
+    """
+    with _lock:
+        if hook not in _hooks:
+            _hooks.append(hook)
+
+
+def remove_hook(hook):
+    """Remove the hook
+
+    Args:
+        hook (function): hook(event)
+    """
+    with _lock:
+        if hook in _hooks:
+            _hooks.remove(hook)
+
+
+def enable():
+    """Enable the built-in recorder
+    """
+    add_hook(_record)
+
+
+def disable():
+    """Disable the built-in recorder
+    """
+    remove_hook(_record)
+
+
+def reset():
+    """Reset the stats of the built-in recorder
+    """
+    with _lock:
+        _stats.clear()
+
+
+def snapshot():
+    """Snapshot of the stats of the built-in recorder
+
+    Returns:
+        dict: {collection-name: {op: {calls, errors, restarts, retries, n_docs, latency: {sum, max, p50, p95, p99, buckets}}}}
+    """
+    with _lock:
+        result = {}
+        for (collection_name, op), op_stats in _stats.items():
+            result.setdefault(collection_name, {})[op] = op_stats.to_dict()
+
+    return result
+
+
+def to_prometheus(prefix='pyutil_mongo'):
+    """Stats of the built-in recorder in the Prometheus text format.
+
+    Args:
+        prefix (str, optional): prefix of the metric-names.
+
+    Returns:
+        str: Prometheus text
+    """
+    the_snapshot = snapshot()
+
+    lines = []
+    for name, key, help_str in [
+        ('calls_total', 'calls', 'number of calls'),
+        ('errors_total', 'errors', 'number of calls with error'),
+        ('restarts_total', 'restarts', 'number of mongo-restarts'),
+        ('retries_total', 'retries', 'number of retries'),
+        ('docs_total', 'n_docs', 'number of returned / written docs'),
+    ]:
+        lines.append('# HELP %s_%s %s' % (prefix, name, help_str))
+        lines.append('# TYPE %s_%s counter' % (prefix, name))
+        for collection_name, stats_by_op in sorted(the_snapshot.items()):
+            for op, op_stats in sorted(stats_by_op.items()):
+                lines.append('%s_%s{%s} %s' % (prefix, name, _get_labels(collection_name, op), op_stats[key]))
+
+    lines.append('# HELP %s_latency_seconds latency of calls' % (prefix))
+    lines.append('# TYPE %s_latency_seconds histogram' % (prefix))
+    for collection_name, stats_by_op in sorted(the_snapshot.items()):
+        for op, op_stats in sorted(stats_by_op.items()):
+            labels = _get_labels(collection_name, op)
+            for upper_bound, count in op_stats['latency']['buckets']:
+                le = '+Inf' if upper_bound == float('inf') else repr(upper_bound)
+                lines.append('%s_latency_seconds_bucket{%s,le="%s"} %s' % (prefix, labels, le, count))
+            lines.append('%s_latency_seconds_sum{%s} %s' % (prefix, labels, repr(op_stats['latency']['sum'])))
+            lines.append('%s_latency_seconds_count{%s} %s' % (prefix, labels, op_stats['calls']))
+
+    lines.append('# HELP %s_latency_quantile_seconds latency quantiles of the recent calls' % (prefix))
+    lines.append('# TYPE %s_latency_quantile_seconds gauge' % (prefix))
+    for collection_name, stats_by_op in sorted(the_snapshot.items()):
+        for op, op_stats in sorted(stats_by_op.items()):
+            labels = _get_labels(collection_name, op)
+            for quantile, key in [('0.5', 'p50'), ('0.95', 'p95'), ('0.99', 'p99')]:
+                lines.append('%s_latency_quantile_seconds{%s,quantile="%s"} %s' % (prefix, labels, quantile, repr(op_stats['latency'][key])))
+
+    return '\n'.join(lines) + '\n'
+
+
+def instrument(func):
+    """Decorator instrumenting the db-op (with collection_name as the 1st argument)
+
+    Args:
+        func (function): db-op
+
+    Returns:
+        function: instrumented db-op
+    """
+    signature = inspect.signature(func)
+    op = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _hooks:
+            return func(*args, **kwargs)
+
+        parent_op = getattr(_local, 'op', None)
+        _local.op = op
+
+        err = None
+        result = None
+        start_timestamp = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            err = e
+            raise
+        finally:
+            duration = time.perf_counter() - start_timestamp
+            _local.op = parent_op
+
+            try:
+                params = signature.bind(*args, **kwargs)
+                params.apply_defaults()
+                params = params.arguments
+            except TypeError:
+                params = {}
+
+            val = None
+            if err is None:
+                err, val = _get_err_val(result)
+
+            _emit({
+                'type': 'op',
+                'op': op,
+                'parent_op': parent_op,
+                'collection_name': params.get('collection_name', ''),
+                'params': params,
+                'duration': duration,
+                'err': err,
+                'n_docs': _count_docs(val),
+            })
+
+        return result
+
+    return wrapper
+
+
+def record_restart(db_name, collection_name, e):
+    """Record the mongo-restart from the db-op.
+
+    Args:
+        db_name (str): db-name in config
+        collection_name (str): collection-name
+        e (Exception): exception triggering the restart.
+    """
+    if not _hooks:
+        return
+
+    _emit({
+        'type': 'restart',
+        'op': getattr(_local, 'op', None) or '',
+        'collection_name': collection_name,
+        'db_name': db_name,
+        'err': e,
+    })
+
+
+def record_retry(db_name, collection_name, e, n_retries):
+    """Record the retry of the db-op.
+
+    Args:
+        db_name (str): db-name in config
+        collection_name (str): collection-name
+        e (Exception): exception triggering the retry.
+        n_retries (int): n-th retry
+    """
+    if not _hooks:
+        return
+
+    _emit({
+        'type': 'retry',
+        'op': getattr(_local, 'op', None) or '',
+        'collection_name': collection_name,
+        'db_name': db_name,
+        'err': e,
+        'n_retries': n_retries,
+    })
+
+
+def _emit(event):
+    """Emit the event to the hooks
+
+    Args:
+        event (dict): event
+    """
+    for hook in list(_hooks):
+        try:
+            hook(event)
+        except Exception as e:
+            _logger.warning('metrics: hook failed: hook: %s e: %s', hook, e)
+
+
+def _record(event):
+    """The built-in recorder
+
+    Args:
+        event (dict): event
+    """
+    key = (event['collection_name'], event['op'])
+    with _lock:
+        op_stats = _stats.get(key, None)
+        if op_stats is None:
+            op_stats = _OpStats()
+            _stats[key] = op_stats
+
+        if event['type'] == 'restart':
+            op_stats.restarts += 1
+            return
+
+        if event['type'] == 'retry':
+            op_stats.retries += 1
+            return
+
+        op_stats.add(event['duration'], event['err'] is not None, event['n_docs'])
+
+
+def _get_err_val(result):
+    """Get (err, val) from the result of the db-op
+
+    Args:
+        result (object): (err, val) or err
+
+    Returns:
+        (Error, object): err, val
+    """
+    if isinstance(result, tuple) and len(result) == 2:
+        return result
+
+    if isinstance(result, Exception):
+        return result, None
+
+    return None, result
+
+
+def _count_docs(val):
+    """Count the returned / written docs
+
+    Args:
+        val (object): db-result
+
+    Returns:
+        int: number of docs
+    """
+    if val is None:
+        return 0
+
+    if isinstance(val, list):
+        return len(val)
+
+    inserted_ids = getattr(val, 'inserted_ids', None)
+    if inserted_ids is not None:
+        return len(inserted_ids)
+
+    if not isinstance(val, dict):
+        return 0
+
+    # raw-result of bulk-op
+    if 'nUpserted' in val:
+        return val.get('nInserted', 0) + val.get('nUpserted', 0) + val.get('nModified', 0) + val.get('nRemoved', 0)
+
+    # raw-result of update / remove
+    if 'n' in val and 'ok' in val:
+        return val['n']
+
+    return 1 if val else 0
+
+
+def _get_bucket_idx(duration):
+    for idx, upper_bound in enumerate(latency_buckets):
+        if duration <= upper_bound:
+            return idx
+
+    return len(latency_buckets)
+
+
+def _accumulate(counts):
+    result = []
+    total = 0
+    for each in counts:
+        total += each
+        result.append(total)
+
+    return result
+
+
+def _percentile(samples, ratio):
+    if not samples:
+        return 0.0
+
+    return samples[min(int(ratio * len(samples)), len(samples) - 1)]
+
+
+def _get_labels(collection_name, op):
+    return 'collection="%s",op="%s"' % (_escape_label(collection_name), _escape_label(op))
+
+
+def _escape_label(val):
+    return str(val).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
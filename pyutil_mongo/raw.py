@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""Helpers of the raw mode (is_raw=True in db_find_one / db_find / db_find_it, and db_find_raw_batches).
+
+In the raw mode the docs are RawBSONDocument: the BSON bytes from the server are kept as-is,
+and only the accessed fields are decoded. The docs can be written out without decoding:
+
+    err, db_result_it = util.db_find_it('a', {'key1': 'a'}, is_raw=True)
+    err, n_docs = raw.write_bson(db_result_it, f)
+
+    for err, batch in util.db_find_raw_batches('a', {'key1': 'a'}):
+        f.write(batch)
+"""
+import bson
+import bson.codec_options
+import bson.json_util
+import bson.raw_bson
+
+
+_RAW_CODEC_OPTIONS = bson.codec_options.CodecOptions(document_class=bson.raw_bson.RawBSONDocument)
+
+
+def iter_raw_batch(batch):
+    """Iterate the docs in the raw BSON batch (from db_find_raw_batches) as RawBSONDocument
+
+    Args:
+        batch (bytes): concatenated BSON docs
+
+    Returns:
+        iterator: RawBSONDocument
+    """
+    return bson.decode_iter(batch, codec_options=_RAW_CODEC_OPTIONS)
+
+
+def to_bson(doc):
+    """Get the BSON bytes of the doc (without re-encoding RawBSONDocument)
+
+    Args:
+        doc (RawBSONDocument / dict / bytes): doc
+
+    Returns:
+        bytes: BSON
+    """
+    if isinstance(doc, bson.raw_bson.RawBSONDocument):
+        return doc.raw
+
+    if isinstance(doc, (bytes, bytearray, memoryview)):
+        return bytes(doc)
+
+    return bson.encode(doc)
+
+
+def write_bson(docs, fp):
+    """Write the docs as concatenated BSON (as mongodump / mongorestore)
+
+    Args:
+        docs (iterator): RawBSONDocument / dict / bytes
+        fp (file): binary file-object
+
+    Returns:
+        (Error, int): number of the written docs
+    """
+    n_docs = 0
+    try:
+        for each in docs:
+            fp.write(to_bson(each))
+            n_docs += 1
+    except Exception as e:
+        return e, n_docs
+
+    return None, n_docs
+
+
+def write_jsonl(docs, fp, json_options=bson.json_util.RELAXED_JSON_OPTIONS):
+    """Write the docs as extended JSON, one doc per line.
+
+    Args:
+        docs (iterator): RawBSONDocument / dict / bytes
+        fp (file): text file-object
+        json_options (JSONOptions, optional): extended JSON options (relaxed / canonical)
+
+    Returns:
+        (Error, int): number of the written docs
+    """
+    n_docs = 0
+    try:
+        for each in docs:
+            if isinstance(each, (bytes, bytearray, memoryview)):
+                each = bson.raw_bson.RawBSONDocument(bytes(each))
+            fp.write(bson.json_util.dumps(each, json_options=json_options))
+            fp.write('\n')
+            n_docs += 1
+    except Exception as e:
+        return e, n_docs
+
+    return None, n_docs
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""Retry policy of the reads and the idempotent writes in util.
+
+The policy of the db-op is resolved as: the retry_policy of the call > MongoMap.retry_policy > default_policy
+(no retry if all are None).
+
+The retried db-ops are re-issued after the mongo-restart (see :py:mod:`pyutil_mongo.breaker`)
+with exponential backoff and jitter. The retries are emitted as the 'retry' events in :py:mod:`pyutil_mongo.metrics`,
+and the number of the retries of the last db-op in the thread is :py:meth:`last_retries`.
+
+Attributes:
+    default_policy (RetryPolicy): default retry policy, None as no retry.
+"""
+import random
+import threading
+import time
+
+from . import breaker
+
+
+default_policy = None
+
+_local = threading.local()
+
+
+class RetryPolicy(object):
+    """Retry policy
+
+    Attributes:
+        base_backoff (float): backoff (sec) before the 1st retry, doubled in each retry.
+        errors (tuple): the retried exception-classes, None as the connection-level errors.
+        jitter (float): ratio of the randomly reduced backoff (0: no jitter, 1: full jitter).
+        max_attempts (int): max number of attempts (including the 1st one).
+        max_backoff (float): max backoff (sec)
+    """
+
+    def __init__(self, max_attempts=3, base_backoff=0.1, max_backoff=2.0, jitter=0.5, errors=None):
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.errors = errors
+
+    def is_retryable(self, e):
+        """Whether the error is retried
+
+        Args:
+            e (Exception): exception
+
+        Returns:
+            bool: Description
+        """
+        if isinstance(e, breaker.CircuitOpenError):
+            return False
+
+        if self.errors is None:
+            return breaker.is_connection_error(e)
+
+        return isinstance(e, self.errors)
+
+    def get_backoff(self, n_retries):
+        """Get the backoff before the n-th retry
+
+        Args:
+            n_retries (int): n-th retry (from 1)
+
+        Returns:
+            float: backoff (sec)
+        """
+        backoff = min(self.max_backoff, self.base_backoff * (2 ** (n_retries - 1)))
+
+        return backoff * (1.0 - self.jitter * random.random())
+
+
+def set_default_policy(policy):
+    """Set the default retry policy
+
+    Args:
+        policy (RetryPolicy): default retry policy, None as no retry.
+    """
+    global default_policy
+
+    default_policy = policy
+
+
+def last_retries():
+    """Number of the retries of the last db-op (with the retry policy) in the thread.
+
+    Returns:
+        int: number of retries
+    """
+    return getattr(_local, 'n_retries', 0)
+
+
+def call(func, policy, on_retry=None):
+    """Call func with the retry policy
+
+    Args:
+        func (function): func()
+        policy (RetryPolicy): retry policy, None as no retry.
+        on_retry (function, optional): on_retry(e, n_retries), called before each retry.
+
+    Returns:
+        object: result of func, raising the last exception if not retried.
+    """
+    n_retries = 0
+    try:
+        while True:
+            try:
+                return func()
+            except Exception as e:
+                if policy is None or n_retries + 1 >= policy.max_attempts or not policy.is_retryable(e):
+                    raise
+
+                n_retries += 1
+                if on_retry is not None:
+                    on_retry(e, n_retries)
+
+                time.sleep(policy.get_backoff(n_retries))
+    finally:
+        # set after the nested db-ops.
+        _local.n_retries = n_retries
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""Parallel scan of a collection by the ranges of an (indexed) key.
+
+The collection is split into ranges [lo, hi) of the key by the sampled split-points,
+and the ranges are scanned concurrently with db_find_batches.
+
+The state ({'ranges', 'completed', 'n_docs'}) is returned after the scan,
+and can be passed back as state to resume from the not-completed ranges.
+(The docs of a failed range may have been passed to the callback before the failure, the range is scanned again in the resume.)
+
+The key should exist with the same BSON type in all the docs (as _id usually does),
+the range-queries ($gte / $lt) do not match the docs with the missing key or with the other types.
+"""
+import concurrent.futures
+import queue
+import threading
+
+from . import util
+
+
+def db_scan_ranges(collection_name, key='_id', query=None, n_ranges=8, sample_size=None, db_name=None):
+    """Split the collection into ranges of the key by the sampled split-points.
+
+    Args:
+        collection_name (str): collection-name
+        key (str, optional): the (indexed) key to split.
+        query (dict, optional): the selection criteria
+        n_ranges (int, optional): (max) number of ranges
+        sample_size (int, optional): number of sampled docs, default 20 * n_ranges
+        db_name (str, optional): db-name in config
+
+    Returns:
+        (Error, [(lo, hi)]): ranges, None as unbounded.
+    """
+    if n_ranges <= 1:
+        return None, [(None, None)]
+
+    if not sample_size:
+        sample_size = 20 * n_ranges
+
+    pipe = []
+    if query:
+        pipe.append({'$match': query})
+    pipe += [
+        {'$sample': {'size': sample_size}},
+        {'$project': {'_id': True} if key == '_id' else {key: True, '_id': False}},
+        {'$sort': {key: 1}},
+    ]
+
+    err, db_results = util.db_aggregate(collection_name, pipe, db_name=db_name)
+    if err:
+        return err, []
+
+    values = [util._get_value(each, key) for each in db_results]
+    values = [each for each in values if each is not None]
+
+    split_points = []
+    for idx in range(1, n_ranges):
+        if not values:
+            break
+        each_value = values[idx * len(values) // n_ranges]
+        if split_points and split_points[-1] == each_value:
+            continue
+        split_points.append(each_value)
+
+    boundaries = [None] + split_points + [None]
+    ranges = [(boundaries[idx], boundaries[idx + 1]) for idx in range(len(boundaries) - 1)]
+
+    return None, ranges
+
+
+def db_parallel_scan(collection_name, callback, query=None, fields=None, key='_id', n_ranges=8, max_workers=4, batch_size=1000, state=None, executor=None, db_name=None):
+    """Scan the collection by the ranges concurrently, passing the docs to callback.
+
+    Args:
+        collection_name (str): collection-name
+        callback (function): callback(range_idx, docs), called in the workers.
+        query (dict, optional): the selection criteria
+        fields (dict, optional): resulting fields
+        key (str, optional): the (indexed) key to split.
+        n_ranges (int, optional): (max) number of ranges
+        max_workers (int, optional): number of the concurrently scanned ranges.
+        batch_size (int, optional): number of docs in each callback.
+        state (dict, optional): state returned from the previous scan, to resume from the not-completed ranges.
+        executor (concurrent.futures.Executor, optional): the executor (ex: ProcessPoolExecutor,
+            with cfg initialized in the workers and picklable callback), default ThreadPoolExecutor(max_workers).
+        db_name (str, optional): db-name in config
+
+    Returns:
+        (Error, dict): state: {ranges, completed, n_docs}
+    """
+    if state is None:
+        err, ranges = db_scan_ranges(collection_name, key=key, query=query, n_ranges=n_ranges, db_name=db_name)
+        if err:
+            return err, {'ranges': [], 'completed': [], 'n_docs': 0}
+        state = {'ranges': ranges, 'completed': [], 'n_docs': 0}
+    else:
+        state = {'ranges': state['ranges'], 'completed': list(state['completed']), 'n_docs': state.get('n_docs', 0)}
+
+    completed = set(state['completed'])
+    range_idxs = [idx for idx in range(len(state['ranges'])) if idx not in completed]
+
+    errs = []
+    the_executor = executor if executor is not None else concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        futures = {
+            the_executor.submit(_scan_range, collection_name, callback, idx, state['ranges'][idx], query, fields, key, batch_size, db_name): idx
+            for idx in range_idxs
+        }
+
+        for future in concurrent.futures.as_completed(futures):
+            idx = futures[future]
+            try:
+                each_err, each_n_docs = future.result()
+            except Exception as e:
+                each_err, each_n_docs = e, 0
+
+            if each_err:
+                errs.append('(%s/%s) e: %s' % (idx, len(state['ranges']), each_err))
+                continue
+
+            state['completed'].append(idx)
+            state['n_docs'] += each_n_docs
+    finally:
+        if executor is None:
+            the_executor.shutdown(wait=True)
+
+    state['completed'].sort()
+
+    err = None if not errs else Exception(','.join(errs))
+
+    return err, state
+
+
+def db_parallel_scan_it(collection_name, query=None, fields=None, key='_id', n_ranges=8, max_workers=4, batch_size=1000, state=None, max_queued_batches=None, db_name=None):
+    """Scan the collection by the ranges concurrently, merged as an iterator of batches.
+
+    The memory is bounded by max_queued_batches, the workers wait if the iterator is not consumed.
+
+    Args:
+        collection_name (str): collection-name
+        query (dict, optional): the selection criteria
+        fields (dict, optional): resulting fields
+        key (str, optional): the (indexed) key to split.
+        n_ranges (int, optional): (max) number of ranges
+        max_workers (int, optional): number of the concurrently scanned ranges.
+        batch_size (int, optional): number of docs in each batch.
+        state (dict, optional): state returned from the previous scan, to resume from the not-completed ranges.
+        max_queued_batches (int, optional): max number of the not-consumed batches, default 2 * max_workers.
+        db_name (str, optional): db-name in config
+
+    Yields:
+        (Error, list): docs in each batch (in any order of the ranges), the last one is (err, state).
+    """
+    if not max_queued_batches:
+        max_queued_batches = 2 * max_workers
+
+    the_queue = queue.Queue(maxsize=max_queued_batches)
+    is_stop = threading.Event()
+    results = []
+
+    def _put(docs):
+        while not is_stop.is_set():
+            try:
+                the_queue.put(docs, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _callback(range_idx, docs):
+        if not _put(docs):
+            raise Exception('db_parallel_scan_it: stopped')
+
+    def _scan():
+        try:
+            results.append(db_parallel_scan(collection_name, _callback, query=query, fields=fields, key=key, n_ranges=n_ranges, max_workers=max_workers, batch_size=batch_size, state=state, db_name=db_name))
+        except Exception as e:
+            results.append((e, state))
+        finally:
+            _put(None)
+
+    thread = threading.Thread(target=_scan, daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            docs = the_queue.get()
+            if docs is None:
+                break
+            yield None, docs
+
+        thread.join()
+        err, the_state = results[0]
+        yield err, the_state
+    finally:
+        is_stop.set()
+
+
+def _scan_range(collection_name, callback, range_idx, the_range, query, fields, key, batch_size, db_name):
+    """Scan the range [lo, hi) of the key
+
+    Args:
+        collection_name (str): collection-name
+        callback (function): callback(range_idx, docs)
+        range_idx (int): index of the range
+        the_range ((lo, hi)): the range
+        query (dict): the selection criteria
+        fields (dict): resulting fields
+        key (str): key of the range
+        batch_size (int): number of docs in each callback.
+        db_name (str): db-name in config
+
+    Returns:
+        (Error, int): number of the scanned docs
+    """
+    range_query = _get_range_query(query, key, the_range)
+
+    n_docs = 0
+    for err, docs in util.db_find_batches(collection_name, range_query, fields=fields, batch_size=batch_size, db_name=db_name):
+        if err:
+            return err, n_docs
+        callback(range_idx, docs)
+        n_docs += len(docs)
+
+    return None, n_docs
+
+
+def _get_range_query(query, key, the_range):
+    """Get the selection criteria of the range
+
+    Args:
+        query (dict): the selection criteria
+        key (str): key of the range
+        the_range ((lo, hi)): the range, None as unbounded.
+
+    Returns:
+        dict: selection criteria
+    """
+    lo, hi = the_range
+    range_cond = {}
+    if lo is not None:
+        range_cond['$gte'] = lo
+    if hi is not None:
+        range_cond['$lt'] = hi
+
+    if not range_cond:
+        return query
+
+    if not query:
+        return {key: range_cond}
+
+    return {'$and': [query, {key: range_cond}]}
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""Slow-op log with the query-shapes (as a hook of :py:mod:`pyutil_mongo.metrics`)
+
+The selection criteria / pipelines of the db-ops are normalized into the shapes by stripping the literal values
+(ex: {'key1': 'a', 'key2': {'$in': [1, 2, 3]}} => {"key1": "?", "key2": {"$in": "?"}}).
+The counts and the latency are aggregated by (op, collection-name, shape),
+and the db-ops over the threshold are logged with cfg.logger.
+
+Attributes:
+    threshold_ms (float): the db-ops over the threshold (ms) are logged.
+"""
+import json
+import logging
+import threading
+
+from . import cfg
+from . import metrics
+
+
+threshold_ms = 100.0
+
+_lock = threading.Lock()
+_stats = {}
+
+_logger = logging.getLogger(__name__)
+
+# params of the db-ops with the selection criteria / pipelines.
+_QUERY_PARAMS = ('key', 'query', 'query_key', 'pipe')
+
+# key is the field-name in the extreme ops (as in advisor), the selection criteria is query.
+_QUERY_PARAMS_BY_OP = {
+    'db_max': ('query',),
+    'db_min': ('query',),
+    'db_max_many': ('query',),
+    'db_min_many': ('query',),
+}
+
+
+def enable(the_threshold_ms=100.0):
+    """Enable the slow-op log
+
+    Args:
+        the_threshold_ms (float, optional): the db-ops over the threshold (ms) are logged.
+    """
+    global threshold_ms
+
+    threshold_ms = the_threshold_ms
+
+    metrics.add_hook(_record)
+
+
+def disable():
+    """Disable the slow-op log
+    """
+    metrics.remove_hook(_record)
+
+
+def reset():
+    """Reset the aggregated stats
+    """
+    with _lock:
+        _stats.clear()
+
+
+def get_shape(obj):
+    """Normalize the selection criteria / pipeline into the shape by stripping the literal values.
+
+    The keys, the operators and the field-paths ('$field') are kept.
+
+    Args:
+        obj (object): selection criteria / pipeline
+
+    Returns:
+        object: shape
+    """
+    if isinstance(obj, dict):
+        return {key: _get_shape_by_key(key, val) for key, val in obj.items()}
+
+    if isinstance(obj, (list, tuple)):
+        if not any([isinstance(each, (dict, list, tuple)) for each in obj]):
+            return '?'
+        return [get_shape(each) for each in obj]
+
+    if isinstance(obj, str) and obj.startswith('$'):
+        return obj
+
+    return '?'
+
+
+def get_shape_str(op, params):
+    """Get the shape of the db-op as str
+
+    Args:
+        op (str): db-op
+        params (dict): params of the db-op
+
+    Returns:
+        str: shape
+    """
+    for param in _QUERY_PARAMS_BY_OP.get(op, _QUERY_PARAMS):
+        if param in params:
+            return json.dumps(get_shape(params[param]))
+
+    update_data = params.get('update_data', None)
+    if update_data:
+        shapes = []
+        for each_data in update_data:
+            each_shape = json.dumps(get_shape(each_data.get('key', {})))
+            if each_shape not in shapes:
+                shapes.append(each_shape)
+        return '[' + ', '.join(shapes) + ']'
+
+    return ''
+
+
+def report(n=20, sort_by='total_ms'):
+    """Report of the shapes, ranked by sort_by.
+
+    Args:
+        n (int, optional): number of the shapes
+        sort_by (str, optional): total_ms / max_ms / avg_ms / count / n_slow
+
+    Returns:
+        list: [{op, collection_name, shape, count, n_slow, n_errors, total_ms, avg_ms, max_ms}]
+    """
+    with _lock:
+        results = [dict(each) for each in _stats.values()]
+
+    for each in results:
+        each['avg_ms'] = each['total_ms'] / each['count'] if each['count'] else 0.0
+
+    results.sort(key=lambda x: x[sort_by], reverse=True)
+
+    return results[:n]
+
+
+def format_report(n=20, sort_by='total_ms'):
+    """Report of the shapes as text
+
+    Args:
+        n (int, optional): number of the shapes
+        sort_by (str, optional): total_ms / max_ms / avg_ms / count / n_slow
+
+    Returns:
+        str: report
+    """
+    lines = ['%10s %8s %8s %12s %10s %10s  %s' % ('count', 'n_slow', 'n_errors', 'total_ms', 'avg_ms', 'max_ms', 'op collection shape')]
+    for each in report(n=n, sort_by=sort_by):
+        lines.append('%10d %8d %8d %12.1f %10.2f %10.2f  %s %s %s' % (each['count'], each['n_slow'], each['n_errors'], each['total_ms'], each['avg_ms'], each['max_ms'], each['op'], each['collection_name'], each['shape']))
+
+    return '\n'.join(lines)
+
+
+def _get_shape_by_key(key, val):
+    # the values of $in / $nin / $all are literals as a whole.
+    if key in ('$in', '$nin', '$all'):
+        return '?'
+
+    return get_shape(val)
+
+
+def _record(event):
+    """Record the event from metrics
+
+    Args:
+        event (dict): event
+    """
+    # only the db-ops called directly (db_find => db_find_it is recorded once).
+    if event['type'] != 'op' or event['parent_op'] is not None:
+        return
+
+    op = event['op']
+    collection_name = event['collection_name']
+    shape = get_shape_str(op, event['params'])
+    duration_ms = event['duration'] * 1000.0
+    is_slow = duration_ms >= threshold_ms
+
+    key = (op, collection_name, shape)
+    with _lock:
+        stats = _stats.get(key, None)
+        if stats is None:
+            stats = {'op': op, 'collection_name': collection_name, 'shape': shape, 'count': 0, 'n_slow': 0, 'n_errors': 0, 'total_ms': 0.0, 'max_ms': 0.0}
+            _stats[key] = stats
+
+        stats['count'] += 1
+        stats['total_ms'] += duration_ms
+        stats['max_ms'] = max(stats['max_ms'], duration_ms)
+        if event['err'] is not None:
+            stats['n_errors'] += 1
+        if is_slow:
+            stats['n_slow'] += 1
+
+    if is_slow:
+        logger = cfg.logger if cfg.logger is not None else _logger
+        logger.warning('slow op: %.1f ms: op: %s collection: %s shape: %s', duration_ms, op, collection_name, shape)
@@ -1,9 +1,27 @@
 # -*- coding: utf-8 -*-
 
 import re
-import copy
+import collections.abc
+import concurrent.futures
+import itertools
+
+import bson
+import pymongo
+import pymongo.errors
 
 from . import cfg
+from . import cache
+from . import metrics
+from . import breaker
+from . import retry
+from . import raw
+from . import matview
+
+# for the nested db-ops (retried and restarted in the enclosing db-op).
+_NO_RETRY = retry.RetryPolicy(max_attempts=1)
+
+# for the non-idempotent db-ops.
+_ONCE = retry.RetryPolicy(max_attempts=1)
 
 
 def db_list():
@@ -31,13 +49,16 @@ def db_find_one_ne(collection_name, key, fields=None, db_name=None):
     return result
 
 
-def db_find_one(collection_name, key, fields=None, db_name=None):
+@metrics.instrument
+def db_find_one(collection_name, key, fields=None, db_name=None, retry_policy=None, is_raw=False):
     """Find one data from the db with customized defaults
 
     Args:
         db_name (str): db-name in config
         key (dict): The selection criteria
         fields (dict, optional): Resulting fields.
+        retry_policy (RetryPolicy, optional): retry policy (see :py:mod:`pyutil_mongo.retry`).
+        is_raw (bool, optional): whether to return RawBSONDocument (not cached, see :py:mod:`pyutil_mongo.raw`).
 
     Returns:
         (Error, dict): db-result
@@ -51,18 +72,27 @@ def db_find_one(collection_name, key, fields=None, db_name=None):
     if db_name is None:
         return Exception('unable to get db_name: collection: %s' % (collection_name)), {}
 
+    ns = _get_cache_ns(db_name, collection_name) if not is_raw else None
+    if ns is not None:
+        is_hit, result = cache.get_result(ns, collection_name, 'db_find_one', key, fields)
+        if is_hit:
+            return None, result
+        cache_version = cache.get_version(ns)
+
     err = None
     result = {}
     try:
-        result = cfg.config[db_name]['db'][collection_name].find_one(key, projection=fields)
+        result = _db_run_with_retry(db_name, collection_name, retry_policy, lambda: _get_collection(db_name, collection_name, is_raw=is_raw).find_one(key, projection=fields))
         if not result:
             result = {}
-        result = dict(result)
+        if not is_raw:
+            result = dict(result)
     except Exception as e:
         err = e
         result = {}
 
-        _db_restart_mongo(db_name, collection_name, e)
+    if ns is not None and not err:
+        cache.set_result(ns, collection_name, 'db_find_one', key, fields, result, cache_version)
 
     return err, result
 
@@ -83,13 +113,16 @@ def db_find_ne(collection_name, key=None, fields=None, db_name=None):
     return result
 
 
-def db_find(collection_name, key=None, fields=None, db_name=None):
+@metrics.instrument
+def db_find(collection_name, key=None, fields=None, db_name=None, retry_policy=None, is_raw=False):
     """Find data from the db with customized defaults
 
     Args:
         db_name (str): db-name in config
         key (dict, optional): The selection criteria
         fields (dict, optional): Resulting fields.
+        retry_policy (RetryPolicy, optional): retry policy (see :py:mod:`pyutil_mongo.retry`).
+        is_raw (bool, optional): whether to return RawBSONDocument (not cached, see :py:mod:`pyutil_mongo.raw`).
 
     Returns:
         (Error, list): db-results
@@ -97,16 +130,36 @@ def db_find(collection_name, key=None, fields=None, db_name=None):
     if fields is None:
         fields = {'_id': False}
 
+    if db_name is None:
+        db_name = _get_default_db(collection_name)
+
+    if db_name is None:
+        return Exception('unable to get db_name: collection: %s' % (collection_name)), []
+
+    ns = _get_cache_ns(db_name, collection_name) if not is_raw else None
+    if ns is not None:
+        is_hit, result = cache.get_result(ns, collection_name, 'db_find', key, fields)
+        if is_hit:
+            return None, result
+        cache_version = cache.get_version(ns)
+
     err = None
     result = []
+
+    def _find():
+        each_err, db_result_it = db_find_it(collection_name, key, fields, db_name=db_name, is_raw=is_raw)
+        if each_err:
+            raise each_err
+        return list(db_result_it)
+
     try:
-        err, db_result_it = db_find_it(collection_name, key, fields, db_name)
-        result = list(db_result_it)
+        result = _db_run_with_retry(db_name, collection_name, retry_policy, _find)
     except Exception as e:
         err = e
         result = []
 
-        _db_restart_mongo(db_name, collection_name, e)
+    if ns is not None and not err:
+        cache.set_result(ns, collection_name, 'db_find', key, fields, result, cache_version)
 
     return err, result
 
@@ -128,14 +181,18 @@ def db_find_it_ne(collection_name, key=None, fields=None, with_id=False, db_name
     return result
 
 
-def db_find_it(collection_name, key=None, fields=None, with_id=False, db_name=None):
+@metrics.instrument
+def db_find_it(collection_name, key=None, fields=None, with_id=False, db_name=None, is_raw=False):
     """Find data from the db with customized defaults.
 
+    The cursor is lazy (the errors are raised in the iteration), not retried (see db_find / db_find_batches).
+
     Args:
         db_name (str): db-name in config
         key (dict, optional): The selection criteria
         fields (dict, optional): Resulting fields.
         with_id (bool, optional): whether to include _id forcely.
+        is_raw (bool, optional): whether to iterate RawBSONDocument (see :py:mod:`pyutil_mongo.raw`).
 
     Returns:
         (Error, iterator): db-results
@@ -152,7 +209,7 @@ def db_find_it(collection_name, key=None, fields=None, with_id=False, db_name=No
     err = None
     result = []
     try:
-        result = cfg.config[db_name]['db'][collection_name].find(filter=key, projection=fields)
+        result = _get_collection(db_name, collection_name, is_raw=is_raw).find(filter=key, projection=fields)
     except Exception as e:
         err = e
         result = None
@@ -164,6 +221,124 @@ def db_find_it(collection_name, key=None, fields=None, with_id=False, db_name=No
     return err, result
 
 
+def db_find_batches(collection_name, key=None, fields=None, batch_size=1000, max_docs=None, max_bytes=None, with_id=False, db_name=None):
+    """Find data from the db, streaming as batches (lists) of at most batch_size docs.
+
+    The memory is bounded by the batch instead of the whole result as in db_find.
+    The 1st batch is fetched with the retry policy of the mongo-map, the errors after that stop the iteration.
+
+    Args:
+        db_name (str): db-name in config
+        key (dict, optional): The selection criteria
+        fields (dict, optional): Resulting fields.
+        batch_size (int, optional): max number of docs in each batch (also the batch-size of the cursor).
+        max_docs (int, optional): max number of docs in total, stop with error if exceeded.
+        max_bytes (int, optional): max BSON-size of each batch, the batch is yielded early if reached.
+        with_id (bool, optional): whether to include _id forcely.
+
+    Yields:
+        (Error, list): db-results in each batch, the iteration stops after the error.
+    """
+    if fields is None and not with_id:
+        fields = {'_id': False}
+
+    if db_name is None:
+        db_name = _get_default_db(collection_name)
+
+    if db_name is None:
+        yield Exception('unable to get db_name: collection: %s' % (collection_name)), []
+        return
+
+    def _find():
+        cursor = _get_collection(db_name, collection_name).find(filter=key, projection=fields, batch_size=batch_size)
+        # the cursor is lazy: fetch the 1st batch in the retry.
+        return cursor, list(itertools.islice(cursor, 1))
+
+    try:
+        db_result_it, first_docs = _db_run_with_retry(db_name, collection_name, None, _find)
+    except Exception as e:
+        yield e, []
+        return
+
+    n_docs = 0
+    try:
+        results = []
+        n_bytes = 0
+        for each in itertools.chain(first_docs, db_result_it):
+            n_docs += 1
+            if max_docs is not None and n_docs > max_docs:
+                yield Exception('db_find_batches: exceeded max_docs: collection: %s max_docs: %s' % (collection_name, max_docs)), []
+                return
+
+            results.append(each)
+            if max_bytes is not None:
+                n_bytes += len(bson.encode(each))
+
+            if len(results) >= batch_size or (max_bytes is not None and n_bytes >= max_bytes):
+                yield None, results
+                results = []
+                n_bytes = 0
+
+        if results:
+            yield None, results
+    except Exception as e:
+        _db_restart_mongo(db_name, collection_name, e)
+
+        yield e, []
+    finally:
+        if hasattr(db_result_it, 'close'):
+            db_result_it.close()
+
+
+def db_find_raw_batches(collection_name, key=None, fields=None, batch_size=1000, with_id=False, db_name=None):
+    """Find data from the db as the raw BSON batches (bytes of the concatenated docs, not decoded).
+
+    The batches can be written out directly, or iterated as RawBSONDocument with :py:meth:`pyutil_mongo.raw.iter_raw_batch`.
+    The 1st batch is fetched with the retry policy of the mongo-map, the errors after that stop the iteration.
+
+    Args:
+        db_name (str): db-name in config
+        key (dict, optional): The selection criteria
+        fields (dict, optional): Resulting fields.
+        batch_size (int, optional): batch-size of the cursor.
+        with_id (bool, optional): whether to include _id forcely.
+
+    Yields:
+        (Error, bytes): raw BSON batch, the iteration stops after the error.
+    """
+    if fields is None and not with_id:
+        fields = {'_id': False}
+
+    if db_name is None:
+        db_name = _get_default_db(collection_name)
+
+    if db_name is None:
+        yield Exception('unable to get db_name: collection: %s' % (collection_name)), b''
+        return
+
+    def _find():
+        cursor = _get_collection(db_name, collection_name).find_raw_batches(filter=key, projection=fields, batch_size=batch_size)
+        # the cursor is lazy: fetch the 1st batch in the retry.
+        return cursor, list(itertools.islice(cursor, 1))
+
+    try:
+        db_result_it, first_batches = _db_run_with_retry(db_name, collection_name, None, _find)
+    except Exception as e:
+        yield e, b''
+        return
+
+    try:
+        for each in itertools.chain(first_batches, db_result_it):
+            yield None, each
+    except Exception as e:
+        _db_restart_mongo(db_name, collection_name, e)
+
+        yield e, b''
+    finally:
+        if hasattr(db_result_it, 'close'):
+            db_result_it.close()
+
+
 def db_insert_ne(collection_name, val, db_name=None):
     """Insert data to the db
 
@@ -179,6 +354,7 @@ def db_insert_ne(collection_name, val, db_name=None):
     return result
 
 
+@metrics.instrument
 def db_insert(collection_name, val, db_name=None):
     """Insert data to the db
 
@@ -202,17 +378,24 @@ def db_insert(collection_name, val, db_name=None):
 
     result = {}
     try:
-        result = cfg.config[db_name]['db'][collection_name].insert_many(val, ordered=False)
+        result = _get_collection(db_name, collection_name).insert_many(val, ordered=False)
     except Exception as e:
         err = e
         result = []
 
         _db_restart_mongo(db_name, collection_name, e)
 
+    _invalidate_cache(db_name, collection_name)
+
+    matview_err = matview.on_insert(db_name, collection_name, val)
+    if not err:
+        err = matview_err
+
     return err, result
 
 
-def db_bulk_update(collection_name, update_data, is_set=True, upsert=True, multi=True, db_name=None):
+@metrics.instrument
+def db_bulk_update(collection_name, update_data, is_set=True, upsert=True, multi=True, db_name=None, chunk_size=None, max_workers=1, progress=None):
     """Bulk update with a list of update-data.
 
     Args:
@@ -221,24 +404,34 @@ def db_bulk_update(collection_name, update_data, is_set=True, upsert=True, multi
         is_set (bool, optional): is using set in db_update or not.
         upsert (bool, optional): is using upsert in db_update or not.
         multi (bool, optional): is using multi in db_update or not.
+        chunk_size (int, optional): see :py:meth:`db_force_bulk_update`
+        max_workers (int, optional): see :py:meth:`db_force_bulk_update`
+        progress (function, optional): see :py:meth:`db_force_bulk_update`
 
     Returns:
         (Error, dict): db-bulk-update-result
     """
     update_data = [each_data for each_data in update_data if each_data.get('key', {}) and each_data.get('val', {})]
 
-    return db_force_bulk_update(collection_name, update_data, is_set=is_set, upsert=upsert, multi=multi, db_name=db_name)
+    return db_force_bulk_update(collection_name, update_data, is_set=is_set, upsert=upsert, multi=multi, db_name=db_name, chunk_size=chunk_size, max_workers=max_workers, progress=progress)
 
 
-def db_force_bulk_update(collection_name, update_data, is_set, upsert, multi, db_name=None):
+@metrics.instrument
+def db_force_bulk_update(collection_name, update_data, is_set, upsert, multi, db_name=None, chunk_size=None, max_workers=1, progress=None):
     """Bulk-update with a list of update-data
 
+    With chunk_size, update_data is split into chunks of chunk_size, run concurrently in max_workers threads,
+    and the results of the chunks are merged into one raw-result (with chunkErrors for the failed chunks).
+
     Args:
         db_name (str): db-name in config
         update_data ([{key, val}]): list of to-update data, each includes key and val as described in :py:meth:`rx_med_analysis.util.db_update`
         is_set (bool): is using set in db_update or not.
         upsert (bool): is using upsert in db_update or not.
         multi (bool): is using multi in db_update or not.
+        chunk_size (int, optional): number of to-update data in each chunk. (None: no chunk)
+        max_workers (int, optional): number of the concurrently running chunks.
+        progress (function, optional): progress(n_done_chunks, n_chunks), called after each chunk is done.
 
     Returns:
         (Error, dict): db-bulk-update-result
@@ -250,18 +443,72 @@ def db_force_bulk_update(collection_name, update_data, is_set, upsert, multi, db
     if db_name is None:
         return Exception('unable to get db_name: collection: %s' % (collection_name)), {}
 
-    err = None
-    if is_set:
-        for each_data in update_data:
-            val = each_data.get('val', {})
-            each_data['val'] = {'$set': val}
+    if not chunk_size:
+        chunk_size = max(len(update_data), 1)
+
+    offsets = list(range(0, len(update_data), chunk_size))
+    if not offsets:
+        offsets = [0]
+
+    def _bulk_update_chunk(offset):
+        return _db_bulk_update_chunk(collection_name, update_data[offset:(offset + chunk_size)], is_set, upsert, multi, db_name)
+
+    results_with_err = []
+    if max_workers <= 1 or len(offsets) == 1:
+        for idx, offset in enumerate(offsets):
+            results_with_err.append(_bulk_update_chunk(offset))
+            if progress is not None:
+                progress(idx + 1, len(offsets))
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(_bulk_update_chunk, offset) for offset in offsets]
+            for idx, _ in enumerate(concurrent.futures.as_completed(futures)):
+                if progress is not None:
+                    progress(idx + 1, len(offsets))
+            results_with_err = [each.result() for each in futures]
+
+    # restart only once for all the chunks
+    first_err = next((each_err for each_err, _ in results_with_err if each_err), None)
+    if first_err:
+        _db_restart_mongo(db_name, collection_name, first_err)
+
+    _invalidate_cache(db_name, collection_name)
+
+    if len(results_with_err) == 1:
+        return results_with_err[0]
+
+    err, _ = _flatten_results_with_err(results_with_err)
+
+    return err, _merge_bulk_results(offsets, results_with_err)
 
+
+def _db_bulk_update_chunk(collection_name, update_data, is_set, upsert, multi, db_name):
+    """Bulk-update a chunk of update-data (without restarting mongo)
+
+    Args:
+        collection_name (str): collection-name
+        update_data ([{key, val}]): list of to-update data
+        is_set (bool): is using set in db_update or not.
+        upsert (bool): is using upsert in db_update or not.
+        multi (bool): is using multi in db_update or not.
+        db_name (str): db-name in config
+
+    Returns:
+        (Error, dict): raw-result of the chunk
+    """
+    err = None
     result = None
+
+    # the groups of the materialized views are read for each chunk.
+    matview_state = matview.pre_write(db_name, collection_name, [each_data.get('key', {}) for each_data in update_data])
+
     try:
-        bulk = cfg.config[db_name]['db'][collection_name].initialize_unordered_bulk_op()
+        bulk = _get_collection(db_name, collection_name).initialize_unordered_bulk_op()
         for each_data in update_data:
             key = each_data.get('key', {})
             val = each_data.get('val', {})
+            if is_set:
+                val = {'$set': val}
             if upsert and multi:
                 bulk.find(key).upsert().update(val)
             elif upsert:
@@ -276,14 +523,56 @@ def db_force_bulk_update(collection_name, update_data, is_set, upsert, multi, db
         result = bulk.execute()
     except Exception as e:
         err = e
-        result = None
+        # BulkWriteError includes the partial raw-result in details.
+        result = getattr(e, 'details', None)
 
-        _db_restart_mongo(db_name, collection_name, e)
+    if matview_state is not None:
+        _invalidate_cache(db_name, collection_name)
+        matview_err = matview.post_write(matview_state)
+        if not err:
+            err = matview_err
+
+    if isinstance(result, dict):
+        return err, result
 
     return err, getattr(result, 'raw_result', {})
 
 
-def db_update(collection_name, key, val, is_set=True, upsert=True, multi=True, db_name=None):
+def _merge_bulk_results(offsets, results_with_err):
+    """Merge the raw-results of the chunks, the indexes in upserted / writeErrors are shifted by the offsets of the chunks.
+
+    Args:
+        offsets ([int]): offsets of the chunks in update-data
+        results_with_err ([(Error, dict)]): raw-results of the chunks
+
+    Returns:
+        dict: merged raw-result
+    """
+    result = {
+        'nInserted': 0,
+        'nUpserted': 0,
+        'nMatched': 0,
+        'nModified': 0,
+        'nRemoved': 0,
+        'upserted': [],
+        'writeErrors': [],
+        'writeConcernErrors': [],
+        'chunkErrors': [],
+    }
+    for idx, (offset, (each_err, each_result)) in enumerate(zip(offsets, results_with_err)):
+        for key in ['nInserted', 'nUpserted', 'nMatched', 'nModified', 'nRemoved']:
+            result[key] += each_result.get(key, 0)
+        for key in ['upserted', 'writeErrors']:
+            result[key] += [dict(each, index=each.get('index', 0) + offset) for each in each_result.get(key, [])]
+        result['writeConcernErrors'] += each_result.get('writeConcernErrors', [])
+        if each_err:
+            result['chunkErrors'].append({'chunk': idx, 'offset': offset, 'errmsg': str(each_err)})
+
+    return result
+
+
+@metrics.instrument
+def db_update(collection_name, key, val, is_set=True, upsert=True, multi=True, db_name=None, retry_policy=None):
     """update data
 
     Args:
@@ -293,6 +582,7 @@ def db_update(collection_name, key, val, is_set=True, upsert=True, multi=True, d
         is_set (bool, optional): is using set in db_update or not.
         upsert (bool, optional): is using upsert in db_update or not.
         multi (bool, optional): is using multi in db_update or not.
+        retry_policy (RetryPolicy, optional): retry policy, only for the idempotent updates ($set / $unset / $setOnInsert / $min / $max).
 
     Returns:
         (Error, dict): db-update-result
@@ -303,10 +593,11 @@ def db_update(collection_name, key, val, is_set=True, upsert=True, multi=True, d
         err = Exception('unable to db_update: no key or val: db_name: %s' % (db_name))
         return err, {}
 
-    return db_force_update(collection_name, key, val, is_set=is_set, upsert=upsert, multi=multi, db_name=db_name)
+    return db_force_update(collection_name, key, val, is_set=is_set, upsert=upsert, multi=multi, db_name=db_name, retry_policy=retry_policy)
 
 
-def db_force_update(collection_name, key, val, is_set=True, upsert=True, multi=True, db_name=None):
+@metrics.instrument
+def db_force_update(collection_name, key, val, is_set=True, upsert=True, multi=True, db_name=None, retry_policy=None):
     """udpate data
 
     Args:
@@ -316,6 +607,7 @@ def db_force_update(collection_name, key, val, is_set=True, upsert=True, multi=T
         is_set (bool, optional): is using set in db_update or not.
         upsert (bool, optional): is using upsert in db_update or not.
         multi (bool, optional): is using multi in db_update or not.
+        retry_policy (RetryPolicy, optional): retry policy, only for the idempotent updates ($set / $unset / $setOnInsert / $min / $max).
 
     Returns:
         (Error, dict): db-update-result
@@ -331,21 +623,33 @@ def db_force_update(collection_name, key, val, is_set=True, upsert=True, multi=T
     if is_set:
         val = {"$set": val}
 
+    if not _is_idempotent_update(val):
+        retry_policy = _ONCE
+
+    def _update():
+        if not multi:
+            return _get_collection(db_name, collection_name).update_one(key, val, upsert=upsert)
+        return _get_collection(db_name, collection_name).update_many(key, val, upsert=upsert)
+
+    matview_state = matview.pre_write(db_name, collection_name, [key])
+
     result = None
     try:
-        if not multi:
-            result = cfg.config[db_name]['db'][collection_name].update_one(key, val, upsert=upsert)
-        else:
-            result = cfg.config[db_name]['db'][collection_name].update_many(key, val, upsert=upsert)
+        result = _db_run_with_retry(db_name, collection_name, retry_policy, _update)
     except Exception as e:
         err = e
         result = None
 
-        _db_restart_mongo(db_name, collection_name, e)
+    _invalidate_cache(db_name, collection_name)
+
+    matview_err = matview.post_write(matview_state)
+    if not err:
+        err = matview_err
 
     return err, getattr(result, 'raw_result', {})
 
 
+@metrics.instrument
 def db_insert_one(collection_name, doc, db_name=None):
     """Insert one doc.
 
@@ -365,6 +669,7 @@ def db_insert_one(collection_name, doc, db_name=None):
     return db_insert(collection_name, [doc], db_name=db_name)
 
 
+@metrics.instrument
 def db_remove(collection_name, key, db_name=None):
     """Remove data
 
@@ -384,6 +689,7 @@ def db_remove(collection_name, key, db_name=None):
     return db_force_remove(collection_name, key=key, db_name=db_name)
 
 
+@metrics.instrument
 def db_force_remove(collection_name, key=None, db_name=None):
     """Remove data
 
@@ -405,34 +711,44 @@ def db_force_remove(collection_name, key=None, db_name=None):
 
     err = None
 
+    matview_state = matview.pre_write(db_name, collection_name, [key], is_remove=True)
+
     result = None
     try:
-        result = cfg.config[db_name]['db'][collection_name].delete_many(key)
+        result = _get_collection(db_name, collection_name).delete_many(key)
     except Exception as e:
         err = e
         result = None
 
         _db_restart_mongo(db_name, collection_name, e)
 
+    _invalidate_cache(db_name, collection_name)
+
+    matview_err = matview.post_write(matview_state)
+    if not err:
+        err = matview_err
+
     return err, getattr(result, 'raw_result', {})
 
 
-def db_distinct(collection_name, distinct_key, query_key, fields=None, with_id=False, db_name=None):
+@metrics.instrument
+def db_distinct(collection_name, distinct_key, query_key, fields=None, with_id=False, db_name=None, retry_policy=None):
     """Distinct data
 
+    Run as the server-side distinct, falling back to :py:meth:`db_distinct_iter` (db-aggregate)
+    if the distinct-results exceed the 16MB limit.
+
     Args:
         db_name (str): db-name in config
         distinct_key (str): the distinct key
         query_key (dict): the selection criteria
-        fields (dict, optional): the resulting fields
-        with_id (bool, optional): whether include _id forcely.
+        fields (dict, optional): not used (kept for compatibility).
+        with_id (bool, optional): not used (kept for compatibility).
+        retry_policy (RetryPolicy, optional): retry policy (see :py:mod:`pyutil_mongo.retry`).
 
     Returns:
         (Error, list): db-distinct-results
     """
-    if fields is None and not with_id:
-        fields = {'_id': False}
-
     if db_name is None:
         db_name = _get_default_db(collection_name)
 
@@ -443,18 +759,59 @@ def db_distinct(collection_name, distinct_key, query_key, fields=None, with_id=F
 
     results = []
     try:
-        db_result = cfg.config[db_name]['db'][collection_name].find(query_key, projection=fields)
-        results = db_result.distinct(distinct_key)
+        results = _db_run_with_retry(db_name, collection_name, retry_policy, lambda: _get_collection(db_name, collection_name).distinct(distinct_key, filter=query_key))
     except Exception as e:
         err = e
         results = []
 
-        _db_restart_mongo(db_name, e)
+    if err and _is_too_large_error(err):
+        cfg.logger.warning('db_distinct: too large, fallback to db_distinct_iter: collection: %s distinct_key: %s', collection_name, distinct_key)
+        err, db_result_it = db_distinct_iter(collection_name, distinct_key, query_key, db_name=db_name)
+        if err:
+            return err, []
+
+        try:
+            results = list(db_result_it)
+        except Exception as e:
+            err = e
+            results = []
+
+            _db_restart_mongo(db_name, collection_name, e)
 
     return err, results
 
 
-def db_set_if_not_exists(collection_name, key, val, fields=None, with_id=False, db_name=None):
+@metrics.instrument
+def db_distinct_iter(collection_name, distinct_key, query_key, db_name=None):
+    """Distinct data by db-aggregate, streaming as iterator (not limited by the 16MB limit of distinct).
+
+    As distinct, the arrays are unwound, and the null / missing values (and the empty arrays) are as None.
+
+    Args:
+        db_name (str): db-name in config
+        distinct_key (str): the distinct key
+        query_key (dict): the selection criteria
+
+    Returns:
+        (Error, iterator): db-distinct-results
+    """
+    pipe = []
+    if query_key:
+        pipe.append({'$match': query_key})
+    pipe += [
+        {'$unwind': {'path': '$' + distinct_key, 'preserveNullAndEmptyArrays': True}},
+        {'$group': {'_id': '$' + distinct_key}},
+    ]
+
+    err, db_result_it = db_aggregate_iter(collection_name, pipe, db_name=db_name)
+    if err:
+        return err, []
+
+    return None, (each.get('_id', None) for each in db_result_it)
+
+
+@metrics.instrument
+def db_set_if_not_exists(collection_name, key, val, fields=None, with_id=False, db_name=None, retry_policy=None):
     """Summary
 
     Args:
@@ -463,6 +820,8 @@ def db_set_if_not_exists(collection_name, key, val, fields=None, with_id=False,
         val (dict): to-update-data
         fields (dict, optional): resulting fields
         with_id (bool, optional): whether include _id forcely.
+        retry_policy (RetryPolicy, optional): retry policy (see :py:mod:`pyutil_mongo.retry`).
+            ('already exists' if the failed attempt was applied before the retry.)
 
     Returns:
         (Error, dict): db-set-if-not-exists-result
@@ -476,15 +835,21 @@ def db_set_if_not_exists(collection_name, key, val, fields=None, with_id=False,
     if db_name is None:
         return Exception('unable to get db_name: collection: %s' % (collection_name)), {}
 
+    matview_state = matview.pre_write(db_name, collection_name, [key])
+
     err = None
     result = {}
     try:
-        result = cfg.config[db_name]['db'][collection_name].find_one_and_update(key, {"$setOnInsert": val}, projection=fields, upsert=True)
+        result = _db_run_with_retry(db_name, collection_name, retry_policy, lambda: _get_collection(db_name, collection_name).find_one_and_update(key, {"$setOnInsert": val}, projection=fields, upsert=True))
     except Exception as e:
         err = e
         result = {}
 
-        _db_restart_mongo(db_name, collection_name, e)
+    _invalidate_cache(db_name, collection_name)
+
+    matview_err = matview.post_write(matview_state)
+    if not err:
+        err = matview_err
 
     if err:
         return err, {}
@@ -495,6 +860,7 @@ def db_set_if_not_exists(collection_name, key, val, fields=None, with_id=False,
     return None, {}
 
 
+@metrics.instrument
 def db_find_and_modify(collection_name, key, val, fields=None, with_id=False, is_set=True, upsert=True, multi=True, db_name=None):
     """find and modify
 
@@ -525,9 +891,11 @@ def db_find_and_modify(collection_name, key, val, fields=None, with_id=False, is
     if is_set:
         val = {'$set': val}
 
+    matview_state = matview.pre_write(db_name, collection_name, [key])
+
     result = {}
     try:
-        result = cfg.config[db_name]['db'][collection_name].find_one_and_update(key, val, projection=fields, upsert=upsert, multi=multi)
+        result = _get_collection(db_name, collection_name).find_one_and_update(key, val, projection=fields, upsert=upsert, multi=multi)
         if not result:
             result = {}
     except Exception as e:
@@ -536,15 +904,23 @@ def db_find_and_modify(collection_name, key, val, fields=None, with_id=False, is
 
         _db_restart_mongo(db_name, collection_name, e)
 
+    _invalidate_cache(db_name, collection_name)
+
+    matview_err = matview.post_write(matview_state)
+    if not err:
+        err = matview_err
+
     return err, dict(result)
 
 
-def db_aggregate_iter(collection_name, pipe, db_name=None):
+@metrics.instrument
+def db_aggregate_iter(collection_name, pipe, db_name=None, retry_policy=None):
     """db-aggregate
 
     Args:
         db_name (str): db-name in config
         pipe ([{}]): pipe in db-aggregate
+        retry_policy (RetryPolicy, optional): retry policy of the aggregate (with the 1st batch, the iteration is not retried, see db_aggregate).
 
     Returns:
         (Error, iterator): db-aggregate-results
@@ -559,7 +935,7 @@ def db_aggregate_iter(collection_name, pipe, db_name=None):
 
     db_result = []
     try:
-        db_result = cfg.config[db_name]['db'][collection_name].aggregate(pipeline=pipe, cursor={}, allowDiskUse=True)
+        db_result = _db_run_with_retry(db_name, collection_name, retry_policy, lambda: _get_collection(db_name, collection_name).aggregate(pipeline=pipe, cursor={}, allowDiskUse=True))
     except Exception as e:
         err = e
         db_result = []
@@ -567,71 +943,148 @@ def db_aggregate_iter(collection_name, pipe, db_name=None):
     return err, db_result
 
 
-def db_aggregate(collection_name, pipe, db_name=None):
-    """db-aggregate
+@metrics.instrument
+def db_aggregate(collection_name, pipe, db_name=None, retry_policy=None, is_cache=True):
+    """db-aggregate, the results are cached if the pipeline cache is enabled (see :py:meth:`pyutil_mongo.cache.enable_pipeline`).
 
     Args:
         db_name (str): db-name in config
         pipe ([{}]): pipe in db-aggregate
+        retry_policy (RetryPolicy, optional): retry policy (see :py:mod:`pyutil_mongo.retry`).
+        is_cache (bool, optional): whether to use the pipeline cache (False to always read from mongo).
+
+    Returns:
+        (Error, list): db-aggregate-results
+    """
+    if db_name is None:
+        db_name = _get_default_db(collection_name)
+
+    ns = _get_cache_ns(db_name, collection_name) if is_cache and cache.pipeline_cache is not None else None
+    if ns is None:
+        return _db_aggregate(collection_name, pipe, db_name, retry_policy)
+
+    return cache.run_pipeline(ns, collection_name, pipe, lambda: _db_aggregate(collection_name, pipe, db_name, retry_policy))
+
+
+def _db_aggregate(collection_name, pipe, db_name, retry_policy):
+    """db-aggregate without the pipeline cache
+
+    Args:
+        collection_name (str): collection-name
+        pipe ([{}]): pipe in db-aggregate
+        db_name (str): db-name in config
+        retry_policy (RetryPolicy): retry policy
 
     Returns:
         (Error, list): db-aggregate-results
     """
     err = None
 
-    err, db_result = db_aggregate_iter(collection_name, pipe, db_name=db_name)
-    if err:
-        return err, []
+    def _aggregate():
+        each_err, db_result = db_aggregate_iter(collection_name, pipe, db_name=db_name, retry_policy=_NO_RETRY)
+        if each_err:
+            raise each_err
+        return list(db_result)
 
     result = []
     try:
-        result = list(db_result)
+        result = _db_run_with_retry(db_name, collection_name, retry_policy, _aggregate)
     except Exception as e:
         result = []
         err = e
 
-        _db_restart_mongo(db_name, collection_name, e)
-
     return err, result
 
 
-def db_aggregate_parse_results(db_results):
+def db_aggregate_parse_results(db_results, non_dict_id='error', on_collision='override'):
     '''
     db_aggregate_parse_result
 
     Args:
         db_results (TYPE): Description
+        non_dict_id (str, optional): see :py:meth:`db_aggregate_parse_result`
+        on_collision (str, optional): see :py:meth:`db_aggregate_parse_result`
 
     Returns:
         TYPE: Description
     '''
-    results_with_err = [db_aggregate_parse_result(db_result) for db_result in db_results]
+    err_msg_list = []
+    results = []
+    for idx, (each_err, each_result) in enumerate(db_aggregate_parse_iter(db_results, non_dict_id=non_dict_id, on_collision=on_collision, is_in_place=False)):
+        if each_err:
+            err_msg_list.append((idx, each_err))
+        results.append(each_result)
+
+    if err_msg_list:
+        return Exception(','.join(['(%s/%s) e: %s' % (idx, len(results), each_err) for idx, each_err in err_msg_list])), results
+
+    return None, results
 
-    return _flatten_results_with_err(results_with_err)
 
+def db_aggregate_parse_iter(db_results, non_dict_id='error', on_collision='override', is_in_place=True):
+    """Parse the db-results from db-aggregate (ex: the iterator from db_aggregate_iter) lazily.
 
-def db_aggregate_parse_result(db_result):
+    Args:
+        db_results (iterator): db-results from db-aggregate
+        non_dict_id (str, optional): see :py:meth:`db_aggregate_parse_result`
+        on_collision (str, optional): see :py:meth:`db_aggregate_parse_result`
+        is_in_place (bool, optional): whether to integrate in the db-results (owned by the iterator) without copying.
+
+    Yields:
+        (Error, dict): integrated result
+    """
+    for db_result in db_results:
+        yield db_aggregate_parse_result(db_result, non_dict_id=non_dict_id, on_collision=on_collision, is_in_place=is_in_place)
+
+
+def db_aggregate_parse_result(db_result, non_dict_id='error', on_collision='override', is_in_place=False):
     """Parse each db-result from db-aggregate by integrating db_result['_id'] into db_result
 
+    The result is a shallow copy of db_result (the nested values are shared with db_result).
+
     Args:
         db_result (dict): db-result from db_aggregate
+        non_dict_id (str, optional): if _id is not a dict: error (return error with _id kept) / keep (keep _id) / drop (remove _id).
+        on_collision (str, optional): if the keys in _id exist in db_result: override (by the values in _id) / keep (the values in db_result) / error (return error with the values in db_result).
+        is_in_place (bool, optional): whether to integrate in db_result without copying.
 
     Returns:
         dict: integrated result
     """
+    result = db_result if is_in_place else dict(db_result)
+    if '_id' not in result:
+        return None, result
 
-    result = copy.deepcopy(db_result)
-    if '_id' in result:
-        data_id = result['_id']
-        result.update(data_id)
-        del result['_id']
+    data_id = result['_id']
+    if not isinstance(data_id, dict):
+        if non_dict_id == 'keep':
+            return None, result
+        if non_dict_id == 'drop':
+            del result['_id']
+            return None, result
+        return Exception('_id is not dict: _id: %s' % (data_id,)), result
 
-    return None, result
+    del result['_id']
 
+    err = None
+    for each_key, each_val in data_id.items():
+        if each_key in result:
+            if on_collision == 'keep':
+                continue
+            if on_collision == 'error':
+                err = Exception('key collision: key: %s' % (each_key))
+                continue
+        result[each_key] = each_val
+
+    return err, result
 
+
+@metrics.instrument
 def db_max(collection_name, key, query, group_columns=None, db_name=None):
     """Find largest record in the db, return as dict
 
+    Without group_columns, the largest value is from find(query).sort(key, -1).limit(1), which can use the index on key.
+
     Args:
         db_name (str): db-name in config
         key (str): the key for largest
@@ -641,39 +1094,156 @@ def db_max(collection_name, key, query, group_columns=None, db_name=None):
     Returns:
         (Error, dict): largest record
     """
+    return _db_extreme(collection_name, key, query, 'max', group_columns=group_columns, db_name=db_name)
+
+
+@metrics.instrument
+def db_min(collection_name, key, query, group_columns=None, db_name=None):
+    """Find smallest record in the db
+
+    Without group_columns, the smallest value is from find(query).sort(key, 1).limit(1), which can use the index on key.
+
+    Args:
+        db_name (str): db-name in config
+        key (str): the key for smallest
+        query (dict): the selection criteria
+        group_columns (list, optional): group columns in db-aggregate
+
+    Returns:
+        (Error, dict): smallest record
+    """
+    return _db_extreme(collection_name, key, query, 'min', group_columns=group_columns, db_name=db_name)
+
+
+@metrics.instrument
+def db_max_many(collection_name, key, query, group_columns=None, db_name=None):
+    """Find largest record of each group in the db
+
+    Args:
+        db_name (str): db-name in config
+        key (str): the key for largest
+        query (dict): the selection criteria
+        group_columns (list, optional): group columns in db-aggregate, default the keys in query.
+
+    Returns:
+        (Error, list): [{group-column: value, 'max': largest}]
+    """
+    err, db_results = _db_group_list(collection_name, key, query, 'max', group_columns, db_name=db_name)
+    if err:
+        return err, []
+
+    return db_aggregate_parse_results(db_results)
+
+
+@metrics.instrument
+def db_min_many(collection_name, key, query, group_columns=None, db_name=None):
+    """Find smallest record of each group in the db
+
+    Args:
+        db_name (str): db-name in config
+        key (str): the key for smallest
+        query (dict): the selection criteria
+        group_columns (list, optional): group columns in db-aggregate, default the keys in query.
+
+    Returns:
+        (Error, list): [{group-column: value, 'min': smallest}]
+    """
+    err, db_results = _db_group_list(collection_name, key, query, 'min', group_columns, db_name=db_name)
+    if err:
+        return err, []
+
+    return db_aggregate_parse_results(db_results)
+
+
+def _db_extreme(collection_name, key, query, op, group_columns=None, db_name=None):
+    """Find largest / smallest record in the db
+
+    Args:
+        collection_name (str): collection-name
+        key (str): the key for largest / smallest
+        query (dict): the selection criteria
+        op (str): max / min
+        group_columns (list, optional): group columns in db-aggregate
+        db_name (str, optional): db-name in config
+
+    Returns:
+        (Error, dict): largest / smallest record
+    """
     if db_name is None:
         db_name = _get_default_db(collection_name)
 
     if db_name is None:
         return Exception('unable to get db_name: collection: %s' % (collection_name)), {}
 
-    err, db_results = _db_max_list(collection_name, key, query, group_columns, db_name=db_name)
+    if not group_columns:
+        return _db_extreme_by_sort(collection_name, key, query, op, db_name=db_name)
+
+    err, db_results = _db_group_list(collection_name, key, query, op, group_columns, db_name=db_name)
     if err:
         return err, db_results
 
     if not db_results:
         return Exception('[empty]'), {}
 
-    return None, db_results[0]['max']
+    return None, db_results[0][op]
+
 
+def _db_extreme_by_sort(collection_name, key, query, op, db_name):
+    """Find largest / smallest record in the db by find(query).sort(key).limit(1)
 
-def _db_max_list(collection_name, key, query, group_columns=None, db_name=None):
-    """Find largest record in the db, return as list
+    The docs with null / missing key are excluded as $max / $min in db-aggregate.
 
     Args:
+        collection_name (str): collection-name
+        key (str): the key for largest / smallest
+        query (dict): the selection criteria
+        op (str): max / min
         db_name (str): db-name in config
-        key (str): key for largest
+
+    Returns:
+        (Error, dict): largest / smallest record
+    """
+    exists_query = {key: {'$ne': None}}
+    the_query = {'$and': [query, exists_query]} if query else exists_query
+    fields = {'_id': True} if key == '_id' else {key: True, '_id': False}
+    direction = pymongo.DESCENDING if op == 'max' else pymongo.ASCENDING
+
+    err = None
+    result = None
+    try:
+        db_results = _db_run_with_retry(db_name, collection_name, None, lambda: list(_get_collection(db_name, collection_name).find(the_query, projection=fields).sort(key, direction).limit(1)))
+        if db_results:
+            result = db_results[0]
+    except Exception as e:
+        err = e
+
+    if err:
+        return err, {}
+
+    if result is None:
+        return Exception('[empty]'), {}
+
+    return None, _get_value(result, key)
+
+
+def _db_group_list(collection_name, key, query, op, group_columns=None, db_name=None):
+    """Find largest / smallest record of each group in the db, return as list
+
+    Args:
+        db_name (str): db-name in config
+        key (str): key for largest / smallest
         query (dict): the selection criteria
+        op (str): max / min
         group_columns (list, optional): group-by column in _id
 
     Returns:
-        (Error, list): largest record
+        (Error, list): largest / smallest record
     """
     if not group_columns:
         group_columns = query.keys()
 
     group = {}
-    group['max'] = {'$max': '$' + key}
+    group[op] = {'$' + op: '$' + key}
     group['_id'] = {column: '$' + column for column in group_columns}
     pipe = [
         {'$match': query},
@@ -692,11 +1262,13 @@ def _db_restart_mongo(db_name, collection_name, e):
     """Restart mongo with the corresponding db-name
 
 
-    Restart mongo with the corresponding db-name except the following error:
+    Restart mongo with the corresponding db-name only for the connection-level errors
+    (single-flight with backoff, see :py:mod:`pyutil_mongo.breaker`), ignoring the following error:
     * E11000: duplicate-error in unique-index-key
 
     Args:
         db_name (str): db-name in config
+        collection_name (str): collection-name
         e (Exception): exception
 
     Returns:
@@ -709,13 +1281,106 @@ def _db_restart_mongo(db_name, collection_name, e):
         cfg.logger.debug('E11000: e: %s', e)
         return None
 
+    # not restarting for the non-connection errors (ex: validation errors / circuit open)
+    if not breaker.is_connection_error(e):
+        cfg.logger.debug('not connection error: e: %s', e)
+        return None
+
     cfg.logger.debug('to restart mongo: e: %s', e)
 
-    cfg.restart_mongo(collection_name=collection_name, db_name=db_name)
+    if breaker.restart(db_name, collection_name):
+        metrics.record_restart(db_name, collection_name, e)
 
     return None
 
 
+def _db_run_with_retry(db_name, collection_name, retry_policy, func):
+    """Run func with the retry policy, restarting mongo before each retry.
+
+    Args:
+        db_name (str): db-name in config
+        collection_name (str): collection-name
+        retry_policy (RetryPolicy): retry policy of the call, None as MongoMap.retry_policy / retry.default_policy.
+        func (function): func()
+
+    Returns:
+        object: result of func
+    """
+    if retry_policy is None:
+        mongo_map = cfg.config.get(db_name, {}).get('mongo_map', None)
+        retry_policy = getattr(mongo_map, 'retry_policy', None) or retry.default_policy
+
+    def _on_retry(e, n_retries):
+        cfg.logger.info('to retry: collection: %s n_retries: %s e: %s', collection_name, n_retries, e)
+        metrics.record_retry(db_name, collection_name, e, n_retries)
+        _db_restart_mongo(db_name, collection_name, e)
+
+    try:
+        return retry.call(func, retry_policy, on_retry=_on_retry)
+    except Exception as e:
+        # restart only once: already restarted before the retries, or by the enclosing db-op.
+        if retry_policy is not _NO_RETRY and not retry.last_retries():
+            _db_restart_mongo(db_name, collection_name, e)
+        raise
+
+
+def _is_idempotent_update(val):
+    """Whether the update is idempotent (retryable)
+
+    Args:
+        val (dict): update with the operators
+
+    Returns:
+        bool: Description
+    """
+    if not val:
+        return False
+
+    return all([each in ('$set', '$unset', '$setOnInsert', '$min', '$max') for each in val.keys()])
+
+
+def _get_collection(db_name, collection_name, is_raw=False):
+    """Get the collection, raising CircuitOpenError if the circuit of the db-name is open.
+
+    Args:
+        db_name (str): db-name in config
+        collection_name (str): collection-name
+        is_raw (bool, optional): whether the docs are RawBSONDocument.
+
+    Returns:
+        pymongo.collection.Collection: collection
+    """
+    err = breaker.check(db_name)
+    if err:
+        raise err
+
+    collection = cfg.config[db_name]['db'][collection_name]
+    if is_raw:
+        collection = collection.with_options(codec_options=raw._RAW_CODEC_OPTIONS)
+
+    return collection
+
+
+def _is_too_large_error(e):
+    """Whether the error is from exceeding the 16MB BSON limit
+
+    Args:
+        e (Exception): exception
+
+    Returns:
+        bool: Description
+    """
+    if isinstance(e, pymongo.errors.DocumentTooLarge):
+        return True
+
+    # 17217: distinct too big, 10334: BSONObjectTooLarge
+    if isinstance(e, pymongo.errors.OperationFailure) and e.code in (17217, 10334):
+        return True
+
+    return False
+
+
+@metrics.instrument
 def drop(collection_name, db_name=None):
     if db_name is None:
         db_name = _get_default_db(collection_name)
@@ -725,12 +1390,17 @@ def drop(collection_name, db_name=None):
 
     err = None
     try:
-        cfg.config[db_name]['db'][collection_name].drop()
+        _get_collection(db_name, collection_name).drop()
     except Exception as e:
         err = e
 
         _db_restart_mongo(db_name, collection_name, e)
 
+    _invalidate_cache(db_name, collection_name)
+
+    if not err:
+        err = matview.on_drop(db_name, collection_name)
+
     return err
 
 
@@ -757,9 +1427,82 @@ def _flatten_results_with_err(results_with_err):
     return None, results
 
 
+def _get_value(doc, key, default=None):
+    """Get the value of the (dotted) key in the doc
+
+    Args:
+        doc (dict): doc (or RawBSONDocument)
+        key (str): key, can be dotted as in mongo (a.b.c)
+        default (object, optional): value if the key does not exist.
+
+    Returns:
+        object: value
+    """
+    val = doc
+    for each_key in key.split('.'):
+        if not isinstance(val, collections.abc.Mapping) or each_key not in val:
+            return default
+        val = val[each_key]
+
+    return val
+
+
+def _get_cache_ns(db_name, collection_name):
+    """Get the namespace in the query / pipeline cache, None if both caches are disabled.
+
+    Args:
+        db_name (str): db-name in config
+        collection_name (str): collection-name
+
+    Returns:
+        tuple: (hostname, mongo-db-name, real collection-name)
+    """
+    if cache.query_cache is None and cache.pipeline_cache is None:
+        return None
+
+    return _get_ns(db_name, collection_name)
+
+
+def _get_ns(db_name, collection_name):
+    """Get the namespace of the collection
+
+    Args:
+        db_name (str): db-name in config
+        collection_name (str): collection-name
+
+    Returns:
+        tuple: (hostname, mongo-db-name, real collection-name), None if db_name is not in config.
+    """
+    config_by_db_name = cfg.config.get(db_name, None)
+    if config_by_db_name is None:
+        return None
+
+    mongo_map = config_by_db_name['mongo_map']
+
+    return (mongo_map.hostname, mongo_map.mongo_db_name, mongo_map.collection_map.get(collection_name, collection_name))
+
+
+def _invalidate_cache(db_name, collection_name):
+    """Invalidate the query / pipeline cache of the collection after writes.
+
+    Args:
+        db_name (str): db-name in config
+        collection_name (str): collection-name
+    """
+    ns = _get_cache_ns(db_name, collection_name)
+    if ns is None:
+        return
+
+    cache.invalidate(ns)
+
+
 def _get_default_db(collection_name):
-    for db_name, val in cfg.config.items():
-        if collection_name in val['db']:
-            return db_name
+    """Get the db-name of the collection-name from cfg.collection_db_map
 
-    return None
+    Args:
+        collection_name (str): collection-name
+
+    Returns:
+        str: db-name (None if not found or ambiguous)
+    """
+    return cfg.collection_db_map.get(collection_name, None)
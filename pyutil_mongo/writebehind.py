@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""Write-behind buffer of the small updates (counters, last-seen timestamps) of a collection.
+
+The updates are queued by the selection criteria (key), merged per key
+($set payloads are merged, $inc deltas are combined, and a $inc on a $set field is added to the $set value),
+and flushed as one db_force_bulk_update (upsert, one doc per key) when flush_size keys are pending,
+every flush_interval sec, and in close() (also at exit).
+
+The exit-hook and the background flushes refer to the buffer weakly (the background flushes hold it only while
+the updates are pending), so the buffers not closed are still freed. Use close() (or with) to flush deterministically.
+
+The memory is bounded by max_keys pending keys: the updates of the new keys block
+(backpressure) until the pending keys are flushed, or return error after block_timeout.
+
+The updates are not re-queued if the flush fails (the error is logged and kept as last_err),
+the partially applied $inc may be applied twice if re-issued by the caller.
+"""
+import atexit
+import functools
+import threading
+import time
+import weakref
+
+import bson
+
+from . import cfg
+from . import util
+
+
+class WriteBuffer(object):
+    """Write-behind buffer of a collection
+
+    Attributes:
+        block_timeout (float): max sec to wait for the space of the new keys, None to wait until flushed.
+        collection_name (str): collection-name
+        db_name (str): db-name in config
+        flush_interval (float): sec between the background flushes.
+        flush_size (int): number of the pending keys to flush.
+        last_err (Error): error of the last flush.
+        max_keys (int): max number of the pending keys.
+        upsert (bool): is using upsert in the updates or not.
+    """
+
+    def __init__(self, collection_name, db_name=None, upsert=True, flush_size=1000, flush_interval=1.0, max_keys=10000, block_timeout=None):
+        self.collection_name = collection_name
+        self.db_name = db_name
+        self.upsert = upsert
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_keys = max_keys
+        self.block_timeout = block_timeout
+        self.last_err = None
+
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        self._pending = {}
+        self._thread = None
+        self._is_closed = False
+
+        self._close_at_exit = functools.partial(_close_at_exit, weakref.ref(self))
+        atexit.register(self._close_at_exit)
+
+    def update(self, key, val=None, inc=None):
+        """Queue the update of the key
+
+        Args:
+            key (dict): the selection criteria
+            val (dict, optional): to-$set data
+            inc (dict, optional): to-$inc deltas
+
+        Returns:
+            Error: error if closed, timeout in waiting for the space, or not able to merge the update.
+        """
+        if not key or (not val and not inc):
+            return Exception('unable to update: no key or val: collection: %s' % (self.collection_name))
+
+        pending_key = bson.encode(key)
+
+        with self._cond:
+            if self._is_closed:
+                return Exception('unable to update: closed: collection: %s' % (self.collection_name))
+
+            self._start()
+
+            deadline = None if self.block_timeout is None else time.monotonic() + self.block_timeout
+            while pending_key not in self._pending and len(self._pending) >= self.max_keys:
+                self._cond.notify_all()
+                timeout = None if deadline is None else deadline - time.monotonic()
+                if timeout is not None and timeout <= 0:
+                    return Exception('unable to update: buffer full: collection: %s max_keys: %s' % (self.collection_name, self.max_keys))
+                self._cond.wait(timeout)
+                if self._is_closed:
+                    return Exception('unable to update: closed: collection: %s' % (self.collection_name))
+
+            entry = self._pending.get(pending_key, None)
+            is_new = entry is None
+            if is_new:
+                entry = {'key': key, 'set': {}, 'inc': {}}
+
+            err = _merge(entry, val, inc)
+            if err:
+                return err
+
+            if is_new:
+                self._pending[pending_key] = entry
+
+            if len(self._pending) >= self.flush_size:
+                self._cond.notify_all()
+
+        return None
+
+    def flush(self):
+        """Flush the pending updates
+
+        Returns:
+            (Error, dict): db-bulk-update-result
+        """
+        with self._flush_lock:
+            with self._cond:
+                pending = self._pending
+                self._pending = {}
+                self._cond.notify_all()
+
+            if not pending:
+                return None, {}
+
+            update_data = [{'key': entry['key'], 'val': _get_update_val(entry)} for entry in pending.values()]
+
+            err, result = util.db_force_bulk_update(self.collection_name, update_data, is_set=False, upsert=self.upsert, multi=False, db_name=self.db_name)
+
+        self.last_err = err
+        if err:
+            cfg.logger.error('writebehind: unable to flush: collection: %s n_keys: %s e: %s', self.collection_name, len(update_data), err)
+
+        return err, result
+
+    def close(self):
+        """Stop the background flushes and flush the pending updates
+
+        Returns:
+            (Error, dict): db-bulk-update-result
+        """
+        with self._cond:
+            self._is_closed = True
+            thread = self._thread
+            self._thread = None
+            self._cond.notify_all()
+
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+        atexit.unregister(self._close_at_exit)
+
+        return self.flush()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _start(self):
+        """Start the background flushes (with the lock acquired)
+        """
+        if self._thread is not None:
+            return
+
+        self._thread = threading.Thread(target=_run, args=(weakref.ref(self),), name='pyutil_mongo_writebehind', daemon=True)
+        self._thread.start()
+
+    def _wait(self, next_timestamp):
+        """Wait until flush_size keys are pending or next_timestamp
+
+        Args:
+            next_timestamp (float): monotonic timestamp of the next flush
+
+        Returns:
+            bool: whether to flush (False if closed).
+        """
+        with self._cond:
+            while not self._is_closed and len(self._pending) < self.flush_size and time.monotonic() < next_timestamp:
+                self._cond.wait(max(0.0, next_timestamp - time.monotonic()))
+
+            return not self._is_closed
+
+
+def _run(buffer_ref):
+    """Flush when flush_size keys are pending or every flush_interval sec,
+    until the buffer is closed or freed (held only while the updates are pending).
+
+    Args:
+        buffer_ref (weakref.ref): the buffer
+    """
+    buffer = buffer_ref()
+    while buffer is not None:
+        if not buffer._wait(time.monotonic() + buffer.flush_interval):
+            return
+
+        try:
+            buffer.flush()
+        except Exception as e:
+            cfg.logger.error('writebehind: unable to flush: collection: %s e: %s', buffer.collection_name, e)
+
+        if not len(buffer):
+            buffer = None
+            buffer = buffer_ref()
+
+
+def _close_at_exit(buffer_ref):
+    """Close the buffer at exit if not freed
+
+    Args:
+        buffer_ref (weakref.ref): the buffer
+    """
+    buffer = buffer_ref()
+    if buffer is None:
+        return
+
+    buffer.close()
+
+
+def _merge(entry, val, inc):
+    """Merge the update into the pending entry
+
+    The entry is not changed if the update is not able to be merged.
+
+    Args:
+        entry (dict): {key, set, inc}
+        val (dict): to-$set data
+        inc (dict): to-$inc deltas
+
+    Returns:
+        Error: error if the delta or the to-$inc value (after the merged $set) is not numeric.
+    """
+    if inc:
+        for each_key, each_delta in inc.items():
+            if not _is_numeric(each_delta):
+                return Exception('unable to merge: non-numeric $inc: key: %s delta: %s' % (each_key, each_delta))
+            if val and each_key in val:
+                each_val = val[each_key]
+            elif each_key in entry['set']:
+                each_val = entry['set'][each_key]
+            else:
+                continue
+            if not _is_numeric(each_val):
+                return Exception('unable to merge: $inc to non-numeric $set: key: %s val: %s' % (each_key, each_val))
+
+    if val:
+        for each_key, each_val in val.items():
+            entry['inc'].pop(each_key, None)
+            entry['set'][each_key] = each_val
+
+    if inc:
+        for each_key, each_delta in inc.items():
+            if each_key in entry['set']:
+                entry['set'][each_key] += each_delta
+                continue
+            entry['inc'][each_key] = entry['inc'].get(each_key, 0) + each_delta
+
+    return None
+
+
+def _is_numeric(val):
+    return isinstance(val, (int, float)) and not isinstance(val, bool)
+
+
+def _get_update_val(entry):
+    """Get the update-operators of the entry
+
+    Args:
+        entry (dict): {key, set, inc}
+
+    Returns:
+        dict: {$set, $inc}
+    """
+    val = {}
+    if entry['set']:
+        val['$set'] = entry['set']
+    if entry['inc']:
+        val['$inc'] = entry['inc']
+
+    return val
@@ -17,6 +17,11 @@ setuptools.setup(
         'pymongo>=3.10.1',
         'mongomock>=3.20.0',
     ],
+    extras_require={
+        'columnar': ['numpy'],
+        'arrow': ['pyarrow'],
+        'zstd': ['zstandard'],
+    },
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",
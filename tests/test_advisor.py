@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import logging
+import pymongo
+
+from pyutil_mongo import cfg
+from pyutil_mongo import util
+from pyutil_mongo import advisor
+import mongomock
+
+
+class TestAdvisor(unittest.TestCase):
+
+    @mongomock.patch(servers=(('localhost', 27017),))
+    def setUp(self):
+        self.logger = logging.getLogger('test')
+        collection_map = {
+            'a': 'b',
+            'a2': 'b',
+            'a3': 'b',
+        }
+        ensure_index = {
+            'a': [('key1', pymongo.ASCENDING)],
+            'a2': [('key1', pymongo.ASCENDING), ('key2', pymongo.ASCENDING)],
+            'a3': [('key5', pymongo.ASCENDING)],
+        }
+        mongo_map = cfg.MongoMap(collection_map, ensure_index=ensure_index)
+
+        err = cfg.init(self.logger, [mongo_map])
+
+        advisor.reset()
+        advisor.enable()
+
+    def tearDown(self):
+        advisor.disable()
+        advisor.reset()
+        util.drop('a')
+        cfg.clean()
+
+    def test_get_query_shape(self):
+        shape = advisor.get_query_shape({'key1': 'a', 'key2': {'$gt': 1}, '$or': [{'key3': {'$in': [1, 2]}}]}, [('key4', -1)])
+        self.assertEqual((('key1', 'key3'), ('key4',), ('key2',)), shape)
+
+    def test_analyze(self):
+        util.db_find_one('a', {'key1': 'a'})
+        util.db_find('a', {'key3': 'a', 'key4': {'$gte': 3}})
+        util.db_find('a', {'key3': 'b', 'key4': {'$gte': 4}})
+        util.db_max('a', 'key2', {'key3': 'a'})
+
+        result = advisor.analyze(is_explain=False)
+
+        self.assertEqual(2, len(result['missing']))
+        self.assertEqual(2, result['missing'][0]['count'])
+        self.assertEqual([('key3', 1), ('key4', 1)], result['missing'][0]['suggested_index'])
+        self.assertEqual({'a': [('key3', 1), ('key4', 1)]}, result['suggested_ensure_index'])
+
+        self.assertEqual([{'db_name': 'mongo', 'collection_name': 'a3', 'index': ['key5'], 'unique': False}], result['unused'])
+
+        self.assertEqual(1, len(result['redundant']))
+        self.assertEqual(['key1'], result['redundant'][0]['index'])
+
+        self.assertIn('suggested ensure_index:', advisor.format_report(is_explain=False))
+
+    def test_analyze_extreme_sort(self):
+        util.db_max_many('a', 'key2', {'key3': 'a'})
+        util.db_min('a', 'key2', {'key6': 'a'}, group_columns=['key6'])
+        util.db_max('a', 'key2', {'key7': 'a'})
+        util.db_aggregate('a', [{'$match': {'key8': 'a'}}, {'$sort': {'key9': 1, 'key10': -1}}])
+
+        result = advisor.analyze(is_explain=False)
+
+        suggested_indexes = sorted([each['suggested_index'] for each in result['missing']])
+        self.assertEqual([[('key3', 1)], [('key6', 1)], [('key7', 1), ('key2', -1)], [('key8', 1), ('key9', 1), ('key10', -1)]], suggested_indexes)
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import logging
+import asyncio
+import pymongo
+
+from pyutil_mongo import cfg
+from pyutil_mongo import util
+from pyutil_mongo import aio
+import mongomock
+
+
+class TestAio(unittest.TestCase):
+
+    @mongomock.patch(servers=(('localhost', 27017),))
+    def setUp(self):
+        self.logger = logging.getLogger('test')
+        collection_map = {
+            'a': 'b',
+            'a2': 'b',
+        }
+        ensure_index = {
+            'a': [('key1', pymongo.ASCENDING)],
+        }
+        mongo_map = cfg.MongoMap(collection_map, ensure_index=ensure_index)
+
+        err = cfg.init(self.logger, [mongo_map])
+
+    def tearDown(self):
+        util.drop('a')
+        cfg.clean()
+        aio.shutdown()
+
+    def test_db_find_one(self):
+        async def _test():
+            err, db_result = await aio.db_update('a', {'key1': 'a'}, {'key2': 'b'})
+            self.assertIsNone(err)
+
+            err, db_result = await aio.db_find_one('a', {'key1': 'a'})
+            self.assertIsNone(err)
+            self.assertEqual({'key1': 'a', 'key2': 'b'}, db_result)
+
+            err, db_result = await aio.db_find_one('c', {'key1': 'a'})
+            self.assertIsNotNone(err)
+            self.assertEqual({}, db_result)
+
+        asyncio.run(_test())
+
+    def test_db_find_it(self):
+        async def _test():
+            err, db_result = await aio.db_insert('a', [{'key1': 'a', 'key2': idx} for idx in range(5)])
+            self.assertIsNone(err)
+
+            err, db_result_it = await aio.db_find_it('a', {'key1': 'a'}, batch_size=2)
+            self.assertIsNone(err)
+
+            db_results = [each['key2'] async for each in db_result_it]
+            self.assertEqual([0, 1, 2, 3, 4], db_results)
+
+            pipe = [{'$match': {'key1': 'a'}}, {'$group': {'_id': {'key1': '$key1'}, 'key2': {'$sum': '$key2'}}}]
+            err, db_result_it = await aio.db_aggregate_iter('a', pipe)
+            self.assertIsNone(err)
+
+            db_results = await db_result_it.to_list()
+            self.assertEqual([{'_id': {'key1': 'a'}, 'key2': 10}], db_results)
+
+        asyncio.run(_test())
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import unittest.mock
+import logging
+import threading
+import time
+
+import pymongo.errors
+
+from pyutil_mongo import cfg
+from pyutil_mongo import util
+from pyutil_mongo import breaker
+from pyutil_mongo import retry
+import mongomock
+
+
+class TestBreaker(unittest.TestCase):
+
+    @mongomock.patch(servers=(('localhost', 27017),))
+    def setUp(self):
+        self.logger = logging.getLogger('test')
+        collection_map = {
+            'a': 'b',
+        }
+        mongo_map = cfg.MongoMap(collection_map)
+
+        err = cfg.init(self.logger, [mongo_map])
+
+        breaker.reset()
+
+    def tearDown(self):
+        breaker.set_policy()
+        breaker.reset()
+        util.drop('a')
+        cfg.clean()
+
+    def test_not_connection_error(self):
+        with unittest.mock.patch.object(mongomock.collection.Collection, 'find_one', side_effect=pymongo.errors.OperationFailure('bad value', code=2)), \
+                unittest.mock.patch.object(cfg, 'restart_mongo', return_value=None) as mock_restart_mongo:
+            err, db_result = util.db_find_one('a', {'key1': 'a'})
+            self.assertIsNotNone(err)
+            self.assertEqual({}, db_result)
+            self.assertEqual(0, mock_restart_mongo.call_count)
+
+    def test_circuit_open(self):
+        breaker.set_policy(the_failure_threshold=1, the_base_backoff=10.0)
+
+        with unittest.mock.patch.object(mongomock.collection.Collection, 'find_one', side_effect=pymongo.errors.AutoReconnect('connection closed')) as mock_find_one, \
+                unittest.mock.patch.object(cfg, 'restart_mongo', return_value=Exception('unable to connect')) as mock_restart_mongo:
+            err, db_result = util.db_find_one('a', {'key1': 'a'})
+            self.assertIsInstance(err, pymongo.errors.AutoReconnect)
+            self.assertEqual(1, mock_restart_mongo.call_count)
+
+            status = breaker.status()
+            self.assertEqual(1, status['mongo']['n_failures'])
+            self.assertTrue(status['mongo']['is_open'])
+
+            # fail fast
+            err, db_result = util.db_find_one('a', {'key1': 'a'})
+            self.assertIsInstance(err, breaker.CircuitOpenError)
+            self.assertEqual(1, mock_find_one.call_count)
+            self.assertEqual(1, mock_restart_mongo.call_count)
+
+        breaker.reset('mongo')
+
+        err, db_result = util.db_find_one('a', {'key1': 'a'})
+        self.assertIsNone(err)
+
+    @mongomock.patch(servers=(('localhost', 27017),))
+    def test_single_flight(self):
+        n_restarts = []
+
+        def _restart_mongo(**kwargs):
+            n_restarts.append(kwargs)
+            time.sleep(0.1)
+
+        with unittest.mock.patch.object(cfg, 'restart_mongo', side_effect=_restart_mongo):
+            threads = [threading.Thread(target=util._db_restart_mongo, args=('mongo', 'a', pymongo.errors.AutoReconnect('connection closed'))) for _ in range(8)]
+            for each in threads:
+                each.start()
+            for each in threads:
+                each.join()
+
+        self.assertEqual(1, len(n_restarts))
+        self.assertEqual(0, breaker.status()['mongo']['n_failures'])
+
+    @mongomock.patch(servers=(('localhost', 27017),))
+    def test_ping_timeout(self):
+        breaker.set_policy(the_ping_timeout_ms=100)
+
+        with unittest.mock.patch.object(cfg, 'restart_mongo', return_value=None), \
+                unittest.mock.patch('pymongo.MongoClient', side_effect=pymongo.MongoClient) as mock_client:
+            self.assertTrue(breaker.restart('mongo', 'a'))
+            self.assertEqual(100, mock_client.call_args[1]['serverSelectionTimeoutMS'])
+            self.assertEqual(0, breaker.status()['mongo']['n_failures'])
+
+        breaker.reset()
+        with unittest.mock.patch.object(cfg, 'restart_mongo', return_value=None), \
+                unittest.mock.patch('pymongo.MongoClient', side_effect=pymongo.errors.ServerSelectionTimeoutError('timeout')):
+            self.assertTrue(breaker.restart('mongo', 'a'))
+            self.assertEqual(1, breaker.status()['mongo']['n_failures'])
+
+    @mongomock.patch(servers=(('localhost', 27017),))
+    def test_min_interval(self):
+        breaker.set_policy(the_min_interval=10.0)
+
+        # not-primary in the election: only the 1st error restarts mongo.
+        with unittest.mock.patch.object(mongomock.collection.Collection, 'find_one', side_effect=pymongo.errors.NotPrimaryError('not primary')), \
+                unittest.mock.patch.object(cfg, 'restart_mongo', return_value=None) as mock_restart_mongo:
+            for _ in range(5):
+                err, db_result = util.db_find_one('a', {'key1': 'a'})
+                self.assertIsInstance(err, pymongo.errors.NotPrimaryError)
+            self.assertEqual(1, mock_restart_mongo.call_count)
+
+            status = breaker.status()
+            self.assertEqual(0, status['mongo']['n_failures'])
+            self.assertFalse(status['mongo']['is_open'])
+            self.assertGreater(status['mongo']['retry_after'], 0.0)
+
+            now = time.monotonic()
+            with unittest.mock.patch('time.monotonic', return_value=now + 10.0):
+                err, db_result = util.db_find_one('a', {'key1': 'a'}, retry_policy=retry.RetryPolicy(max_attempts=1))
+            self.assertEqual(2, mock_restart_mongo.call_count)
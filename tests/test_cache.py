@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import unittest.mock
+import logging
+import os
+import tempfile
+import threading
+import time
+import pymongo
+
+from pyutil_mongo import cfg
+from pyutil_mongo import util
+from pyutil_mongo import cache
+import mongomock
+
+
+class TestCache(unittest.TestCase):
+
+    @mongomock.patch(servers=(('localhost', 27017),))
+    def setUp(self):
+        self.logger = logging.getLogger('test')
+        collection_map = {
+            'a': 'b',
+            'a2': 'b',
+        }
+        ensure_index = {
+            'a': [('key1', pymongo.ASCENDING)],
+        }
+        mongo_map = cfg.MongoMap(collection_map, ensure_index=ensure_index)
+
+        err = cfg.init(self.logger, [mongo_map])
+
+        cache.enable(max_size=2)
+
+    def tearDown(self):
+        cache.disable()
+        cache.disable_pipeline()
+        util.drop('a')
+        cfg.clean()
+
+    def test_db_find_one(self):
+        err, db_result = util.db_update('a', {'key1': 'a'}, {'key2': 'b'})
+        self.assertIsNone(err)
+
+        err, db_result = util.db_find_one('a', {'key1': 'a'})
+        self.assertIsNone(err)
+        self.assertEqual({'key1': 'a', 'key2': 'b'}, db_result)
+
+        db_result['key2'] = 'c'
+
+        err, db_result = util.db_find_one('a', {'key1': 'a'})
+        self.assertIsNone(err)
+        self.assertEqual({'key1': 'a', 'key2': 'b'}, db_result)
+        self.assertEqual(1, cache.stats()['hits'])
+        self.assertEqual(1, cache.stats()['misses'])
+
+        # write through the alias of the same real collection.
+        err, db_result = util.db_update('a2', {'key1': 'a'}, {'key2': 'c'})
+        self.assertIsNone(err)
+
+        err, db_result = util.db_find_one('a', {'key1': 'a'})
+        self.assertIsNone(err)
+        self.assertEqual({'key1': 'a', 'key2': 'c'}, db_result)
+        self.assertEqual(2, cache.stats()['misses'])
+
+    def test_cache_key(self):
+        ns = util._get_ns('mongo', 'a')
+
+        self.assertEqual(cache._get_cache_key(ns, 'db_find', {'a': 1, 'b': {'$lt': 3, '$gte': 1}}, {'a': True, 'b': True}), cache._get_cache_key(ns, 'db_find', {'b': {'$gte': 1, '$lt': 3}, 'a': 1}, {'b': True, 'a': True}))
+        self.assertEqual(cache._get_cache_key(ns, 'db_find', {'$or': [{'a': 1, 'b': 2}]}, None), cache._get_cache_key(ns, 'db_find', {'$or': [{'b': 2, 'a': 1}]}, None))
+
+        # the embedded documents match in the order.
+        self.assertNotEqual(cache._get_cache_key(ns, 'db_find', {'a': {'x': 1, 'y': 2}}, None), cache._get_cache_key(ns, 'db_find', {'a': {'y': 2, 'x': 1}}, None))
+
+        err, db_result = util.db_find_one('a', {'key1': 'a', 'key2': 'b'})
+        err, db_result = util.db_find_one('a', {'key2': 'b', 'key1': 'a'})
+        self.assertEqual(1, cache.stats()['hits'])
+
+    def test_db_find(self):
+        err, db_result = util.db_insert('a', [{'key1': 'a', 'key2': 1}, {'key1': 'b', 'key2': 2}, {'key1': 'c', 'key2': 3}])
+        self.assertIsNone(err)
+
+        for key1 in ['a', 'b', 'c', 'a']:
+            err, db_results = util.db_find('a', {'key1': key1})
+            self.assertIsNone(err)
+            self.assertEqual(1, len(db_results))
+
+        stats = cache.stats()
+        self.assertEqual(0, stats['hits'])
+        self.assertEqual(4, stats['misses'])
+        self.assertEqual(2, stats['size'])
+        self.assertEqual(2, stats['evictions'])
+
+        err, db_results = util.db_find('a', {'key1': 'a'})
+        self.assertEqual(1, cache.stats()['hits'])
+
+        err, db_result = util.db_force_remove('a', {'key1': 'a'})
+        self.assertIsNone(err)
+
+        err, db_results = util.db_find('a', {'key1': 'a'})
+        self.assertIsNone(err)
+        self.assertEqual([], db_results)
+
+    def test_db_aggregate(self):
+        cache.disable()
+        cache.enable_pipeline(max_size=2)
+
+        err, db_result = util.db_insert('a', [{'key1': 'a', 'key2': 1}, {'key1': 'a', 'key2': 2}, {'key1': 'b', 'key2': 3}])
+        self.assertIsNone(err)
+
+        pipe = [{'$group': {'_id': '$key1', 'total': {'$sum': '$key2'}}}, {'$sort': {'_id': 1}}]
+        for _ in range(2):
+            err, db_results = util.db_aggregate('a', pipe)
+            self.assertIsNone(err)
+            self.assertEqual([{'_id': 'a', 'total': 3}, {'_id': 'b', 'total': 3}], db_results)
+
+        stats = cache.pipeline_stats()
+        self.assertEqual(1, stats['hits'])
+        self.assertEqual(1, stats['misses'])
+
+        # not cached: $sample
+        err, db_results = util.db_aggregate('a', [{'$sample': {'size': 1}}])
+        self.assertIsNone(err)
+        self.assertEqual(1, cache.pipeline_stats()['size'])
+
+        err, db_result = util.db_update('a2', {'key1': 'b'}, {'key2': 10})
+        self.assertIsNone(err)
+
+        err, db_results = util.db_aggregate('a', pipe)
+        self.assertIsNone(err)
+        self.assertEqual([{'_id': 'a', 'total': 3}, {'_id': 'b', 'total': 10}], db_results)
+        self.assertEqual(2, cache.pipeline_stats()['misses'])
+
+    def test_db_aggregate_single_flight(self):
+        cache.enable_pipeline()
+
+        n_calls = []
+        is_started = threading.Event()
+
+        def _func():
+            n_calls.append(1)
+            is_started.set()
+            time.sleep(0.1)
+            return None, [{'_id': 'a'}]
+
+        ns = ('localhost', 'test', 'b')
+        results = []
+
+        def _run():
+            results.append(cache.run_pipeline(ns, 'a', [{'$match': {}}], _func))
+
+        threads = [threading.Thread(target=_run)]
+        threads[0].start()
+        is_started.wait()
+        threads += [threading.Thread(target=_run) for _ in range(3)]
+        for each in threads[1:]:
+            each.start()
+        for each in threads:
+            each.join()
+
+        self.assertEqual(1, len(n_calls))
+        self.assertEqual([(None, [{'_id': 'a'}])] * 4, results)
+
+    def test_db_aggregate_disk(self):
+        with tempfile.TemporaryDirectory() as the_dir:
+            cache.enable_pipeline(the_pipeline_dir=the_dir)
+
+            err, db_result = util.db_insert('a', [{'key1': 'a', 'key2': 1}])
+            pipe = [{'$project': {'_id': False, 'key1': True}}]
+
+            err, db_results = util.db_aggregate('a', pipe)
+            self.assertIsNone(err)
+            self.assertEqual(1, len(os.listdir(the_dir)))
+
+            # new process: the in-memory cache is empty.
+            cache.enable_pipeline(the_pipeline_dir=the_dir)
+            err, db_results = util.db_aggregate('a', [{'$match': {'key1': 'a'}}])
+            self.assertEqual(2, len(os.listdir(the_dir)))
+
+            with unittest.mock.patch.object(util, '_db_aggregate', side_effect=Exception('not from disk')):
+                err, db_results = util.db_aggregate('a', pipe)
+            self.assertIsNone(err)
+            self.assertEqual([{'key1': 'a'}], db_results)
+
+            err, db_result = util.db_insert('a', [{'key1': 'b', 'key2': 1}])
+            self.assertEqual([], os.listdir(the_dir))
+
+    def test_db_aggregate_disk_expire(self):
+        with tempfile.TemporaryDirectory() as the_dir:
+            cache.enable_pipeline(ttl=10.0, the_pipeline_dir=the_dir)
+
+            err, db_result = util.db_insert('a', [{'key1': 'a', 'key2': 1}])
+            pipe = [{'$project': {'_id': False, 'key1': True}}]
+
+            err, db_results = util.db_aggregate('a', pipe)
+            self.assertIsNone(err)
+            path = os.path.join(the_dir, os.listdir(the_dir)[0])
+            with open(path, 'rb') as f:
+                data = f.read()
+
+            # new process, 8 sec later: the file is not rewritten, cached in memory for the remaining 2 sec.
+            cache.enable_pipeline(ttl=10.0, the_pipeline_dir=the_dir)
+            now = time.time()
+            with unittest.mock.patch('time.time', return_value=now + 8.0):
+                err, db_results = util.db_aggregate('a', pipe)
+            self.assertIsNone(err)
+            with open(path, 'rb') as f:
+                self.assertEqual(data, f.read())
+
+            now = time.monotonic()
+            with unittest.mock.patch('time.monotonic', return_value=now + 3.0):
+                self.assertFalse(cache.pipeline_cache.get(util._get_ns('mongo', 'a'), cache._get_pipeline_key(util._get_ns('mongo', 'a'), pipe))[0])
+
+    def test_db_aggregate_disk_invalidate(self):
+        with tempfile.TemporaryDirectory() as the_dir:
+            cache.enable_pipeline(the_pipeline_dir=the_dir)
+
+            pipe = [{'$project': {'_id': False, 'key1': True}}]
+            ns = util._get_ns('mongo', 'a')
+            cache_key = cache._get_pipeline_key(ns, pipe)
+            version = cache.pipeline_cache.get_version(ns)
+
+            # failed to write: the temp-file is removed.
+            with unittest.mock.patch('os.replace', side_effect=OSError('disk full')):
+                cache._set_pipeline_file(ns, cache_key, [], 10.0, version)
+            self.assertEqual([], os.listdir(the_dir))
+
+            # invalidated while writing the file: the file and the temp-file are not kept.
+            mkstemp = tempfile.mkstemp
+
+            def _mkstemp(*args, **kwargs):
+                result = mkstemp(*args, **kwargs)
+                cache.invalidate(ns)
+                return result
+
+            with unittest.mock.patch('tempfile.mkstemp', side_effect=_mkstemp):
+                cache._set_pipeline_file(ns, cache_key, [], 10.0, version)
+            self.assertEqual([], os.listdir(the_dir))
+
+            cache._set_pipeline_file(ns, cache_key, [], 10.0, cache.pipeline_cache.get_version(ns))
+            self.assertEqual(1, len(os.listdir(the_dir)))
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import unittest
+import unittest.mock
 import logging
 import pymongo
 
@@ -46,3 +47,115 @@ class TestCfg(unittest.TestCase):
 
         err = cfg.init(logger, [mongo_map])
         self.assertIsNotNone(err)
+
+    @mongomock.patch(servers=(('localhost', 27017),))
+    def test_init_shared_client(self):
+        logger = logging.getLogger("test")
+
+        mongo_map = cfg.MongoMap({'a': 'b'}, max_pool_size=10)
+        mongo_map2 = cfg.MongoMap({'c': 'd'}, db_name='mongo2', mongo_db_name='test2', max_pool_size=10)
+        mongo_map3 = cfg.MongoMap({'e': 'f'}, db_name='mongo3', max_pool_size=20)
+
+        err = cfg.init(logger, [mongo_map, mongo_map2, mongo_map3])
+        self.assertIsNone(err)
+
+        self.assertEqual(2, len(cfg.clients))
+        self.assertEqual(cfg.config['mongo']['client_key'], cfg.config['mongo2']['client_key'])
+        self.assertNotEqual(cfg.config['mongo']['client_key'], cfg.config['mongo3']['client_key'])
+        self.assertIs(cfg.config['mongo']['db']['a'].database.client, cfg.config['mongo2']['db']['c'].database.client)
+
+        client = cfg.clients[cfg.config['mongo']['client_key']]
+
+        with unittest.mock.patch.object(client, 'close') as mock_close:
+            err = cfg.restart_mongo(collection_name='a', db_name='mongo')
+            self.assertIsNone(err)
+            self.assertEqual(0, mock_close.call_count)
+
+        self.assertEqual(2, len(cfg.clients))
+        new_client = cfg.clients[cfg.config['mongo']['client_key']]
+        self.assertIsNot(client, new_client)
+        self.assertIs(new_client, cfg.config['mongo']['db']['a'].database.client)
+        self.assertIs(new_client, cfg.config['mongo2']['db']['c'].database.client)
+
+    @mongomock.patch(servers=(('localhost', 27017),))
+    def test_init_collection_db_map(self):
+        logger = logging.getLogger("test")
+
+        mongo_map = cfg.MongoMap({'a': 'b', 'c': 'd'})
+        mongo_map2 = cfg.MongoMap({'c': 'd', 'e': 'f'}, db_name='mongo2')
+
+        err = cfg.init(logger, [mongo_map, mongo_map2])
+        self.assertIsNone(err)
+
+        self.assertEqual({'a': 'mongo', 'c': None, 'e': 'mongo2'}, cfg.collection_db_map)
+        self.assertEqual('mongo', util._get_default_db('a'))
+        self.assertIsNone(util._get_default_db('c'))
+        self.assertIsNone(util._get_default_db('g'))
+
+        err = cfg.restart_mongo(collection_name='a')
+        self.assertIsNone(err)
+        self.assertEqual({'a': 'mongo', 'c': None, 'e': 'mongo2'}, cfg.collection_db_map)
+
+        cfg.clean()
+        self.assertEqual({}, cfg.collection_db_map)
+
+    @mongomock.patch(servers=(('localhost', 27017),))
+    def test_init_ensure_index(self):
+        logger = logging.getLogger("test")
+
+        collection_map = {
+            'a': 'b',
+            'a2': 'b',
+        }
+        ensure_index = {
+            'a': [('key1', pymongo.ASCENDING)],
+        }
+        ensure_unique_index = {
+            'a2': [('key2', pymongo.ASCENDING)],
+        }
+        mongo_map = cfg.MongoMap(collection_map, ensure_index=ensure_index, ensure_unique_index=ensure_unique_index)
+
+        err = cfg.init(logger, [mongo_map])
+        self.assertIsNone(err)
+
+        index_keys = [list(each['key'].items()) for each in cfg.config['mongo']['db']['a'].list_indexes()]
+        self.assertIn([('key1', 1)], index_keys)
+        self.assertIn([('key2', 1)], index_keys)
+
+        with unittest.mock.patch.object(mongomock.collection.Collection, 'create_index', autospec=True) as mock_create_index:
+            err = cfg.restart_mongo(collection_name='a')
+            self.assertIsNone(err)
+            self.assertEqual(0, mock_create_index.call_count)
+
+        with unittest.mock.patch.object(mongomock.collection.Collection, 'list_indexes', autospec=True) as mock_list_indexes:
+            err = cfg.restart_mongo(collection_name='a', is_ensure_index=False)
+            self.assertIsNone(err)
+            self.assertEqual(0, mock_list_indexes.call_count)
+
+    @mongomock.patch(servers=(('localhost', 27017),))
+    def test_init_lazy(self):
+        logger = logging.getLogger("test")
+
+        mongo_map = cfg.MongoMap({'a': 'b'}, ensure_index={'a': [('key1', pymongo.ASCENDING)]})
+
+        err = cfg.init(logger, [mongo_map], the_is_lazy=True)
+        self.assertIsNone(err)
+
+        self.assertEqual(0, len(cfg.clients))
+
+        err, result = util.db_find_one('a', {'key1': 1})
+        self.assertIsNone(err)
+        self.assertEqual({}, result)
+
+        self.assertEqual(1, len(cfg.clients))
+        index_keys = [list(each['key'].items()) for each in cfg.config['mongo']['db']['a'].list_indexes()]
+        self.assertIn([('key1', pymongo.ASCENDING)], index_keys)
+
+        with unittest.mock.patch('os.getpid', return_value=-1):
+            collection = cfg.config['mongo']['db']['a']
+            self.assertIsNot(cfg.config['mongo']['db']['a'].database.client, None)
+            self.assertEqual(-1, cfg._client_pids[cfg.config['mongo']['client_key']])
+            self.assertIs(collection, cfg.config['mongo']['db']['a'])
+
+        cfg.clean()
+        self.assertFalse(cfg.is_lazy)
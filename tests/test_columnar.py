@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import logging
+
+from pyutil_mongo import cfg
+from pyutil_mongo import util
+from pyutil_mongo import columnar
+import mongomock
+
+
+class TestColumnar(unittest.TestCase):
+
+    @mongomock.patch(servers=(('localhost', 27017),))
+    def setUp(self):
+        self.logger = logging.getLogger('test')
+        collection_map = {
+            'a': 'b',
+        }
+        mongo_map = cfg.MongoMap(collection_map)
+
+        err = cfg.init(self.logger, [mongo_map])
+
+        docs = [{'key1': 'a', 'key2': idx, 'key3': {'key4': idx * 0.5}} for idx in range(5)]
+        docs.append({'key1': 'b'})
+        err, db_result = util.db_insert('a', docs)
+
+    def tearDown(self):
+        util.drop('a')
+        cfg.clean()
+
+    @unittest.skipIf(columnar.numpy is None, 'numpy is not installed')
+    def test_db_find_columns(self):
+        err, columns = columnar.db_find_columns('a', [('key2', 'int64'), ('key3.key4', 'float64')], n_docs=2)
+        self.assertIsNone(err)
+
+        self.assertEqual([0, 1, 2, 3, 4, None], columns['key2'].tolist())
+        self.assertEqual([0.0, 0.5, 1.0, 1.5, 2.0, None], columns['key3.key4'].tolist())
+        self.assertEqual('int64', str(columns['key2'].dtype))
+
+    @unittest.skipIf(columnar.numpy is None, 'numpy is not installed')
+    def test_db_aggregate_columns(self):
+        pipe = [{'$group': {'_id': '$key1', 'total': {'$sum': '$key2'}}}, {'$sort': {'_id': 1}}]
+        err, columns = columnar.db_aggregate_columns('a', pipe, [('_id', 'object'), ('total', 'int64')])
+        self.assertIsNone(err)
+
+        self.assertEqual(['a', 'b'], columns['_id'].tolist())
+        self.assertEqual([10, 0], columns['total'].tolist())
+
+    @unittest.skipIf(columnar.pyarrow is None, 'pyarrow is not installed')
+    def test_db_find_record_batches(self):
+        batches = []
+        for err, batch in columnar.db_find_record_batches('a', [('key1', 'string'), ('key2', 'int64')], batch_size=4):
+            self.assertIsNone(err)
+            batches.append(batch)
+
+        self.assertEqual([4, 2], [each.num_rows for each in batches])
+        self.assertEqual([4, None], batches[1].column(1).to_pylist())
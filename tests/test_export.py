@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import unittest.mock
+import logging
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+
+import bson
+
+from pyutil_mongo import cfg
+from pyutil_mongo import util
+from pyutil_mongo import export
+from pyutil_mongo import load
+import mongomock
+
+try:
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+class TestExport(unittest.TestCase):
+
+    @mongomock.patch(servers=(('localhost', 27017),))
+    def setUp(self):
+        self.logger = logging.getLogger('test')
+        collection_map = {
+            'a': 'b',
+        }
+        mongo_map = cfg.MongoMap(collection_map)
+
+        err = cfg.init(self.logger, [mongo_map])
+
+        err, db_result = util.db_insert('a', [{'_id': idx, 'key1': 'a' if idx % 2 else 'b', 'key2': idx} for idx in range(20)])
+
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+        util.drop('a')
+        cfg.clean()
+
+    def test_export_jsonl_gzip(self):
+        path = os.path.join(self.tmp_dir.name, 'a.jsonl.gz')
+
+        err, manifest = export.export_find('a', path, {'key1': 'a'}, is_raw=False)
+        self.assertIsNone(err)
+        self.assertEqual(10, manifest['n_docs'])
+        self.assertEqual('gzip', manifest['compression'])
+
+        with gzip.open(path, 'rt') as f:
+            docs = [json.loads(each) for each in f]
+        self.assertEqual([{'_id': idx, 'key1': 'a', 'key2': idx} for idx in range(1, 20, 2)], docs)
+
+        with open(path, 'rb') as f:
+            self.assertEqual(hashlib.sha256(f.read()).hexdigest(), manifest['files'][0]['sha256'])
+
+        with open(path + '.manifest.json') as f:
+            self.assertEqual(10, json.load(f)['n_docs'])
+
+        # round-trip with load.
+        util.drop('a')
+        err, stats = load.load_file('a', path)
+        self.assertIsNone(err)
+        self.assertEqual(10, stats['n_inserted'])
+
+    def test_export_bson_shards(self):
+        path = os.path.join(self.tmp_dir.name, 'a.bson')
+
+        with unittest.mock.patch('pyutil_mongo.scan.db_scan_ranges', return_value=(None, [(None, 5), (5, 12), (12, None)])):
+            err, manifest = export.export_find('a', path, is_raw=False, n_shards=3)
+        self.assertIsNone(err)
+        self.assertEqual(20, manifest['n_docs'])
+        self.assertEqual(['a-00000.bson', 'a-00001.bson', 'a-00002.bson'], [each['path'] for each in manifest['files']])
+        self.assertEqual([5, 7, 8], [each['n_docs'] for each in manifest['files']])
+        self.assertEqual([5, 12], manifest['files'][1]['range'])
+
+        docs = []
+        for each in manifest['files']:
+            with open(os.path.join(self.tmp_dir.name, each['path']), 'rb') as f:
+                docs += bson.decode_all(f.read())
+        self.assertEqual(list(range(20)), [each['_id'] for each in docs])
+
+    def test_export_aggregate(self):
+        path = os.path.join(self.tmp_dir.name, 'a.jsonl')
+
+        err, manifest = export.export_aggregate('a', [{'$group': {'_id': '$key1', 'n': {'$sum': 1}}}, {'$sort': {'_id': 1}}], path)
+        self.assertIsNone(err)
+        self.assertEqual(2, manifest['n_docs'])
+
+        with open(path) as f:
+            self.assertEqual([{'_id': 'a', 'n': 10}, {'_id': 'b', 'n': 10}], [json.loads(each) for each in f])
+
+        err, manifest = export.export_aggregate('a', [], os.path.join(self.tmp_dir.name, 'a.csv'))
+        self.assertIsNotNone(err)
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test_export_parquet(self):
+        path = os.path.join(self.tmp_dir.name, 'a.parquet')
+
+        err, manifest = export.export_find('a', path, {'key1': 'b'}, schema=[('_id', 'int64'), ('key2', 'int64')], batch_size=4)
+        self.assertIsNone(err)
+        self.assertEqual(10, manifest['n_docs'])
+
+        parquet_file = pyarrow.parquet.ParquetFile(path)
+        self.assertEqual(3, parquet_file.num_row_groups)
+        self.assertEqual(list(range(0, 20, 2)), parquet_file.read().column('key2').to_pylist())
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import logging
+import gzip
+import io
+import os
+import tempfile
+import contextlib
+
+import bson
+import pymongo
+
+from pyutil_mongo import cfg
+from pyutil_mongo import util
+from pyutil_mongo import load
+import mongomock
+
+
+class TestLoad(unittest.TestCase):
+
+    @mongomock.patch(servers=(('localhost', 27017),))
+    def setUp(self):
+        self.logger = logging.getLogger('test')
+        collection_map = {
+            'a': 'b',
+        }
+        ensure_unique_index = {
+            'a': [('key1', pymongo.ASCENDING)],
+        }
+        mongo_map = cfg.MongoMap(collection_map, ensure_unique_index=ensure_unique_index)
+
+        err = cfg.init(self.logger, [mongo_map])
+
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+        util.drop('a')
+        cfg.clean()
+
+    def _write(self, filename, data, is_gzip=False):
+        path = os.path.join(self.tmp_dir.name, filename)
+        with (gzip.open if is_gzip else open)(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_load_jsonl(self):
+        data = b''.join([b'{"key1": "%d", "key2": {"$numberLong": "%d"}}\n' % (idx, idx) for idx in range(10)])
+        data += b'\n{"key1": "3", "key2": 100}\n{invalid\n'
+        path = self._write('a.jsonl', data)
+
+        progresses = []
+        err, stats = load.load_file('a', path, batch_size=3, n_writers=2, progress=progresses.append)
+        self.assertIsNotNone(err)
+        self.assertEqual(12, stats['n_docs'])
+        self.assertEqual(len(data) - 1, stats['n_bytes'])
+        self.assertEqual(10, stats['n_inserted'])
+        self.assertEqual(1, stats['n_duplicates'])
+        self.assertEqual(10, stats['duplicates'][0]['index'])
+        self.assertEqual(1, stats['n_errors'])
+        self.assertEqual(11, stats['errors'][0]['index'])
+        self.assertTrue(progresses)
+
+        err, db_results = util.db_find('a', {'key1': '3'})
+        self.assertEqual([{'key1': '3', 'key2': 3}], db_results)
+
+    def test_load_csv_upsert(self):
+        err, db_result = util.db_insert('a', [{'key1': 'a', 'key2': 1, 'key4': 'x'}])
+
+        path = self._write('a.csv.gz', b'key1,key2,key3.key4\na,10,\nb,20,"c\nd"\n', is_gzip=True)
+
+        err, stats = load.load_file('a', path, csv_types={'key2': int}, upsert_keys=['key1'])
+        self.assertIsNone(err)
+        self.assertEqual(2, stats['n_docs'])
+        self.assertEqual(1, stats['n_upserted'])
+        self.assertEqual(1, stats['n_modified'])
+
+        err, db_results = util.db_find('a', {})
+        self.assertEqual([{'key1': 'a', 'key2': 10, 'key4': 'x'}, {'key1': 'b', 'key2': 20, 'key3': {'key4': 'c\nd'}}], db_results)
+
+    def test_load_bson(self):
+        docs = [{'_id': idx, 'key1': str(idx)} for idx in range(5)]
+        path = self._write('a.bson', b''.join([bson.encode(each) for each in docs]) + b'\x10\x00')
+
+        err, stats = load.load_file('a', path, batch_bytes=1)
+        self.assertIsNotNone(err)
+        self.assertEqual(5, stats['n_inserted'])
+        self.assertEqual(1, stats['n_errors'])
+
+        err, db_results = util.db_find('a', {}, {'_id': True, 'key1': True})
+        self.assertEqual(docs, db_results)
+
+    def test_load_missing_file(self):
+        err, stats = load.load_file('a', os.path.join(self.tmp_dir.name, 'missing.jsonl'))
+        self.assertIsNotNone(err)
+        self.assertEqual(0, stats['n_docs'])
+
+    @mongomock.patch(servers=(('localhost', 27017),))
+    def test_main(self):
+        cfg.clean()
+
+        path = self._write('a.jsonl', b'{"key1": "a"}\n{"key1": "b"}\n')
+        duplicates_path = os.path.join(self.tmp_dir.name, 'duplicates.jsonl')
+
+        f = io.StringIO()
+        with contextlib.redirect_stdout(f):
+            exit_code = load.main(['--collection', 'c', '--upsert-key', 'key1', '--duplicates', duplicates_path, path])
+        self.assertEqual(0, exit_code)
+        self.assertIn('"n_upserted": 2', f.getvalue())
+        self.assertTrue(os.path.exists(duplicates_path))
+
+        self.assertEqual(2, load.main(['--collection', 'c', '--csv-type', 'key2=decimal', path]))
+
+        # the missing file is reported, the other files are still loaded.
+        f = io.StringIO()
+        with contextlib.redirect_stdout(f):
+            exit_code = load.main(['--collection', 'c', '--upsert-key', 'key1', os.path.join(self.tmp_dir.name, 'missing.jsonl'), path])
+        self.assertEqual(1, exit_code)
+        self.assertIn('"n_modified": 0', f.getvalue())
+        self.assertEqual(2, len(f.getvalue().splitlines()))
+
+        self.tmp_dir.cleanup()
+        self.setUp()
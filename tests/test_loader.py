@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import unittest.mock
+import logging
+import asyncio
+import threading
+
+from pyutil_mongo import cfg
+from pyutil_mongo import util
+from pyutil_mongo import aio
+from pyutil_mongo import loader
+import mongomock
+
+
+class TestLoader(unittest.TestCase):
+
+    @mongomock.patch(servers=(('localhost', 27017),))
+    def setUp(self):
+        self.logger = logging.getLogger('test')
+        collection_map = {
+            'a': 'b',
+        }
+        mongo_map = cfg.MongoMap(collection_map)
+
+        err = cfg.init(self.logger, [mongo_map])
+
+        err, db_result = util.db_insert('a', [{'id': idx, 'key1': 'a%s' % (idx)} for idx in range(5)])
+
+    def tearDown(self):
+        util.drop('a')
+        cfg.clean()
+        aio.shutdown()
+
+    def test_load(self):
+        the_loader = loader.Loader('a', key_field='id', wait_ms=100.0)
+
+        results = {}
+
+        def _load(idx):
+            results[idx] = the_loader.load(idx % 6)
+
+        with unittest.mock.patch.object(util, 'db_find_it', wraps=util.db_find_it) as mock_db_find_it:
+            threads = [threading.Thread(target=_load, args=(idx,)) for idx in range(12)]
+            for each in threads:
+                each.start()
+            for each in threads:
+                each.join()
+
+            self.assertEqual(1, mock_db_find_it.call_count)
+            self.assertEqual({'id': {'$in': [0, 1, 2, 3, 4, 5]}}, sorted_in(mock_db_find_it.call_args[0][1]))
+
+        for idx in range(12):
+            err, db_result = results[idx]
+            self.assertIsNone(err)
+            if idx % 6 == 5:
+                self.assertEqual({}, db_result)
+            else:
+                self.assertEqual({'id': idx % 6, 'key1': 'a%s' % (idx % 6)}, db_result)
+
+        # own doc for each caller
+        results[0][1]['key1'] = 'changed'
+        self.assertEqual('a0', results[6][1]['key1'])
+
+    def test_load_leader_error(self):
+        the_loader = loader.Loader('a', key_field='id', wait_ms=100.0)
+
+        err, db_result = the_loader.load([1, 2])
+        self.assertIsNotNone(err)
+
+        results = {}
+
+        def _load(idx):
+            results[idx] = the_loader.load(idx)
+
+        with unittest.mock.patch.object(loader, '_find_docs', side_effect=Exception('find failed')):
+            threads = [threading.Thread(target=_load, args=(idx,)) for idx in range(3)]
+            for each in threads:
+                each.start()
+            for each in threads:
+                each.join(5.0)
+                self.assertFalse(each.is_alive())
+
+        self.assertTrue(all([results[idx][0] is not None for idx in range(3)]))
+
+        err, db_result = the_loader.load(1)
+        self.assertIsNone(err)
+        self.assertEqual({'id': 1, 'key1': 'a1'}, db_result)
+
+    def test_load_leader_interrupt(self):
+        the_loader = loader.Loader('a', key_field='id', wait_ms=100.0)
+
+        results = {}
+
+        def _load(idx):
+            try:
+                results[idx] = the_loader.load(idx)
+            except KeyboardInterrupt as e:
+                results[idx] = ('raised', e)
+
+        with unittest.mock.patch.object(loader, '_find_docs', side_effect=KeyboardInterrupt()):
+            threads = [threading.Thread(target=_load, args=(idx,)) for idx in range(3)]
+            for each in threads:
+                each.start()
+            for each in threads:
+                each.join(5.0)
+                self.assertFalse(each.is_alive())
+
+        # the leader re-raises, the waiters get the error.
+        self.assertEqual(1, len([each for each in results.values() if each[0] == 'raised']))
+        self.assertTrue(all([isinstance(each[1] if each[0] == 'raised' else each[0], KeyboardInterrupt) for each in results.values()]))
+
+    def test_async_load_cancelled(self):
+        async def _test():
+            the_loader = loader.AsyncLoader('a', key_field='id', wait_ms=10.0)
+
+            with unittest.mock.patch.object(loader, '_find_docs', side_effect=asyncio.CancelledError()):
+                results = await asyncio.wait_for(asyncio.gather(*[the_loader.load(idx) for idx in range(3)]), 5.0)
+
+            for err, db_result in results:
+                self.assertIsInstance(err, asyncio.CancelledError)
+                self.assertEqual({}, db_result)
+
+        asyncio.run(_test())
+
+    def test_load_many(self):
+        the_loader = loader.Loader('a', key_field='id', fields={'key1': True, '_id': False})
+
+        err, db_results = the_loader.load_many([3, 1, 3, 9])
+        self.assertIsNone(err)
+        self.assertEqual([{'key1': 'a3'}, {'key1': 'a1'}, {'key1': 'a3'}, {}], db_results)
+
+    def test_async_load(self):
+        async def _test():
+            the_loader = loader.AsyncLoader('a', key_field='id', wait_ms=10.0)
+
+            with unittest.mock.patch.object(util, 'db_find_it', wraps=util.db_find_it) as mock_db_find_it:
+                results = await asyncio.gather(*[the_loader.load(idx % 3) for idx in range(9)])
+                self.assertEqual(1, mock_db_find_it.call_count)
+
+            for idx, (err, db_result) in enumerate(results):
+                self.assertIsNone(err)
+                self.assertEqual({'id': idx % 3, 'key1': 'a%s' % (idx % 3)}, db_result)
+
+            err, db_results = await the_loader.load_many([4, 0])
+            self.assertIsNone(err)
+            self.assertEqual([{'id': 4, 'key1': 'a4'}, {'id': 0, 'key1': 'a0'}], db_results)
+
+        asyncio.run(_test())
+
+
+def sorted_in(query):
+    return {key: {'$in': sorted(val['$in'])} for key, val in query.items()}
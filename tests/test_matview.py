@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import unittest.mock
+import logging
+
+from pyutil_mongo import cfg
+from pyutil_mongo import util
+from pyutil_mongo import matview
+from pyutil_mongo import cache
+import mongomock
+
+
+class TestMatView(unittest.TestCase):
+
+    @mongomock.patch(servers=(('localhost', 27017),))
+    def setUp(self):
+        self.logger = logging.getLogger('test')
+        collection_map = {
+            'a': 'b',
+            'a2': 'b',
+            'view': 'view',
+        }
+        mongo_map = cfg.MongoMap(collection_map)
+
+        err = cfg.init(self.logger, [mongo_map])
+
+        err, db_result = util.db_insert('a', [{'key1': 'a', 'key2': 1}, {'key1': 'a', 'key2': 5}, {'key1': 'b', 'key2': 3}])
+
+        err = matview.register('view', 'a', 'view', ['key1'], {'total': {'$sum': '$key2'}, 'n': {'$sum': 1}, 'lo': {'$min': '$key2'}, 'hi': {'$max': '$key2'}})
+        self.assertIsNone(err)
+
+    def tearDown(self):
+        matview.clean()
+        util.drop('a')
+        util.drop('view')
+        cfg.clean()
+
+    def _get_view(self):
+        err, db_results = util.db_find('view', {})
+        self.assertIsNone(err)
+        return sorted(db_results, key=lambda each: each['key1'])
+
+    def _get_expected(self):
+        err, db_results = util.db_aggregate('a', [matview.views['view'].get_group_spec()])
+        self.assertIsNone(err)
+        return sorted([dict({'key1': each['_id']['0']}, **{k: v for k, v in each.items() if k != '_id'}) for each in db_results], key=lambda each: each['key1'])
+
+    def test_register(self):
+        self.assertIsNotNone(matview.register('view2', 'a', 'view2', ['key1'], {'avg': {'$avg': '$key2'}}))
+        self.assertIsNotNone(matview.register('view2', 'a', 'a', ['key1'], {'n': {'$sum': 1}}))
+        self.assertIsNotNone(matview.register('view2', 'a', 'view2', ['key1'], {'key1': {'$sum': 1}}))
+        self.assertIsNotNone(matview.build('view2'))
+
+    def test_insert(self):
+        err = matview.build('view')
+        self.assertIsNone(err)
+        self.assertEqual([{'key1': 'a', 'total': 6, 'n': 2, 'lo': 1, 'hi': 5}, {'key1': 'b', 'total': 3, 'n': 1, 'lo': 3, 'hi': 3}], self._get_view())
+
+        err, db_result = util.db_insert('a', [{'key1': 'a', 'key2': 10}, {'key1': 'c', 'key2': 0}, {'key1': 'c'}])
+        self.assertIsNone(err)
+        self.assertEqual([{'key1': 'a', 'total': 16, 'n': 3, 'lo': 1, 'hi': 10}, {'key1': 'b', 'total': 3, 'n': 1, 'lo': 3, 'hi': 3}, {'key1': 'c', 'total': 0, 'n': 2, 'lo': 0, 'hi': 0}], self._get_view())
+        self.assertEqual(self._get_expected(), self._get_view())
+
+    def test_update_remove(self):
+        err = matview.build('view')
+        self.assertIsNone(err)
+
+        # through the alias of the same real collection, moving a doc from group a to b.
+        err, db_result = util.db_update('a2', {'key2': 5}, {'key1': 'b'})
+        self.assertIsNone(err)
+        self.assertEqual([{'key1': 'a', 'total': 1, 'n': 1, 'lo': 1, 'hi': 1}, {'key1': 'b', 'total': 8, 'n': 2, 'lo': 3, 'hi': 5}], self._get_view())
+
+        err, db_result = util.db_force_bulk_update('a', [{'key': {'key2': 3}, 'val': {'key2': 4}}, {'key': {'key1': 'd'}, 'val': {'key2': 7}}], is_set=True, upsert=True, multi=False)
+        self.assertIsNone(err)
+        self.assertEqual(self._get_expected(), self._get_view())
+        self.assertEqual(3, len(self._get_view()))
+
+        err, db_result = util.db_force_remove('a', {'key1': 'a'})
+        self.assertIsNone(err)
+        self.assertEqual(['b', 'd'], [each['key1'] for each in self._get_view()])
+        self.assertEqual(self._get_expected(), self._get_view())
+
+    def test_bulk_chunks_error(self):
+        err = matview.build('view')
+        self.assertIsNone(err)
+
+        with unittest.mock.patch.object(matview, '_MAX_KEYS_IN_MATCH', 1):
+            err, db_result = util.db_force_bulk_update('a', [{'key': {'key2': 1}, 'val': {'key2': 2}}, {'key': {'key2': 3}, 'val': {'key1': 'a'}}], is_set=True, upsert=False, multi=True, chunk_size=1)
+        self.assertIsNone(err)
+        self.assertEqual([{'key1': 'a', 'total': 10, 'n': 3, 'lo': 2, 'hi': 5}], self._get_view())
+
+        with unittest.mock.patch.object(matview, '_find_group_docs', side_effect=Exception('find failed')):
+            err, db_result = util.db_update('a', {'key2': 2}, {'key2': 4})
+        self.assertIsNotNone(err)
+        self.assertTrue(matview.views['view'].is_built)
+
+        err = matview.build('view')
+        self.assertIsNone(err)
+        self.assertEqual(self._get_expected(), self._get_view())
+
+    def test_drop(self):
+        err = matview.build('view')
+        self.assertIsNone(err)
+
+        err = util.drop('a')
+        self.assertIsNone(err)
+        self.assertEqual([], self._get_view())
+        self.assertTrue(matview.views['view'].is_built)
+
+        err, db_result = util.db_insert('a', [{'key1': 'c', 'key2': 1}])
+        self.assertEqual([{'key1': 'c', 'total': 1, 'n': 1, 'lo': 1, 'hi': 1}], self._get_view())
+
+        err = util.drop('view')
+        self.assertIsNone(err)
+        self.assertFalse(matview.views['view'].is_built)
+
+    def test_insert_concurrent_recompute(self):
+        err = matview.build('view')
+        self.assertIsNone(err)
+
+        # the concurrent write to the same group recomputes the group between insert_many and on_insert.
+        insert_many = util._get_collection('mongo', 'a').insert_many
+
+        def _insert_many(*args, **kwargs):
+            result = insert_many(*args, **kwargs)
+            self.assertIsNone(matview._recompute_groups(matview.views['view'], set([('a',)])))
+            return result
+
+        with unittest.mock.patch.object(util._get_collection('mongo', 'a'), 'insert_many', side_effect=_insert_many):
+            err, db_result = util.db_insert('a', [{'key1': 'a', 'key2': 10}])
+        self.assertIsNone(err)
+        self.assertEqual(self._get_expected(), self._get_view())
+        self.assertEqual(16, self._get_view()[0]['total'])
+
+    def test_pipeline_cache(self):
+        cache.enable_pipeline(ttl=60, is_invalidate=False)
+        try:
+            err = matview.build('view')
+            self.assertIsNone(err)
+
+            err, db_result = util.db_update('a', {'key2': 5}, {'key2': 7})
+            self.assertIsNone(err)
+            err, db_result = util.db_update('a', {'key2': 7}, {'key2': 9})
+            self.assertIsNone(err)
+            self.assertEqual(10, self._get_view()[0]['total'])
+        finally:
+            cache.disable_pipeline()
+
+    def test_set_if_not_exists(self):
+        err = matview.build('view')
+        self.assertIsNone(err)
+
+        err, db_result = util.db_set_if_not_exists('a', {'key1': 'c'}, {'key2': 2})
+        self.assertIsNone(err)
+        self.assertEqual(self._get_expected(), self._get_view())
+        self.assertEqual('c', self._get_view()[2]['key1'])
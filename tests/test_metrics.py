@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import logging
+
+from pyutil_mongo import cfg
+from pyutil_mongo import util
+from pyutil_mongo import metrics
+import mongomock
+
+
+class TestMetrics(unittest.TestCase):
+
+    @mongomock.patch(servers=(('localhost', 27017),))
+    def setUp(self):
+        self.logger = logging.getLogger('test')
+        collection_map = {
+            'a': 'b',
+        }
+        mongo_map = cfg.MongoMap(collection_map)
+
+        err = cfg.init(self.logger, [mongo_map])
+
+        metrics.reset()
+        metrics.enable()
+
+    def tearDown(self):
+        metrics.disable()
+        metrics.reset()
+        util.drop('a')
+        cfg.clean()
+
+    def test_snapshot(self):
+        err, db_result = util.db_insert('a', [{'key1': 'a', 'key2': idx} for idx in range(3)])
+        self.assertIsNone(err)
+
+        err, db_results = util.db_find('a', {'key1': 'a'})
+        self.assertIsNone(err)
+
+        err, db_result = util.db_update('a', {'key1': 'a'}, {'key3': 'c'})
+        self.assertIsNone(err)
+
+        err, db_result = util.db_insert('a', [])
+        self.assertIsNotNone(err)
+
+        the_snapshot = metrics.snapshot()
+        self.assertEqual(2, the_snapshot['a']['db_insert']['calls'])
+        self.assertEqual(1, the_snapshot['a']['db_insert']['errors'])
+        self.assertEqual(3, the_snapshot['a']['db_insert']['n_docs'])
+        self.assertEqual(3, the_snapshot['a']['db_find']['n_docs'])
+        self.assertEqual(1, the_snapshot['a']['db_find_it']['calls'])
+        self.assertEqual(3, the_snapshot['a']['db_update']['n_docs'])
+        self.assertEqual(2, the_snapshot['a']['db_insert']['latency']['buckets'][-1][1])
+
+        text = metrics.to_prometheus()
+        self.assertIn('pyutil_mongo_calls_total{collection="a",op="db_insert"} 2', text)
+        self.assertIn('pyutil_mongo_latency_seconds_bucket{collection="a",op="db_insert",le="+Inf"} 2', text)
+
+    def test_hook(self):
+        events = []
+        metrics.add_hook(events.append)
+
+        err, db_result = util.db_find_one('a', {'key1': 'a'})
+        self.assertIsNone(err)
+
+        metrics.remove_hook(events.append)
+
+        err, db_result = util.db_find_one('a', {'key1': 'a'})
+
+        self.assertEqual(1, len(events))
+        self.assertEqual('db_find_one', events[0]['op'])
+        self.assertEqual({'key1': 'a'}, events[0]['params']['key'])
+        self.assertIsNone(events[0]['err'])
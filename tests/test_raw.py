@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import unittest.mock
+import logging
+import io
+import json
+
+import bson
+import bson.raw_bson
+
+from pyutil_mongo import cfg
+from pyutil_mongo import util
+from pyutil_mongo import cache
+from pyutil_mongo import raw
+import mongomock
+
+
+class _RawCollection(object):
+    """mongomock does not support RawBSONDocument as document_class
+    """
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def find_one(self, *args, **kwargs):
+        doc = self._collection.find_one(*args, **kwargs)
+        if doc is None:
+            return None
+        return bson.raw_bson.RawBSONDocument(bson.encode(doc))
+
+    def find(self, *args, **kwargs):
+        return (bson.raw_bson.RawBSONDocument(bson.encode(each)) for each in self._collection.find(*args, **kwargs))
+
+
+def _find_raw_batches(self, filter=None, projection=None, batch_size=0):
+    docs = [bson.encode(each) for each in self.find(filter, projection=projection)]
+    return (b''.join(docs[idx:(idx + batch_size)]) for idx in range(0, len(docs), batch_size))
+
+
+class TestRaw(unittest.TestCase):
+
+    @mongomock.patch(servers=(('localhost', 27017),))
+    def setUp(self):
+        self.logger = logging.getLogger('test')
+        collection_map = {
+            'a': 'b',
+        }
+        mongo_map = cfg.MongoMap(collection_map)
+
+        err = cfg.init(self.logger, [mongo_map])
+
+        err, db_result = util.db_insert('a', [{'key1': 'a', 'key2': {'key3': idx}} for idx in range(3)])
+
+    def tearDown(self):
+        cache.disable()
+        util.drop('a')
+        cfg.clean()
+
+    def test_db_find_raw(self):
+        cache.enable()
+
+        with unittest.mock.patch.object(mongomock.collection.Collection, 'with_options', new=lambda self, **kwargs: _RawCollection(self)):
+            err, db_result = util.db_find_one('a', {'key2.key3': 1}, is_raw=True)
+            self.assertIsNone(err)
+            self.assertIsInstance(db_result, bson.raw_bson.RawBSONDocument)
+            self.assertEqual(1, util._get_value(db_result, 'key2.key3'))
+
+            err, db_results = util.db_find('a', {'key1': 'a'}, is_raw=True)
+            self.assertIsNone(err)
+            self.assertEqual(3, len(db_results))
+            self.assertTrue(all([isinstance(each, bson.raw_bson.RawBSONDocument) for each in db_results]))
+
+        self.assertEqual(0, cache.stats()['size'])
+
+        f = io.BytesIO()
+        err, n_docs = raw.write_bson(db_results, f)
+        self.assertIsNone(err)
+        self.assertEqual(3, n_docs)
+        self.assertEqual([{'key1': 'a', 'key2': {'key3': idx}} for idx in range(3)], bson.decode_all(f.getvalue()))
+
+        f = io.StringIO()
+        err, n_docs = raw.write_jsonl(db_results, f)
+        self.assertIsNone(err)
+        self.assertEqual([{'key1': 'a', 'key2': {'key3': idx}} for idx in range(3)], [json.loads(each) for each in f.getvalue().splitlines()])
+
+    def test_db_find_raw_batches(self):
+        with unittest.mock.patch.object(mongomock.collection.Collection, 'find_raw_batches', new=_find_raw_batches, create=True):
+            batches = []
+            for err, batch in util.db_find_raw_batches('a', {'key1': 'a'}, batch_size=2):
+                self.assertIsNone(err)
+                batches.append(batch)
+
+        self.assertEqual(2, len(batches))
+        docs = [each for batch in batches for each in raw.iter_raw_batch(batch)]
+        self.assertEqual([0, 1, 2], [util._get_value(each, 'key2.key3') for each in docs])
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import unittest.mock
+import logging
+
+import pymongo.errors
+
+from pyutil_mongo import cfg
+from pyutil_mongo import util
+from pyutil_mongo import breaker
+from pyutil_mongo import metrics
+from pyutil_mongo import retry
+import mongomock
+
+
+class TestRetry(unittest.TestCase):
+
+    @mongomock.patch(servers=(('localhost', 27017),))
+    def setUp(self):
+        self.logger = logging.getLogger('test')
+        collection_map = {
+            'a': 'b',
+        }
+        mongo_map = cfg.MongoMap(collection_map, retry_policy=retry.RetryPolicy(max_attempts=3, base_backoff=0.0))
+
+        err = cfg.init(self.logger, [mongo_map])
+
+        breaker.reset()
+        metrics.reset()
+        metrics.enable()
+
+    def tearDown(self):
+        metrics.disable()
+        metrics.reset()
+        breaker.reset()
+        util.drop('a')
+        cfg.clean()
+
+    @mongomock.patch(servers=(('localhost', 27017),))
+    def test_db_find_one(self):
+        with unittest.mock.patch.object(mongomock.collection.Collection, 'find_one', side_effect=[pymongo.errors.AutoReconnect('connection closed'), {'key1': 'a'}]) as mock_find_one, \
+                unittest.mock.patch.object(cfg, 'restart_mongo', return_value=None) as mock_restart_mongo:
+            err, db_result = util.db_find_one('a', {'key1': 'a'})
+            self.assertIsNone(err)
+            self.assertEqual({'key1': 'a'}, db_result)
+            self.assertEqual(1, retry.last_retries())
+            self.assertEqual(2, mock_find_one.call_count)
+            self.assertEqual(1, mock_restart_mongo.call_count)
+
+        self.assertEqual(1, metrics.snapshot()['a']['db_find_one']['retries'])
+
+    @mongomock.patch(servers=(('localhost', 27017),))
+    def test_db_find_one_max_attempts(self):
+        with unittest.mock.patch.object(mongomock.collection.Collection, 'find_one', side_effect=pymongo.errors.AutoReconnect('connection closed')) as mock_find_one, \
+                unittest.mock.patch.object(cfg, 'restart_mongo', return_value=None) as mock_restart_mongo:
+            err, db_result = util.db_find_one('a', {'key1': 'a'}, retry_policy=retry.RetryPolicy(max_attempts=2, base_backoff=0.0))
+            self.assertIsInstance(err, pymongo.errors.AutoReconnect)
+            self.assertEqual(1, retry.last_retries())
+            self.assertEqual(2, mock_find_one.call_count)
+            self.assertEqual(1, mock_restart_mongo.call_count)
+
+        breaker.reset()
+        with unittest.mock.patch.object(mongomock.collection.Collection, 'find', side_effect=pymongo.errors.AutoReconnect('connection closed')), \
+                unittest.mock.patch.object(cfg, 'restart_mongo', return_value=None) as mock_restart_mongo:
+            err, db_result = util.db_find('a', {'key1': 'a'}, retry_policy=retry.RetryPolicy(max_attempts=1))
+            self.assertIsInstance(err, pymongo.errors.AutoReconnect)
+            self.assertEqual(0, retry.last_retries())
+            self.assertEqual(1, mock_restart_mongo.call_count)
+
+    @mongomock.patch(servers=(('localhost', 27017),))
+    def test_db_find(self):
+        err, db_result = util.db_insert('a', [{'key1': 'a', 'key2': idx} for idx in range(3)])
+        self.assertIsNone(err)
+
+        find = mongomock.collection.Collection.find
+        n_calls = []
+
+        def _find(self, *args, **kwargs):
+            n_calls.append(1)
+            if len(n_calls) == 1:
+                raise pymongo.errors.AutoReconnect('connection closed')
+            return find(self, *args, **kwargs)
+
+        with unittest.mock.patch.object(mongomock.collection.Collection, 'find', autospec=True, side_effect=_find), \
+                unittest.mock.patch.object(cfg, 'restart_mongo', return_value=None):
+            err, db_results = util.db_find('a', {'key1': 'a'})
+            self.assertIsNone(err)
+            self.assertEqual(3, len(db_results))
+            self.assertEqual(1, retry.last_retries())
+
+    @mongomock.patch(servers=(('localhost', 27017),))
+    def test_db_update_not_idempotent(self):
+        with unittest.mock.patch.object(mongomock.collection.Collection, 'update_many', side_effect=pymongo.errors.AutoReconnect('connection closed')) as mock_update_many, \
+                unittest.mock.patch.object(cfg, 'restart_mongo', return_value=None):
+            err, db_result = util.db_update('a', {'key1': 'a'}, {'$inc': {'key2': 1}}, is_set=False)
+            self.assertIsNotNone(err)
+            self.assertEqual(1, mock_update_many.call_count)
+
+            err, db_result = util.db_update('a', {'key1': 'a'}, {'key2': 1})
+            self.assertIsNotNone(err)
+            self.assertEqual(4, mock_update_many.call_count)
+
+    def test_not_retryable(self):
+        with unittest.mock.patch.object(mongomock.collection.Collection, 'find_one', side_effect=pymongo.errors.OperationFailure('bad value', code=2)) as mock_find_one:
+            err, db_result = util.db_find_one('a', {'key1': 'a'})
+            self.assertIsNotNone(err)
+            self.assertEqual(0, retry.last_retries())
+            self.assertEqual(1, mock_find_one.call_count)
+
+    @mongomock.patch(servers=(('localhost', 27017),))
+    def test_db_max_find_batches(self):
+        err, db_result = util.db_insert('a', [{'key1': 'a', 'key2': idx} for idx in range(3)])
+        self.assertIsNone(err)
+
+        find = mongomock.collection.Collection.find
+        n_calls = []
+
+        def _find(self, *args, **kwargs):
+            n_calls.append(1)
+            if len(n_calls) % 2:
+                raise pymongo.errors.AutoReconnect('connection closed')
+            return find(self, *args, **kwargs)
+
+        with unittest.mock.patch.object(mongomock.collection.Collection, 'find', autospec=True, side_effect=_find), \
+                unittest.mock.patch.object(cfg, 'restart_mongo', return_value=None):
+            err, db_result = util.db_max('a', 'key2', {'key1': 'a'})
+            self.assertIsNone(err)
+            self.assertEqual(2, db_result)
+            self.assertEqual(1, retry.last_retries())
+
+            batches = list(util.db_find_batches('a', {'key1': 'a'}, batch_size=2))
+            self.assertEqual([None, None], [each_err for each_err, _ in batches])
+            self.assertEqual([2, 1], [len(each) for _, each in batches])
+            self.assertEqual(4, len(n_calls))
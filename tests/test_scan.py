@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import logging
+import threading
+
+from pyutil_mongo import cfg
+from pyutil_mongo import util
+from pyutil_mongo import scan
+import mongomock
+
+
+class TestScan(unittest.TestCase):
+
+    @mongomock.patch(servers=(('localhost', 27017),))
+    def setUp(self):
+        self.logger = logging.getLogger('test')
+        collection_map = {
+            'a': 'b',
+        }
+        mongo_map = cfg.MongoMap(collection_map)
+
+        err = cfg.init(self.logger, [mongo_map])
+
+        err, db_result = util.db_insert('a', [{'key1': idx % 3, 'key2': idx} for idx in range(100)])
+
+    def tearDown(self):
+        util.drop('a')
+        cfg.clean()
+
+    def test_db_scan_ranges(self):
+        err, ranges = scan.db_scan_ranges('a', key='key2', n_ranges=4)
+        self.assertIsNone(err)
+        self.assertEqual(4, len(ranges))
+        self.assertIsNone(ranges[0][0])
+        self.assertIsNone(ranges[-1][1])
+        for idx in range(len(ranges) - 1):
+            self.assertEqual(ranges[idx][1], ranges[idx + 1][0])
+
+    def test_db_parallel_scan(self):
+        lock = threading.Lock()
+        values = []
+
+        def _callback(range_idx, docs):
+            with lock:
+                values.extend([each['key2'] for each in docs])
+
+        err, state = scan.db_parallel_scan('a', _callback, query={'key1': 0}, n_ranges=4, batch_size=7)
+        self.assertIsNone(err)
+        self.assertEqual(list(range(0, 100, 3)), sorted(values))
+        self.assertEqual(34, state['n_docs'])
+        self.assertEqual(list(range(len(state['ranges']))), state['completed'])
+
+        # resume
+        values = []
+        state['completed'] = state['completed'][1:]
+        err, state = scan.db_parallel_scan('a', _callback, query={'key1': 0}, state=state)
+        self.assertIsNone(err)
+        self.assertEqual(list(range(len(state['ranges']))), state['completed'])
+        self.assertTrue(0 < len(values) < 34)
+
+    def test_db_parallel_scan_it(self):
+        results = list(scan.db_parallel_scan_it('a', n_ranges=4, batch_size=10))
+        err, state = results[-1]
+        self.assertIsNone(err)
+        self.assertEqual(100, state['n_docs'])
+
+        values = sorted([each['key2'] for _, docs in results[:-1] for each in docs])
+        self.assertEqual(list(range(100)), values)
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import logging
+
+from pyutil_mongo import cfg
+from pyutil_mongo import util
+from pyutil_mongo import slowlog
+import mongomock
+
+
+class TestSlowlog(unittest.TestCase):
+
+    @mongomock.patch(servers=(('localhost', 27017),))
+    def setUp(self):
+        self.logger = logging.getLogger('test')
+        collection_map = {
+            'a': 'b',
+        }
+        mongo_map = cfg.MongoMap(collection_map)
+
+        err = cfg.init(self.logger, [mongo_map])
+
+        slowlog.reset()
+        slowlog.enable(the_threshold_ms=0)
+
+    def tearDown(self):
+        slowlog.disable()
+        slowlog.reset()
+        util.drop('a')
+        cfg.clean()
+
+    def test_get_shape(self):
+        shape = slowlog.get_shape({'key1': 'a', 'key2': {'$in': [1, 2, 3]}, '$or': [{'key3': 1}, {'key4': {'$gt': 2}}]})
+        self.assertEqual({'key1': '?', 'key2': {'$in': '?'}, '$or': [{'key3': '?'}, {'key4': {'$gt': '?'}}]}, shape)
+
+        shape = slowlog.get_shape([{'$match': {'key1': 'a'}}, {'$group': {'_id': {'key1': '$key1'}, 'key2': {'$sum': '$key2'}}}])
+        self.assertEqual([{'$match': {'key1': '?'}}, {'$group': {'_id': {'key1': '$key1'}, 'key2': {'$sum': '$key2'}}}], shape)
+
+    def test_report(self):
+        for idx in range(3):
+            util.db_find_one('a', {'key1': idx})
+        util.db_find_one('a', {'key2': 'a'})
+
+        results = slowlog.report(sort_by='count')
+        self.assertEqual(2, len(results))
+        self.assertEqual('db_find_one', results[0]['op'])
+        self.assertEqual('{"key1": "?"}', results[0]['shape'])
+        self.assertEqual(3, results[0]['count'])
+        self.assertEqual(3, results[0]['n_slow'])
+
+        self.assertIn('{"key2": "?"}', slowlog.format_report())
+
+    def test_report_extreme_nested(self):
+        util.db_max('a', 'key2', {'key1': 'a'})
+        util.db_max('a', 'key2', {'key3': {'$gt': 1}})
+        util.db_find('a', {'key1': 'a'})
+
+        results = slowlog.report(sort_by='count')
+        self.assertEqual([('db_find', '{"key1": "?"}'), ('db_max', '{"key1": "?"}'), ('db_max', '{"key3": {"$gt": "?"}}')], sorted([(each['op'], each['shape']) for each in results]))
@@ -72,6 +72,26 @@ class TestUtil(unittest.TestCase):
         self.assertIsNone(err)
         self.assertIsInstance(db_result, Cursor)
 
+    def test_db_find_batches(self):
+        err, db_result = util.db_insert('a', [{'key1': 'a', 'key2': idx} for idx in range(5)])
+        self.assertIsNone(err)
+
+        db_results = list(util.db_find_batches('a', {'key1': 'a'}, batch_size=2))
+        self.assertEqual([None, None, None], [each_err for each_err, _ in db_results])
+        self.assertEqual([[0, 1], [2, 3], [4]], [[each['key2'] for each in each_results] for _, each_results in db_results])
+
+        db_results = list(util.db_find_batches('a', {'key1': 'a'}, batch_size=2, max_docs=3))
+        self.assertEqual(2, len(db_results))
+        self.assertIsNone(db_results[0][0])
+        self.assertIsNotNone(db_results[1][0])
+
+        db_results = list(util.db_find_batches('a', {'key1': 'a'}, batch_size=10, max_bytes=1))
+        self.assertEqual(5, len(db_results))
+
+        db_results = list(util.db_find_batches('c', {'key1': 'a'}))
+        self.assertEqual(1, len(db_results))
+        self.assertIsNotNone(db_results[0][0])
+
     def test_db_insert(self):
         err, db_result = util.db_remove('a', {'key1': 'a'})
         self.assertIsNone(err)
@@ -128,6 +148,24 @@ class TestUtil(unittest.TestCase):
         self.assertEqual(1, len(db_results))
         self.assertEqual([{'key1': 'a', 'key2': 'c'}], db_results)
 
+    def test_db_bulk_update_chunk(self):
+        update_data = [{'key': {'key1': 'a%s' % (idx)}, 'val': {'key2': idx}} for idx in range(10)]
+
+        progresses = []
+        err, db_result = util.db_bulk_update('a', update_data, chunk_size=3, max_workers=2, progress=lambda n_done, n_chunks: progresses.append((n_done, n_chunks)))
+        self.assertIsNone(err)
+        self.assertEqual(10, db_result['nUpserted'])
+        self.assertEqual(list(range(10)), sorted([each['index'] for each in db_result['upserted']]))
+        self.assertEqual([], db_result['chunkErrors'])
+        self.assertEqual([(1, 4), (2, 4), (3, 4), (4, 4)], progresses)
+
+        # not mutated
+        self.assertEqual({'key2': 0}, update_data[0]['val'])
+
+        err, db_results = util.db_find('a', {'key2': {'$gte': 0}})
+        self.assertIsNone(err)
+        self.assertEqual(10, len(db_results))
+
     def test_db_update(self):
         err, db_result = util.db_remove('a', {'key1': 'a'})
         self.assertIsNone(err)
@@ -160,6 +198,22 @@ class TestUtil(unittest.TestCase):
         self.assertEqual(2, len(db_results))
         self.assertEqual(['b', 'c'], db_results)
 
+    def test_db_distinct_iter(self):
+        err, db_result = util.db_insert('a', [{'key1': 'a', 'key2': 'b'}, {'key1': 'a', 'key2': ['b', 'd']}, {'key1': 'a', 'key2': 'c'}, {'key1': 'b', 'key2': 'e'}])
+        self.assertIsNone(err)
+
+        err, db_result_it = util.db_distinct_iter('a', 'key2', {'key1': 'a'})
+        self.assertIsNone(err)
+        self.assertEqual(['b', 'c', 'd'], sorted(db_result_it))
+
+        # null / missing as None (as distinct).
+        err, db_result = util.db_insert('a', [{'key1': 'c', 'key2': None}, {'key1': 'c'}, {'key1': 'c', 'key2': 'f'}])
+        self.assertIsNone(err)
+
+        err, db_result_it = util.db_distinct_iter('a', 'key2', {'key1': 'c'})
+        self.assertIsNone(err)
+        self.assertEqual(['f', None], sorted(db_result_it, key=lambda x: (x is None, x)))
+
     def test_db_set_if_not_exists(self):
         err, db_result = util.db_remove('a', {'key1': 'a'})
         self.assertIsNone(err)
@@ -192,6 +246,37 @@ class TestUtil(unittest.TestCase):
         err, db_results = util.db_aggregate_parse_results(db_results)
         self.assertEqual([{'key1': 'a', 'key2': 6}], db_results)
 
+    def test_db_aggregate_parse_iter(self):
+        err, db_result = util.db_insert('a', [{'key1': 'a', 'key2': 1}, {'key1': 'a', 'key2': 2}, {'key1': 'b', 'key2': 3}])
+        self.assertIsNone(err)
+
+        pipe = [{'$group': {'_id': {'key1': '$key1'}, 'key2': {'$sum': '$key2'}}}, {'$sort': {'_id.key1': 1}}]
+        err, db_result_it = util.db_aggregate_iter('a', pipe)
+        self.assertIsNone(err)
+
+        results = list(util.db_aggregate_parse_iter(db_result_it))
+        self.assertEqual([(None, {'key1': 'a', 'key2': 3}), (None, {'key1': 'b', 'key2': 3})], results)
+
+        db_result = {'_id': {'key1': 'a', 'key2': 'b'}, 'key2': 3}
+        err, result = util.db_aggregate_parse_result(db_result, on_collision='keep')
+        self.assertIsNone(err)
+        self.assertEqual({'key1': 'a', 'key2': 3}, result)
+        self.assertEqual({'_id': {'key1': 'a', 'key2': 'b'}, 'key2': 3}, db_result)
+
+        err, result = util.db_aggregate_parse_result(db_result, on_collision='error')
+        self.assertIsNotNone(err)
+
+        err, result = util.db_aggregate_parse_result({'_id': 'a', 'key2': 3})
+        self.assertIsNotNone(err)
+
+        err, result = util.db_aggregate_parse_result({'_id': 'a', 'key2': 3}, non_dict_id='keep')
+        self.assertIsNone(err)
+        self.assertEqual({'_id': 'a', 'key2': 3}, result)
+
+        err, results = util.db_aggregate_parse_results([{'_id': 'a', 'key2': 3}, {'_id': 'b'}], non_dict_id='drop')
+        self.assertIsNone(err)
+        self.assertEqual([{'key2': 3}, {}], results)
+
     def test_db_max(self):
         err, db_result = util.db_remove('a', {'key1': 'a'})
         self.assertIsNone(err)
@@ -203,6 +288,35 @@ class TestUtil(unittest.TestCase):
         self.assertIsNone(err)
         self.assertEqual(3, db_result)
 
+    def test_db_min(self):
+        err, db_result = util.db_insert('a', [{'key1': 'a', 'key2': 1}, {'key1': 'a', 'key2': 2}, {'key1': 'a'}])
+        self.assertIsNone(err)
+
+        err, db_result = util.db_min('a', 'key2', {'key1': 'a'})
+        self.assertIsNone(err)
+        self.assertEqual(1, db_result)
+
+        err, db_result = util.db_min('a', 'key2', {'key1': 'a'}, group_columns=['key1'])
+        self.assertIsNone(err)
+        self.assertEqual(1, db_result)
+
+        err, db_result = util.db_min('a', 'key2', {'key1': 'b'})
+        self.assertIsNotNone(err)
+
+    def test_db_max_many(self):
+        err, db_result = util.db_insert('a', [{'key1': 'a', 'key2': 1}, {'key1': 'a', 'key2': 2}, {'key1': 'b', 'key2': 3}])
+        self.assertIsNone(err)
+
+        err, db_results = util.db_max_many('a', 'key2', {}, group_columns=['key1'])
+        self.assertIsNone(err)
+        db_results.sort(key=lambda x: x['key1'])
+        self.assertEqual([{'key1': 'a', 'max': 2}, {'key1': 'b', 'max': 3}], db_results)
+
+        err, db_results = util.db_min_many('a', 'key2', {}, group_columns=['key1'])
+        self.assertIsNone(err)
+        db_results.sort(key=lambda x: x['key1'])
+        self.assertEqual([{'key1': 'a', 'min': 1}, {'key1': 'b', 'min': 3}], db_results)
+
     def test__flatten_results_with_err(self):
         results_with_err = [(Exception('err0'), {}), (Exception('err1'), {})]
 
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import logging
+import gc
+import time
+import weakref
+
+from pyutil_mongo import cfg
+from pyutil_mongo import util
+from pyutil_mongo import writebehind
+import mongomock
+
+
+class TestWriteBehind(unittest.TestCase):
+
+    @mongomock.patch(servers=(('localhost', 27017),))
+    def setUp(self):
+        self.logger = logging.getLogger('test')
+        collection_map = {
+            'a': 'b',
+        }
+        mongo_map = cfg.MongoMap(collection_map)
+
+        err = cfg.init(self.logger, [mongo_map])
+
+    def tearDown(self):
+        util.drop('a')
+        cfg.clean()
+
+    def test_flush(self):
+        buffer = writebehind.WriteBuffer('a', flush_interval=60.0)
+
+        self.assertIsNone(buffer.update({'key1': 'a'}, {'key2': 1}, inc={'count': 1}))
+        self.assertIsNone(buffer.update({'key1': 'a'}, {'key3': 'c'}, inc={'count': 2}))
+        self.assertIsNone(buffer.update({'key1': 'a'}, inc={'key2': 10}))
+        self.assertIsNone(buffer.update({'key1': 'b'}, inc={'count': 5}))
+        self.assertEqual(2, len(buffer))
+
+        err, db_result = buffer.flush()
+        self.assertIsNone(err)
+        self.assertEqual(2, db_result['nUpserted'])
+        self.assertEqual(0, len(buffer))
+
+        err, db_results = util.db_find('a', {})
+        self.assertIsNone(err)
+        self.assertEqual([{'key1': 'a', 'key2': 11, 'key3': 'c', 'count': 3}, {'key1': 'b', 'count': 5}], db_results)
+
+        self.assertIsNone(buffer.update({'key1': 'b'}, inc={'count': 1}))
+        err, db_result = buffer.close()
+        self.assertIsNone(err)
+        self.assertEqual(1, db_result['nModified'])
+
+        err, db_result = util.db_find_one('a', {'key1': 'b'})
+        self.assertEqual({'key1': 'b', 'count': 6}, db_result)
+
+        self.assertIsNotNone(buffer.update({'key1': 'b'}, inc={'count': 1}))
+
+    def test_merge_non_numeric(self):
+        buffer = writebehind.WriteBuffer('a', flush_interval=60.0)
+
+        self.assertIsNone(buffer.update({'key1': 'a'}, {'n': 'x', 'm': 1}))
+        self.assertIsNotNone(buffer.update({'key1': 'a'}, inc={'m': 1, 'n': 1}))
+        self.assertIsNotNone(buffer.update({'key1': 'b'}, inc={'n': 'x'}))
+        self.assertEqual(1, len(buffer))
+
+        err, db_result = buffer.close()
+        self.assertIsNone(err)
+
+        err, db_results = util.db_find('a', {})
+        self.assertEqual([{'key1': 'a', 'n': 'x', 'm': 1}], db_results)
+
+    def test_flush_size(self):
+        with writebehind.WriteBuffer('a', flush_size=2, flush_interval=60.0) as buffer:
+            self.assertIsNone(buffer.update({'key1': 'a'}, {'key2': 1}))
+            self.assertIsNone(buffer.update({'key1': 'b'}, {'key2': 2}))
+
+            for _ in range(100):
+                if not len(buffer):
+                    break
+                time.sleep(0.01)
+            self.assertEqual(0, len(buffer))
+
+        err, db_results = util.db_find('a', {})
+        self.assertEqual(2, len(db_results))
+
+    def test_backpressure(self):
+        buffer = writebehind.WriteBuffer('a', flush_size=10, flush_interval=60.0, max_keys=1, block_timeout=0.05)
+
+        self.assertIsNone(buffer.update({'key1': 'a'}, {'key2': 1}))
+        self.assertIsNone(buffer.update({'key1': 'a'}, {'key2': 2}))
+        self.assertIsNotNone(buffer.update({'key1': 'b'}, {'key2': 1}))
+
+        err, db_result = buffer.close()
+        self.assertIsNone(err)
+
+        err, db_results = util.db_find('a', {})
+        self.assertEqual([{'key1': 'a', 'key2': 2}], db_results)
+
+    def test_not_closed_freed(self):
+        buffer = writebehind.WriteBuffer('a', flush_interval=0.05)
+        self.assertIsNone(buffer.update({'key1': 'a'}, {'key2': 1}))
+        thread = buffer._thread
+
+        buffer_ref = weakref.ref(buffer)
+        del buffer
+
+        # flushed in the background, then freed.
+        thread.join(5.0)
+        self.assertFalse(thread.is_alive())
+        gc.collect()
+        self.assertIsNone(buffer_ref())
+
+        err, db_results = util.db_find('a', {})
+        self.assertEqual([{'key1': 'a', 'key2': 1}], db_results)